@@ -21,10 +21,21 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 
+import os
+from functools import cache
 from pathlib import Path
+from typing import Self
 
+import numpy as np
 import pandas as pd
-from pydantic import BaseModel, DirectoryPath, FilePath, model_validator
+from pydantic import (
+    BaseModel,
+    ConfigDict,
+    DirectoryPath,
+    Field,
+    FilePath,
+    model_validator,
+)
 
 
 class DefaultPaths(BaseModel):
@@ -33,6 +44,10 @@ class DefaultPaths(BaseModel):
     Attributes:
         dirpath_ms2deepscore_pos: points towards default ms2deepscore dir
         url_ms2deepscore_pos: the url to download the default ms2deepscore file
+        dirpath_embedding_cache: points towards the ms2deepscore embedding cache dir,
+            overridden by the FERMO_EMBEDDING_CACHE environment variable
+        max_mb_embedding_cache: the max. size of the embedding cache dir in MB,
+            overridden by the FERMO_EMBEDDING_CACHE_MAX_MB environment variable
         dirpath_losses: point towards neutral loss dir
         dirpath_frags: point towards fragment dir
         library_mibig_pos: points towards mibig spectral library for positive ion mode
@@ -45,6 +60,19 @@ class DefaultPaths(BaseModel):
         "https://zenodo.org/records/8274763/files/"
         "ms2deepscore_positive_10k_1000_1000_1000_500.hdf5?download=1"
     )
+    dirpath_embedding_cache: Path = Field(
+        default_factory=lambda: Path(
+            os.environ.get(
+                "FERMO_EMBEDDING_CACHE",
+                Path(__file__).parent.parent.joinpath("libraries/ms2deepscore/cache"),
+            )
+        )
+    )
+    max_mb_embedding_cache: int = Field(
+        default_factory=lambda: int(
+            os.environ.get("FERMO_EMBEDDING_CACHE_MAX_MB", 2048)
+        )
+    )
     dirpath_losses: DirectoryPath = Path(__file__).parent.parent.joinpath(
         "libraries/loss_libs/"
     )
@@ -240,3 +268,118 @@ class CharFragments(BaseModel):
                 )
             )
         return self
+
+
+class MassLibrary(BaseModel):
+    """A Pydantic-based class for storing reference masses as sorted arrays
+
+    Attributes:
+        ctgrs: the category names, in the order of the category index
+        mass: the reference masses in ascending order
+        ctgr: the category index per mass
+        idx: the position of the mass in the file-ordered entries of its category
+        descr: the description per mass
+        abbr: the abbreviation per mass
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    ctgrs: tuple
+    mass: np.ndarray
+    ctgr: np.ndarray
+    idx: np.ndarray
+    descr: np.ndarray
+    abbr: np.ndarray
+
+    @classmethod
+    def from_frames(cls, frames: dict[str, pd.DataFrame]) -> Self:
+        """Create a MassLibrary from per-category DataFrames
+
+        Arguments:
+            frames: category name: DataFrame with columns 'mass', 'descr', 'abbr'
+
+        Returns:
+            A MassLibrary instance sorted by mass
+        """
+        df = pd.concat(
+            [
+                frame.assign(ctgr=i, idx=np.arange(len(frame)))
+                for i, frame in enumerate(frames.values())
+            ],
+            ignore_index=True,
+        )
+        order = np.argsort(df["mass"].to_numpy(dtype=float), kind="stable")
+        df = df.iloc[order]
+        return cls(
+            ctgrs=tuple(frames.keys()),
+            mass=df["mass"].to_numpy(dtype=float),
+            ctgr=df["ctgr"].to_numpy(dtype=int),
+            idx=df["idx"].to_numpy(dtype=int),
+            descr=df["descr"].to_numpy(dtype=object),
+            abbr=df["abbr"].to_numpy(dtype=object),
+        )
+
+    def select(self: Self, ctgrs: tuple[str, ...]) -> Self:
+        """Restrict the library to categories, in the given order of categories
+
+        Arguments:
+            ctgrs: a tuple of category names
+
+        Returns:
+            A new MassLibrary instance with category indices referring to ctgrs
+        """
+        remap = np.full(len(self.ctgrs), -1, dtype=int)
+        for i, ctgr in enumerate(ctgrs):
+            remap[self.ctgrs.index(ctgr)] = i
+        mask = remap[self.ctgr] != -1
+        return MassLibrary(
+            ctgrs=ctgrs,
+            mass=self.mass[mask],
+            ctgr=remap[self.ctgr[mask]],
+            idx=self.idx[mask],
+            descr=self.descr[mask],
+            abbr=self.abbr[mask],
+        )
+
+
+@cache
+def load_neutral_losses() -> MassLibrary:
+    """Read the NeutralLosses reference files once per process
+
+    Returns:
+        A MassLibrary with the NeutralLosses attribute names as categories
+    """
+    frames = {}
+    for ctgr in (
+        "ribosomal",
+        "nonribo",
+        "glycoside",
+        "gen_bio_pos",
+        "gen_other_pos",
+        "gen_other_neg",
+    ):
+        df = pd.read_csv(NeutralLosses.model_fields[f"{ctgr}_src"].default)
+        frames[ctgr] = pd.DataFrame(
+            {"mass": df["loss"], "descr": df["descr"], "abbr": df["abbr"]}
+        )
+    return MassLibrary.from_frames(frames)
+
+
+@cache
+def load_char_fragments() -> MassLibrary:
+    """Read the CharFragments reference file once per process
+
+    Returns:
+        A MassLibrary with the CharFragments attribute names as categories
+
+    Notes:
+        Entries are ordered as in CharFragments: y2 followed by b2 per row.
+    """
+    df = pd.read_csv(CharFragments.model_fields["aa_frags_src"].default)
+    mass = np.column_stack((df["y2"], df["b2"])).ravel()
+    descr = np.column_stack(
+        (df["pair"] + "(y2, [M+H]+)", df["pair"] + "(b2, [M+H]+)")
+    ).ravel()
+    return MassLibrary.from_frames(
+        {"aa_frags": pd.DataFrame({"mass": mass, "descr": descr, "abbr": ""})}
+    )
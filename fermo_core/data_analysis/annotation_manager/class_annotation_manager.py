@@ -23,7 +23,7 @@ SOFTWARE.
 
 import logging
 from pyexpat import features
-from typing import Self
+from typing import Any, Optional, Self
 
 from pydantic import BaseModel
 
@@ -34,6 +34,9 @@ from fermo_core.data_analysis.annotation_manager.class_adduct_annotator import (
 from fermo_core.data_analysis.annotation_manager.class_fragment_annotator import (
     FragmentAnnotator,
 )
+from fermo_core.data_analysis.annotation_manager.class_library_source import (
+    LibrarySource,
+)
 from fermo_core.data_analysis.annotation_manager.class_mod_cos_annotator import (
     ModCosAnnotator,
 )
@@ -52,6 +55,7 @@ from fermo_core.data_analysis.annotation_manager.class_neutral_loss_annotator im
 from fermo_core.data_processing.class_repository import Repository
 from fermo_core.data_processing.class_stats import Stats
 from fermo_core.input_output.class_parameter_manager import ParameterManager
+from fermo_core.utils.class_spectrum_deduplicator import SpectrumDeduplicator
 from fermo_core.utils.utility_method_manager import UtilityMethodManager
 
 logger = logging.getLogger("fermo_core")
@@ -96,18 +100,9 @@ class AnnotationManager(BaseModel):
         def _eval_ms2query_results_file() -> bool:
             return True if self.params.MS2QueryResultsParameters else False
 
-        def _eval_as_results_file() -> bool:
-            return True if self.params.AsResultsParameters else False
+        self.run_library_matching()
 
         modules = (
-            (
-                self.params.SpectralLibMatchingCosineParameters,
-                self.run_user_lib_mod_cosine_matching,
-            ),
-            (
-                self.params.SpectralLibMatchingDeepscoreParameters,
-                self.run_user_lib_ms2deepscore_matching,
-            ),
             (
                 self.params.AdductAnnotationParameters,
                 self.run_feature_adduct_annotation,
@@ -135,14 +130,6 @@ class AnnotationManager(BaseModel):
                 _eval_ms2query_results_file(),
                 self.run_ms2query_results_assignment,
             ),
-            (
-                _eval_as_results_file(),
-                self.run_as_kcb_cosine_annotation,
-            ),
-            (
-                _eval_as_results_file(),
-                self.run_as_kcb_deepscore_annotation,
-            ),
         )
         for module in modules:
             if module[0]:
@@ -172,81 +159,238 @@ class AnnotationManager(BaseModel):
         else:
             return True
 
-    def run_user_lib_mod_cosine_matching(self: Self):
-        """Match features against a user-provided spectral library using mod cosine."""
-        logger.info(
-            "'AnnotationManager': started matching of features against a "
-            "user-provided spectral library using the modified cosine algorithm."
-        )
+    def prepare_as_kcb_library(self: Self) -> tuple[Optional[dict], Optional[list]]:
+        """Extract the antiSMASH KnownClusterBlast results and their MIBiG library
 
-        if not self.verify_user_lib_params():
-            return
+        Returns:
+            A tuple of the KCB results and the MIBiG spectral library, or (None, None)
+        """
+        if not self.params.AsResultsParameters:
+            return None, None
+
+        if self.params.PeaktableParameters.polarity == "negative":
+            logger.warning(
+                "'AnnotationManager': negative ion mode detected. antiSMASH "
+                "KnownClusterBlast result annotation only available for positive ion "
+                "mode - SKIP"
+            )
+            return None, None
+
+        for params, name in (
+            (self.params.AsKcbCosineMatchingParams, "modified_cosine"),
+            (self.params.AsKcbDeepscoreMatchingParams, "ms2deepscore"),
+        ):
+            if not (params and params.activate_module):
+                logger.warning(
+                    f"'AnnotationManager': antiSMASH results file provided but "
+                    f"'as_kcb_matching/{name}' is turned off - SKIP"
+                )
+
+        if not any(
+            params and params.activate_module
+            for params in (
+                self.params.AsKcbCosineMatchingParams,
+                self.params.AsKcbDeepscoreMatchingParams,
+            )
+        ):
+            return None, None
 
         try:
-            mod_cosine_annotator = ModCosAnnotator(
-                features=self.features,
-                active_features=self.stats.active_features,
-                library=self.stats.spectral_library,
-                library_name=self.params.SpecLibParameters.dirpath.name,
-                fragment_tol=self.params.SpectralLibMatchingCosineParameters.fragment_tol,
-                score_cutoff=self.params.SpectralLibMatchingCosineParameters.score_cutoff,
-                min_nr_matched_peaks=self.params.SpectralLibMatchingCosineParameters.min_nr_matched_peaks,
-                max_precursor_mass_diff=self.params.SpectralLibMatchingCosineParameters.max_precursor_mass_diff,
+            kcb_results = UtilityMethodManager().extract_as_kcb_results(
+                as_results=self.params.AsResultsParameters.directory_path,
+                cutoff=self.params.AsResultsParameters.similarity_cutoff,
             )
-            mod_cosine_annotator.prepare_queries()
-            mod_cosine_annotator.calculate_scores_mod_cosine()
-            mod_cosine_annotator.extract_userlib_scores()
-            self.features = mod_cosine_annotator.return_features()
-            self.params.SpectralLibMatchingCosineParameters.module_passed = True
+            mibig_bgcs = {key for key, value in kcb_results.items()}
+            spec_library = UtilityMethodManager().create_mibig_spec_lib(mibig_bgcs)
         except Exception as e:
             logger.error(str(e))
             logger.error(
-                "'AnnotationManager': Error during running of ModCosineAnnotator - SKIP"
+                "'AnnotationManager': Error during preparation of the antiSMASH "
+                "KnownClusterBlast MIBiG library - SKIP"
             )
-            return
+            return None, None
 
-        logger.info(
-            "'AnnotationManager': completed matching of features against a "
-            "user-provided spectral library using the modified cosine algorithm."
-        )
+        return kcb_results, spec_library
 
-    def run_user_lib_ms2deepscore_matching(self: Self):
-        """Match features against user-provided spectral library using ms2deepscore."""
-        logger.info(
-            "'AnnotationManager': started matching of features against a "
-            "user-provided spectral library using the ms2deepscore algorithm."
-        )
+    def collect_library_sources(
+        self: Self,
+        algorithm: str,
+        user_lib: bool,
+        kcb_results: Optional[dict],
+        kcb_library: Optional[list],
+    ) -> list:
+        """Collect the libraries an algorithm matches against, grouped by settings
+
+        Libraries are only scored in the same pass if they share the settings
+        affecting the scores: fragment tolerance and backend for modified cosine,
+        the inference backend for ms2deepscore.
+
+        Arguments:
+            algorithm: 'modified cosine' or 'ms2deepscore'
+            user_lib: the user-provided library passed the checks
+            kcb_results: the KnownClusterBlast results (or None)
+            kcb_library: the MIBiG library of the KnownClusterBlast results (or None)
 
-        if not self.verify_user_lib_params():
-            return
+        Returns:
+            A list of groups, each a list of tuples (LibrarySource, parameters)
+        """
+        if algorithm == "modified cosine":
+            user_params = self.params.SpectralLibMatchingCosineParameters
+            kcb_params = self.params.AsKcbCosineMatchingParams
+        else:
+            user_params = self.params.SpectralLibMatchingDeepscoreParameters
+            kcb_params = self.params.AsKcbDeepscoreMatchingParams
+
+        candidates = []
+        if user_lib and user_params and user_params.activate_module:
+            candidates.append(
+                (
+                    self.stats.spectral_library,
+                    self.params.SpecLibParameters.dirpath.name,
+                    self.params.SpecLibParameters.dirpath,
+                    None,
+                    user_params,
+                )
+            )
+        if kcb_results is not None and kcb_params and kcb_params.activate_module:
+            candidates.append(
+                (
+                    kcb_library,
+                    DefaultPaths().library_mibig_pos.name,
+                    DefaultPaths().library_mibig_pos,
+                    kcb_results,
+                    kcb_params,
+                )
+            )
 
-        try:
-            ms2deepscore_annotator = Ms2deepscoreAnnotator(
+        groups = {}
+        for library, name, path, results, params in candidates:
+            if algorithm == "modified cosine":
+                key = (params.fragment_tol, params.backend)
+                source = LibrarySource(
+                    library=library,
+                    library_name=name,
+                    kcb_results=results,
+                    score_cutoff=params.score_cutoff,
+                    max_precursor_mass_diff=params.max_precursor_mass_diff,
+                    max_nr_matches=params.max_nr_matches,
+                    min_nr_matched_peaks=params.min_nr_matched_peaks,
+                )
+            else:
+                key = (params.backend,)
+                source = LibrarySource(
+                    library=library,
+                    library_name=name,
+                    library_path=path,
+                    kcb_results=results,
+                    score_cutoff=params.score_cutoff,
+                    max_precursor_mass_diff=params.max_precursor_mass_diff,
+                    max_nr_matches=params.max_nr_matches,
+                    search=params.search,
+                    nr_candidates=params.nr_candidates,
+                    nr_probe=params.nr_probe,
+                )
+            groups.setdefault(key, []).append((source, params))
+        return list(groups.values())
+
+    def create_combined_annotator(self: Self, algorithm: str, group: list) -> Any:
+        """Create the annotator scoring the combined library of a group of sources
+
+        Arguments:
+            algorithm: 'modified cosine' or 'ms2deepscore'
+            group: a list of tuples (LibrarySource, parameters)
+
+        Returns:
+            A ModCosAnnotator or Ms2deepscoreAnnotator instance
+        """
+        sources = [source for source, _ in group]
+        params = group[0][1]
+        deduplicator = None
+        dedup_params = self.params.SpectrumDeduplicationParameters
+        if getattr(dedup_params, "activate_module", False):
+            deduplicator = SpectrumDeduplicator(
+                min_cosine=dedup_params.min_cosine,
+                fragment_tol=dedup_params.fragment_tol,
+            )
+
+        if algorithm == "modified cosine":
+            return ModCosAnnotator.from_sources(
                 features=self.features,
                 active_features=self.stats.active_features,
-                polarity=self.params.PeaktableParameters.polarity,
-                library=self.stats.spectral_library,
-                library_name=self.params.SpecLibParameters.dirpath.name,
-                score_cutoff=self.params.SpectralLibMatchingDeepscoreParameters.score_cutoff,
-                max_precursor_mass_diff=self.params.SpectralLibMatchingDeepscoreParameters.max_precursor_mass_diff,
+                sources=sources,
+                fragment_tol=params.fragment_tol,
+                backend=params.backend,
+                deduplicator=deduplicator,
             )
-            ms2deepscore_annotator.prepare_queries()
-            ms2deepscore_annotator.calculate_scores_ms2deepscore()
-            ms2deepscore_annotator.extract_userlib_scores()
-            self.features = ms2deepscore_annotator.return_features()
-            self.params.SpectralLibMatchingDeepscoreParameters.module_passed = True
-        except Exception as e:
-            logger.error(str(e))
-            logger.error(
-                "'AnnotationManager': Error during running of Ms2deepscoreAnnotator "
-                "- SKIP"
+        else:
+            return Ms2deepscoreAnnotator.from_sources(
+                features=self.features,
+                active_features=self.stats.active_features,
+                polarity=self.params.PeaktableParameters.polarity,
+                sources=sources,
+                backend=params.backend,
+                batch_size=params.batch_size,
+                nr_threads=params.nr_threads,
+                deduplicator=deduplicator,
             )
-            return
 
-        logger.info(
-            "'AnnotationManager': completed matching of features against a "
-            "user-provided spectral library using the ms2deepscore algorithm."
-        )
+    def run_library_matching(self: Self):
+        """Match features against the user-provided and the antiSMASH KCB libraries
+
+        The query spectra and the KnownClusterBlast-derived MIBiG library are
+        prepared once. Per algorithm, the libraries are concatenated with source
+        tags and scored in a single pass; the matches are filtered with the
+        settings of their source and assigned to 'user_library_annotation' or
+        'antismash_kcb_annotation'.
+        """
+        cosine_params = self.params.SpectralLibMatchingCosineParameters
+        deepscore_params = self.params.SpectralLibMatchingDeepscoreParameters
+        user_lib = False
+        if getattr(cosine_params, "activate_module", False) or getattr(
+            deepscore_params, "activate_module", False
+        ):
+            user_lib = self.verify_user_lib_params()
+        kcb_results, kcb_library = self.prepare_as_kcb_library()
+
+        queries = None
+        for algorithm in ("modified cosine", "ms2deepscore"):
+            for group in self.collect_library_sources(
+                algorithm, user_lib, kcb_results, kcb_library
+            ):
+                names = ", ".join(source.library_name for source, _ in group)
+                logger.info(
+                    f"'AnnotationManager': started matching of features against "
+                    f"'{names}' using the {algorithm} algorithm."
+                )
+                try:
+                    annotator = self.create_combined_annotator(algorithm, group)
+                    if queries is None:
+                        annotator.prepare_queries()
+                        queries = annotator.queries
+                    else:
+                        annotator.queries = queries
+                    if algorithm == "modified cosine":
+                        annotator.calculate_scores_mod_cosine()
+                    else:
+                        annotator.calculate_scores_ms2deepscore()
+                    annotator.extract_source_scores()
+                    self.features = annotator.return_features()
+                    for _, params in group:
+                        params.module_passed = True
+                    if annotator.deduplicator is not None:
+                        self.params.SpectrumDeduplicationParameters.module_passed = True
+                except Exception as e:
+                    logger.error(str(e))
+                    logger.error(
+                        f"'AnnotationManager': Error during {algorithm} matching "
+                        f"against '{names}' - SKIP"
+                    )
+                    continue
+
+                logger.info(
+                    f"'AnnotationManager': completed matching of features against "
+                    f"'{names}' using the {algorithm} algorithm."
+                )
 
     def run_feature_adduct_annotation(self: Self):
         """Perform feature adduct annotation"""
@@ -369,131 +513,3 @@ class AnnotationManager(BaseModel):
         logger.info(
             "'AnnotationManager': completed annotation from existing MS2Query results."
         )
-
-    def run_as_kcb_cosine_annotation(self: Self):
-        """Match features against a antiSMASH knownclusterblast-derived library.
-
-        Allows modified cosine-based library matching against the in silico generated
-        MS2 spectra of significant antiSMASH KnownClusterBlast (MIBiG) matches.
-        """
-        logger.info(
-            "'AnnotationManager': started antiSMASH KnownClusterBlast "
-            "modified cosine annotation."
-        )
-
-        if self.params.PeaktableParameters.polarity == "negative":
-            logger.warning(
-                "'AnnotationManager': negative ion mode detected. antiSMASH "
-                "KnownClusterBlast result annotation only available for positive ion "
-                "mode - SKIP"
-            )
-            return
-
-        if not (
-            self.params.AsKcbCosineMatchingParams
-            and self.params.AsKcbCosineMatchingParams.activate_module
-        ):
-            logger.warning(
-                "'AnnotationManager': antiSMASH results file provided but "
-                "'as_kcb_matching/modified_cosine' is turned off - SKIP"
-            )
-            return
-
-        try:
-            kcb_results = UtilityMethodManager().extract_as_kcb_results(
-                as_results=self.params.AsResultsParameters.directory_path,
-                cutoff=self.params.AsResultsParameters.similarity_cutoff,
-            )
-            mibig_bgcs = {key for key, value in kcb_results.items()}
-            spec_library = UtilityMethodManager().create_mibig_spec_lib(mibig_bgcs)
-            kcb_annotator = ModCosAnnotator(
-                features=self.features,
-                active_features=self.stats.active_features,
-                library=spec_library,
-                library_name=DefaultPaths().library_mibig_pos.name,
-                fragment_tol=self.params.AsKcbCosineMatchingParams.fragment_tol,
-                score_cutoff=self.params.AsKcbCosineMatchingParams.score_cutoff,
-                min_nr_matched_peaks=self.params.AsKcbCosineMatchingParams.min_nr_matched_peaks,
-                max_precursor_mass_diff=self.params.AsKcbCosineMatchingParams.max_precursor_mass_diff,
-            )
-            kcb_annotator.prepare_queries()
-            kcb_annotator.calculate_scores_mod_cosine()
-            kcb_annotator.extract_mibig_scores(kcb_results)
-            self.features = kcb_annotator.return_features()
-            self.params.AsKcbCosineMatchingParams.module_passed = True
-        except Exception as e:
-            logger.error(str(e))
-            logger.error(
-                "'AnnotationManager': Error during running of antiSMASH "
-                "KnownClusterBlast modified cosine annotation - SKIP"
-            )
-            return
-
-        logger.info(
-            "'AnnotationManager': completed antiSMASH KnownClusterBlast "
-            "modified cosine annotation."
-        )
-
-    def run_as_kcb_deepscore_annotation(self: Self):
-        """Match features against a antiSMASH knownclusterblast-derived library.
-
-        Allows MS2DeepScore-based library matching against the in silico generated
-        MS2 spectra of significant antiSMASH KnownClusterBlast (MIBiG) matches.
-        """
-        logger.info(
-            "'AnnotationManager': started antiSMASH KnownClusterBlast MS2DeepScore "
-            "annotation."
-        )
-
-        if self.params.PeaktableParameters.polarity == "negative":
-            logger.warning(
-                "'AnnotationManager': negative ion mode detected. antiSMASH "
-                "KnownClusterBlast result annotation only available for positive ion "
-                "mode - SKIP"
-            )
-            return
-
-        if not (
-            self.params.AsKcbDeepscoreMatchingParams
-            and self.params.AsKcbDeepscoreMatchingParams.activate_module
-        ):
-            logger.warning(
-                "'AnnotationManager': antiSMASH results file provided but "
-                "'as_kcb_matching/ms2deepscore' is turned off - SKIP"
-            )
-            return
-
-        try:
-            kcb_results = UtilityMethodManager().extract_as_kcb_results(
-                as_results=self.params.AsResultsParameters.directory_path,
-                cutoff=self.params.AsResultsParameters.similarity_cutoff,
-            )
-            mibig_bgcs = {key for key, value in kcb_results.items()}
-            spec_library = UtilityMethodManager().create_mibig_spec_lib(mibig_bgcs)
-
-            kcb_annotator = Ms2deepscoreAnnotator(
-                features=self.features,
-                active_features=self.stats.active_features,
-                polarity=self.params.PeaktableParameters.polarity,
-                library=spec_library,
-                library_name=DefaultPaths().library_mibig_pos.name,
-                score_cutoff=self.params.AsKcbDeepscoreMatchingParams.score_cutoff,
-                max_precursor_mass_diff=self.params.AsKcbDeepscoreMatchingParams.max_precursor_mass_diff,
-            )
-            kcb_annotator.prepare_queries()
-            kcb_annotator.calculate_scores_ms2deepscore()
-            kcb_annotator.extract_mibig_scores(kcb_results)
-            self.features = kcb_annotator.return_features()
-            self.params.AsKcbDeepscoreMatchingParams.module_passed = True
-        except Exception as e:
-            logger.error(str(e))
-            logger.error(
-                "'AnnotationManager': Error during running of antiSMASH "
-                "KnownClusterBlast MS2DeepScore annotation - SKIP"
-            )
-            return
-
-        logger.info(
-            "'AnnotationManager': completed antiSMASH KnownClusterBlast MS2DeepScore "
-            "annotation."
-        )
@@ -22,11 +22,12 @@ SOFTWARE.
 """
 
 import logging
-from typing import Self
+from typing import Any, Optional, Self
 
+import numpy as np
 from pydantic import BaseModel
 
-from fermo_core.config.class_default_settings import CharFragments
+from fermo_core.config.class_default_settings import MassLibrary, load_char_fragments
 from fermo_core.data_processing.builder_feature.dataclass_feature import (
     Annotations,
     CharFrag,
@@ -48,14 +49,14 @@ class FragmentAnnotator(BaseModel):
         stats: Stats object, holds stats on molecular features and samples
         features: Repository object, holds "General Feature" objects
         samples: Repository object, holds "Sample" objects
-        frags: CharFragments object storing hardcoded values
+        frags: MassLibrary of reference fragments, loaded lazily once per process
     """
 
     params: ParameterManager
     stats: Stats
     features: Repository
     samples: Repository
-    frags: CharFragments = CharFragments()
+    frags: Optional[Any] = None
 
     def return_attributes(self: Self) -> tuple[Repository, ParameterManager]:
         """Returns modified object instance
@@ -81,6 +82,53 @@ class FragmentAnnotator(BaseModel):
             feature.Annotations.fragments = []
         return feature
 
+    def compile_references(self: Self) -> MassLibrary:
+        """Return the reference fragments, sorted by mass
+
+        Returns:
+            A MassLibrary of the reference fragments
+        """
+        if self.frags is None:
+            self.frags = load_char_fragments()
+        return self.frags
+
+    def add_fragments(
+        self: Self,
+        feature: Feature,
+        frags: np.ndarray,
+        f_idx: np.ndarray,
+        r_idx: np.ndarray,
+        ppm: np.ndarray,
+    ) -> Feature:
+        """Add matched reference fragments to the feature
+
+        Arguments:
+            feature: a feature object instance
+            frags: the fragment m/z values of the feature
+            f_idx: indices of matched fragments, in ascending order
+            r_idx: indices of matched sorted reference fragments
+            ppm: mass deviation of matches in ppm
+
+        Returns:
+            the modified feature object instance
+        """
+        if len(f_idx) == 0:
+            return feature
+
+        refs = self.compile_references()
+        feature = self.add_annotation(feature)
+        for i in np.lexsort((refs.idx[r_idx], f_idx)):
+            ref = r_idx[i]
+            feature.Annotations.fragments.append(
+                CharFrag(
+                    id=refs.descr[ref],
+                    frag_det=frags[f_idx[i]],
+                    frag_ex=refs.mass[ref],
+                    diff=ppm[i],
+                )
+            )
+        return feature
+
     def validate_pos_aa_fragments(self: Self, feature: Feature) -> Feature:
         """Validate frags against a list of amino acid y2 and b2 ions (positive mode)
 
@@ -90,22 +138,62 @@ class FragmentAnnotator(BaseModel):
         Returns:
             the modified feature object instance
         """
-        for frag in feature.Spectrum.peaks.mz:
-            for ref_frag in self.frags.aa_frags:
-                ppm = Utils().mass_deviation(
-                    m1=frag, m2=ref_frag.mass, f_id_m2=ref_frag.descr
+        frags = feature.Spectrum.peaks.mz
+        f_idx, r_idx, ppm = Utils.match_masses_ppm(
+            queries=frags,
+            refs=self.compile_references().mass,
+            mass_dev_ppm=self.params.FragmentAnnParameters.mass_dev_ppm,
+        )
+        return self.add_fragments(feature, frags, f_idx, r_idx, ppm)
+
+    def annotate_run_pos(self: Self, f_ids: set):
+        """Annotate positive mode ion frags of all features in a single lookup
+
+        The fragment m/z values of all features are flattened into one array that
+        is matched once against the reference fragments; hits are then scattered
+        back to the features using the feature offsets in the flat array.
+
+        Arguments:
+            f_ids: the feature IDs to annotate
+        """
+        f_ids = sorted(f_ids)
+        features = []
+        spectra = []
+        for f_id in f_ids:
+            feature = self.features.get(f_id)
+            if feature.Spectrum is None or len(feature.Spectrum.peaks.mz) == 0:
+                logger.debug(
+                    f"'AnnotationManager/FragmentAnnotator': feature ID '{f_id}' has "
+                    f"no associated MS/MS spectrum - SKIP "
                 )
-                if ppm < self.params.FragmentAnnParameters.mass_dev_ppm:
-                    feature = self.add_annotation(feature)
-                    feature.Annotations.fragments.append(
-                        CharFrag(
-                            id=ref_frag.descr,
-                            frag_det=frag,
-                            frag_ex=ref_frag.mass,
-                            diff=ppm,
-                        )
-                    )
-        return feature
+                continue
+            features.append(feature)
+            spectra.append(feature.Spectrum.peaks.mz)
+
+        if len(features) == 0:
+            return
+
+        offsets = np.cumsum([0] + [len(mz) for mz in spectra])
+        flat_idx, r_idx, ppm = Utils.match_masses_ppm(
+            queries=np.concatenate(spectra),
+            refs=self.compile_references().mass,
+            mass_dev_ppm=self.params.FragmentAnnParameters.mass_dev_ppm,
+        )
+        feature_idx = np.searchsorted(offsets, flat_idx, side="right") - 1
+        bounds = np.searchsorted(feature_idx, np.arange(len(features) + 1))
+
+        for i, feature in enumerate(features):
+            hits = slice(bounds[i], bounds[i + 1])
+            if bounds[i] == bounds[i + 1]:
+                continue
+            feature = self.add_fragments(
+                feature,
+                spectra[i],
+                flat_idx[hits] - offsets[i],
+                r_idx[hits],
+                ppm[hits],
+            )
+            self.features.modify(feature.f_id, feature)
 
     def annotate_feature_pos(self: Self, f_id: int):
         """Annotate positive mode ion frags of feature and store data in General Feature
@@ -145,8 +233,7 @@ class FragmentAnnotator(BaseModel):
                 "'AnnotationManager/FragmentAnnotator': positive ion mode detected. "
                 "Attempt to annotate for positive ion mode fragments."
             )
-            for f_id in self.stats.active_features:
-                self.annotate_feature_pos(f_id)
+            self.annotate_run_pos(self.stats.active_features)
         else:
             logger.warning(
                 "'AnnotationManager/FragmentAnnotator': negative ion mode detected. "
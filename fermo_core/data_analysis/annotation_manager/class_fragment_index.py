@@ -0,0 +1,130 @@
+"""Inverted index of library fragments for pruning modified cosine candidates.
+
+Copyright (c) 2022 to present Mitja Maximilian Zdouc, PhD
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from typing import Any, Optional, Self
+
+import numpy as np
+from pydantic import BaseModel
+
+from fermo_core.utils.utility_method_manager import UtilityMethodManager
+
+
+class FragmentIndex(BaseModel):
+    """Pydantic-based class to organize an inverted index of library fragments
+
+    Fragment m/z and neutral loss m/z (precursor m/z - fragment m/z) of all library
+    spectra are stored as postings sorted by m/z, each pointing to its library peak.
+    A query peak can be paired by modified cosine to a library peak only if their
+    fragments (unshifted) or their neutral losses (shifted) are within tolerance.
+
+    Attributes:
+        tolerance: the fragment tolerance of the modified cosine algorithm
+        nr_refs: the number of indexed library spectra
+        peak_ref: the library index of each indexed peak
+        frag_mz: the sorted fragment m/z postings
+        frag_peak: the peak of each fragment m/z posting
+        loss_mz: the sorted neutral loss m/z postings
+        loss_peak: the peak of each neutral loss m/z posting
+    """
+
+    tolerance: float
+    nr_refs: int = 0
+    peak_ref: Optional[Any] = None
+    frag_mz: Optional[Any] = None
+    frag_peak: Optional[Any] = None
+    loss_mz: Optional[Any] = None
+    loss_peak: Optional[Any] = None
+
+    def build(self: Self, library: list) -> Self:
+        """Index the fragments and neutral losses of the library spectra
+
+        Arguments:
+            library: a list of matchms Spectrum objects
+
+        Returns:
+            The FragmentIndex instance
+        """
+        mz = [s.peaks.mz for s in library]
+        counts = np.array([len(i) for i in mz], dtype=int)
+        precursor = np.array(
+            [s.metadata.get("precursor_mz") or np.nan for s in library], dtype=float
+        )
+
+        self.nr_refs = len(library)
+        self.peak_ref = np.repeat(np.arange(len(library)), counts)
+        frags = np.concatenate(mz) if len(mz) != 0 else np.zeros(0)
+        losses = precursor[self.peak_ref] - frags
+
+        self.frag_peak = np.argsort(frags, kind="stable")
+        self.frag_mz = frags[self.frag_peak]
+        self.loss_peak = np.argsort(losses, kind="stable")
+        self.loss_mz = losses[self.loss_peak]
+        return self
+
+    def lookup(
+        self: Self, postings: np.ndarray, values: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Find the postings within tolerance of the query values
+
+        Arguments:
+            postings: a sorted array of indexed m/z values
+            values: the query m/z values
+
+        Returns:
+            A tuple of query value indices and posting positions
+        """
+        margin = self.tolerance + 10**-6
+        return UtilityMethodManager.expand_index_ranges(
+            start=np.searchsorted(postings, values - margin, side="left"),
+            stop=np.searchsorted(postings, values + margin, side="right"),
+        )
+
+    def max_matched_peaks(self: Self, spectrum: Any) -> tuple[np.ndarray, np.ndarray]:
+        """Calculate an upper bound of matched peaks between a query and the library
+
+        A peak can only be paired once, so the number of matched peaks cannot exceed
+        the number of distinct query peaks nor of distinct library peaks taking part
+        in any fragment or neutral loss hit. Only library spectra with at least one
+        hit are counted.
+
+        Arguments:
+            spectrum: the query matchms Spectrum object
+
+        Returns:
+            A tuple of the sorted hit library indices and their max nr of matched peaks
+        """
+        frags = spectrum.peaks.mz
+        losses = (spectrum.metadata.get("precursor_mz") or np.nan) - frags
+
+        q_frag, pos_frag = self.lookup(self.frag_mz, frags)
+        q_loss, pos_loss = self.lookup(self.loss_mz, losses)
+        q_peak = np.concatenate((q_frag, q_loss))
+        r_peak = np.concatenate((self.frag_peak[pos_frag], self.loss_peak[pos_loss]))
+        ref = self.peak_ref[r_peak]
+
+        nr_frags = max(len(frags), 1)
+        refs, q_counts = np.unique(
+            np.unique(ref * nr_frags + q_peak) // nr_frags, return_counts=True
+        )
+        _, r_counts = np.unique(self.peak_ref[np.unique(r_peak)], return_counts=True)
+        return refs, np.minimum(q_counts, r_counts)
@@ -0,0 +1,77 @@
+"""A spectral library taking part in combined library matching.
+
+Copyright (c) 2022 to present Mitja Maximilian Zdouc, PhD
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from pydantic import BaseModel
+
+
+class LibrarySource(BaseModel):
+    """Pydantic-based class to organize one library of a combined library matching
+
+    The libraries of all sources are concatenated and scored in a single pass; the
+    match filters and the annotation module are applied per source.
+
+    Attributes:
+        library: a list of Spectrum object representing the library to match against
+        library_name: the name of the library
+        library_path: the library dir or file to store embeddings next to (or None)
+        kcb_results: the knownclusterblast results of a MIBiG library (or None)
+        score_cutoff: minimum score for a match
+        max_precursor_mass_diff: maximum precursor mass difference
+        max_nr_matches: maximum number of best-scoring matches per feature (or None)
+        min_nr_matched_peaks: minimum number of matched peaks (modified cosine)
+        search: the library search ('exact', 'ivf') (ms2deepscore)
+        nr_candidates: the approximate nearest library spectra per query ('ivf')
+        nr_probe: the inverted file index lists searched per query ('ivf')
+    """
+
+    library: list
+    library_name: str
+    library_path: Optional[Path] = None
+    kcb_results: Optional[dict] = None
+    score_cutoff: float
+    max_precursor_mass_diff: float
+    max_nr_matches: Optional[int] = None
+    min_nr_matched_peaks: int = 0
+    search: str = "exact"
+    nr_candidates: int = 100
+    nr_probe: int = 8
+
+    @staticmethod
+    def combine(sources: list) -> tuple[list, np.ndarray]:
+        """Concatenate the libraries of the sources
+
+        Arguments:
+            sources: a list of LibrarySource objects
+
+        Returns:
+            A tuple of the combined library and the source index of each spectrum
+        """
+        library = [spectrum for source in sources for spectrum in source.library]
+        source_idx = np.repeat(
+            np.arange(len(sources)), [len(source.library) for source in sources]
+        )
+        return library, source_idx
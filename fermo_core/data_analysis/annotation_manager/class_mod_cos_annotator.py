@@ -22,16 +22,27 @@ SOFTWARE.
 """
 
 import logging
+from collections.abc import Iterator
+from itertools import islice
 from typing import Any, Optional, Self
 
 import matchms
+import numpy as np
 from pydantic import BaseModel
 
+from fermo_core.data_analysis.annotation_manager.class_fragment_index import (
+    FragmentIndex,
+)
+from fermo_core.data_analysis.annotation_manager.class_library_source import (
+    LibrarySource,
+)
 from fermo_core.data_processing.builder_feature.dataclass_feature import (
     Annotations,
     Match,
 )
 from fermo_core.data_processing.class_repository import Repository
+from fermo_core.utils.class_batched_mod_cosine import BatchedModifiedCosine
+from fermo_core.utils.class_spectrum_deduplicator import SpectrumDeduplicator
 
 logger = logging.getLogger("fermo_core")
 
@@ -45,11 +56,16 @@ class ModCosAnnotator(BaseModel):
         library: a list of Spectrum object representing the library to match against
         library_name: the name of the library
         queries: a list of Spectra for which to perform matching
-        scores: a matchms.Scores object storing the raw results of the matching
+        scores: a dict of arrays storing the scored reference-query pairs
         fragment_tol: fragment tolerance for modified cosine algorithm
         score_cutoff: minimum score for a match
         min_nr_matched_peaks: minimum number of matched peaks
         max_precursor_mass_diff: maximum precursor mass difference
+        max_nr_matches: maximum number of best-scoring matches per feature (or None)
+        backend: the modified cosine implementation ('matchms', 'numpy')
+        sources: the LibrarySource objects of a combined library (or None)
+        source_idx: the index of the source of each library spectrum (or None)
+        deduplicator: scores identical query spectra once if given (or None)
     """
 
     features: Repository
@@ -62,6 +78,68 @@ class ModCosAnnotator(BaseModel):
     score_cutoff: float
     min_nr_matched_peaks: int
     max_precursor_mass_diff: float
+    max_nr_matches: Optional[int] = None
+    backend: str = "matchms"
+    sources: Optional[list] = None
+    source_idx: Optional[Any] = None
+    deduplicator: Optional[SpectrumDeduplicator] = None
+
+    @classmethod
+    def from_sources(
+        cls,
+        features: Repository,
+        active_features: set,
+        sources: list,
+        fragment_tol: float,
+        backend: str = "matchms",
+        deduplicator: Optional[SpectrumDeduplicator] = None,
+    ) -> Self:
+        """Create an annotator matching against the combined library of sources
+
+        The scalar filters are set to the most permissive ones of the sources; the
+        filters of each source are applied when extracting its matches.
+
+        Arguments:
+            features: Repository object, holds "General Feature" objects
+            active_features: a set of active features
+            sources: a list of LibrarySource objects
+            fragment_tol: fragment tolerance for modified cosine algorithm
+            backend: the modified cosine implementation ('matchms', 'numpy')
+            deduplicator: scores identical query spectra once if given (or None)
+
+        Returns:
+            A ModCosAnnotator instance
+        """
+        library, source_idx = LibrarySource.combine(sources)
+        return cls(
+            features=features,
+            active_features=active_features,
+            library=library,
+            library_name="|".join(source.library_name for source in sources),
+            fragment_tol=fragment_tol,
+            score_cutoff=min(source.score_cutoff for source in sources),
+            min_nr_matched_peaks=min(s.min_nr_matched_peaks for s in sources),
+            max_precursor_mass_diff=max(s.max_precursor_mass_diff for s in sources),
+            backend=backend,
+            sources=sources,
+            source_idx=source_idx,
+            deduplicator=deduplicator,
+        )
+
+    def ref_settings(self: Self, name: str) -> np.ndarray:
+        """Return the value of a match filter for each library spectrum
+
+        Arguments:
+            name: the name of the filter attribute
+
+        Returns:
+            An array with the filter value of the source of each library spectrum
+        """
+        if self.sources is None:
+            return np.full(len(self.library), getattr(self, name), dtype=float)
+        return np.array([getattr(s, name) for s in self.sources], dtype=float)[
+            self.source_idx
+        ]
 
     def return_features(self: Self) -> Repository:
         """Return the modified Feature objects as Repository object
@@ -110,39 +188,194 @@ class ModCosAnnotator(BaseModel):
                 "'prepare_queries()'? - SKIP "
             )
 
-        sim_algorithm = matchms.similarity.ModifiedCosine(tolerance=self.fragment_tol)
+        ref_idx, query_idx = self.collect_candidates()
+
+        if self.backend == "numpy":
+            sim_algorithm = BatchedModifiedCosine(tolerance=self.fragment_tol)
+        else:
+            sim_algorithm = matchms.similarity.ModifiedCosine(
+                tolerance=self.fragment_tol
+            )
 
         logger.info(
-            "'AnnotationManager/ModCosAnnotator': Started modified cosine library matching algorithm "
+            f"'AnnotationManager/ModCosAnnotator': Started modified cosine library "
+            f"matching algorithm on '{len(ref_idx)}' of "
+            f"'{len(self.library) * len(self.queries)}' candidate pairs"
         )
-        self.scores = matchms.calculate_scores(
+        pair_ref, pair_query, inverse = ref_idx, query_idx, slice(None)
+        if self.deduplicator is not None:
+            pair_ref, pair_query, inverse = self.deduplicator.unique_pairs(
+                self.queries, ref_idx, query_idx, ("precursor_mz",)
+            )
+        results = sim_algorithm.sparse_array(
             references=self.library,
             queries=self.queries,
-            similarity_function=sim_algorithm,
+            idx_row=pair_ref,
+            idx_col=pair_query,
+        )[inverse]
+        keep = (results["score"] != 0) & (results["matches"] != 0)
+        ref_idx, query_idx, results = ref_idx[keep], query_idx[keep], results[keep]
+
+        order = np.lexsort((-results["score"], query_idx))
+        self.scores = {
+            "ref": ref_idx[order],
+            "query": query_idx[order],
+            "score": results["score"][order],
+            "matches": results["matches"][order],
+        }
+
+    def collect_candidates(self: Self) -> tuple[np.ndarray, np.ndarray]:
+        """Collect the library-query pairs that can pass the match filters
+
+        An inverted fragment index proposes the library spectra sharing enough
+        fragments or neutral losses with a query to reach 'min_nr_matched_peaks';
+        these are restricted to the precursor m/z window.
+
+        Returns:
+            A tuple of library indices and query indices of the candidate pairs
+        """
+        index = FragmentIndex(tolerance=self.fragment_tol).build(self.library)
+        ref_mz = np.array(
+            [s.metadata.get("precursor_mz") or np.nan for s in self.library],
+            dtype=float,
+        )
+        ref_min_peaks = self.ref_settings("min_nr_matched_peaks")
+        ref_max_diff = self.ref_settings("max_precursor_mass_diff")
+
+        ref_idx = []
+        query_idx = []
+        for q_idx, spectrum in enumerate(self.queries):
+            f_mz = self.features.get(int(spectrum.metadata.get("id"))).mz
+            refs, max_peaks = index.max_matched_peaks(spectrum)
+            refs = refs[max_peaks >= ref_min_peaks[refs]]
+            refs = refs[np.abs(ref_mz[refs] - f_mz) <= ref_max_diff[refs]]
+            ref_idx.append(refs)
+            query_idx.append(np.full(len(refs), q_idx))
+
+        return (
+            np.concatenate(ref_idx).astype(int),
+            np.concatenate(query_idx).astype(int),
         )
 
-    def filter_match(self: Self, match: tuple, f_mz: float) -> bool:
+    def matches_by_query(
+        self: Self, q_idx: int, source_nr: Optional[int] = None
+    ) -> Iterator[tuple]:
+        """Yield the scored library matches of a query, sorted by descending score
+
+        Arguments:
+            q_idx: the index of the query spectrum in self.queries
+            source_nr: only yield matches of this source of self.sources (or None)
+
+        Yields:
+            Tuples (matchms.Spectrum, (score, nr_matched_peaks))
+        """
+        start, stop = np.searchsorted(self.scores["query"], [q_idx, q_idx + 1])
+        for i in range(start, stop):
+            ref = self.scores["ref"][i]
+            if source_nr is None or self.source_idx[ref] == source_nr:
+                yield (
+                    self.library[ref],
+                    (self.scores["score"][i], self.scores["matches"][i]),
+                )
+
+    def filter_match(
+        self: Self, match: tuple, f_mz: float, settings: Optional[Any] = None
+    ) -> bool:
         """Filter modified cosine-derived matches for user-specified params
 
         Arguments:
             match: a tuple of (matchms.Spectrum, List[score, nr_matched_peaks])
             f_mz: the m/z of the matched feature
+            settings: the LibrarySource holding the filters, by default self
 
         Returns:
             A bool indicating if match is inside the settings (True) or not (False)
         """
-        if match[1][0] < self.score_cutoff:
+        settings = self if settings is None else settings
+        if match[1][0] < settings.score_cutoff:
             return False
-        elif match[1][1] < self.min_nr_matched_peaks:
+        elif match[1][1] < settings.min_nr_matched_peaks:
             return False
         elif (
             abs(match[0].metadata.get("precursor_mz") - f_mz)
-            > self.max_precursor_mass_diff
+            > settings.max_precursor_mass_diff
         ):
             return False
         else:
             return True
 
+    def best_matches(
+        self: Self, q_idx: int, f_mz: float, source_nr: Optional[int] = None
+    ) -> list:
+        """Return the best-scoring matches of a query that pass the filters
+
+        Since matches are sorted by descending score, collection stops after
+        'max_nr_matches' accepted matches.
+
+        Arguments:
+            q_idx: the index of the query spectrum in self.queries
+            f_mz: the m/z of the matched feature
+            source_nr: only return matches of this source of self.sources (or None)
+
+        Returns:
+            A list of at most 'max_nr_matches' tuples (matchms.Spectrum, (score, nr_matched_peaks))
+        """
+        settings = self if source_nr is None else self.sources[source_nr]
+        matches = (
+            match
+            for match in self.matches_by_query(q_idx, source_nr)
+            if self.filter_match(match, f_mz, settings)
+        )
+        return list(islice(matches, settings.max_nr_matches))
+
+    @staticmethod
+    def create_match(
+        match: tuple, f_mz: float, library_name: str, kcb_results: Optional[dict]
+    ) -> Match:
+        """Create the Match of a library match
+
+        Arguments:
+            match: a tuple of (matchms.Spectrum, List[score, nr_matched_peaks])
+            f_mz: the m/z of the matched feature
+            library_name: the name of the library
+            kcb_results: the knownclusterblast results for MIBiG matches, else None
+
+        Returns:
+            A Match object of module 'user_library_annotation' or
+            'antismash_kcb_annotation'
+        """
+        if kcb_results is None:
+            match_id = match[0].metadata.get("compound_name")
+            module = "user_library_annotation"
+        else:
+            similarity = ""
+            region = ""
+            mibig_id = ""
+            for id in match[0].metadata.get("mibigaccession").split(","):
+                if id in kcb_results:
+                    similarity = kcb_results[id].get("bgc_sim")
+                    region = kcb_results[id].get("region")
+                    mibig_id = id
+            match_id = (
+                f'{match[0].metadata.get("id")}|'
+                f"{mibig_id}|"
+                f"sim%:{similarity}|"
+                f"{region}"
+            )
+            module = "antismash_kcb_annotation"
+
+        return Match(
+            id=match_id,
+            library=library_name,
+            algorithm="modified cosine",
+            score=float(match[1][0].round(2)),
+            mz=match[0].metadata.get("precursor_mz"),
+            diff_mz=round(abs(match[0].metadata.get("precursor_mz") - f_mz), 4),
+            module=module,
+            smiles=match[0].metadata.get("smiles") or "unknown",
+            inchikey=match[0].metadata.get("inchikey") or "unknown",
+        )
+
     def extract_userlib_scores(self: Self):
         """Extract best matches against user library
 
@@ -158,35 +391,18 @@ class ModCosAnnotator(BaseModel):
                 "Did you run 'self.calculate_scores_mod_cosine()'?"
             )
 
-        for spectrum in self.queries:
+        for q_idx, spectrum in enumerate(self.queries):
             feature = self.features.get(int(spectrum.metadata.get("id")))
 
-            sorted_matches = self.scores.scores_by_query(
-                spectrum, name="ModifiedCosine_score", sort=True
-            )
-            for match in sorted_matches:
-                if self.filter_match(match, feature.mz):
-                    if feature.Annotations is None:
-                        feature.Annotations = Annotations()
-                    if feature.Annotations.matches is None:
-                        feature.Annotations.matches = []
+            for match in self.best_matches(q_idx, feature.mz):
+                if feature.Annotations is None:
+                    feature.Annotations = Annotations()
+                if feature.Annotations.matches is None:
+                    feature.Annotations.matches = []
 
-                    feature.Annotations.matches.append(
-                        Match(
-                            id=match[0].metadata.get("compound_name"),
-                            library=self.library_name,
-                            algorithm="modified cosine",
-                            score=float(match[1][0].round(2)),
-                            mz=match[0].metadata.get("precursor_mz"),
-                            diff_mz=round(
-                                abs(match[0].metadata.get("precursor_mz") - feature.mz),
-                                4,
-                            ),
-                            module="user_library_annotation",
-                            smiles=match[0].metadata.get("smiles") or "unknown",
-                            inchikey=match[0].metadata.get("inchikey") or "unknown",
-                        )
-                    )
+                feature.Annotations.matches.append(
+                    self.create_match(match, feature.mz, self.library_name, None)
+                )
 
             self.features.modify(int(spectrum.metadata.get("id")), feature)
 
@@ -205,49 +421,50 @@ class ModCosAnnotator(BaseModel):
                 "Did you run 'self.calculate_scores_mod_cosine()'?"
             )
 
-        for spectrum in self.queries:
+        for q_idx, spectrum in enumerate(self.queries):
             feature = self.features.get(int(spectrum.metadata.get("id")))
 
-            sorted_matches = self.scores.scores_by_query(
-                spectrum, name="ModifiedCosine_score", sort=True
+            for match in self.best_matches(q_idx, feature.mz):
+                if feature.Annotations is None:
+                    feature.Annotations = Annotations()
+                if feature.Annotations.matches is None:
+                    feature.Annotations.matches = []
+
+                feature.Annotations.matches.append(
+                    self.create_match(match, feature.mz, self.library_name, kcb_results)
+                )
+
+            self.features.modify(int(spectrum.metadata.get("id")), feature)
+
+    def extract_source_scores(self: Self):
+        """Extract best matches per source of a combined library
+
+        Matches are filtered with the settings of their source and assigned to its
+        annotation module.
+
+        Raises:
+            RuntimeError: 'self.scores' None - no scores calculated
+        """
+        if self.scores is None or self.sources is None:
+            raise RuntimeError(
+                "'AnnotationManager/ModCosAnnotator': 'self.scores' or 'self.sources' "
+                "is None. Did you run 'from_sources()' and "
+                "'self.calculate_scores_mod_cosine()'?"
             )
-            for match in sorted_matches:
-                if self.filter_match(match, feature.mz):
+
+        for q_idx, spectrum in enumerate(self.queries):
+            feature = self.features.get(int(spectrum.metadata.get("id")))
+
+            for source_nr, source in enumerate(self.sources):
+                for match in self.best_matches(q_idx, feature.mz, source_nr):
                     if feature.Annotations is None:
                         feature.Annotations = Annotations()
                     if feature.Annotations.matches is None:
                         feature.Annotations.matches = []
 
-                    mibig_id_list = match[0].metadata.get("mibigaccession").split(",")
-
-                    similarity = ""
-                    region = ""
-                    mibig_id = ""
-                    for id in mibig_id_list:
-                        if id in kcb_results:
-                            similarity = kcb_results[id].get("bgc_sim")
-                            region = kcb_results[id].get("region")
-                            mibig_id = id
-
                     feature.Annotations.matches.append(
-                        Match(
-                            id=(
-                                f'{match[0].metadata.get("id")}|'
-                                f"{mibig_id}|"
-                                f"sim%:{similarity}|"
-                                f"{region}"
-                            ),
-                            library=self.library_name,
-                            algorithm="modified cosine",
-                            score=float(match[1][0].round(2)),
-                            mz=match[0].metadata.get("precursor_mz"),
-                            diff_mz=round(
-                                abs(match[0].metadata.get("precursor_mz") - feature.mz),
-                                4,
-                            ),
-                            module="antismash_kcb_annotation",
-                            smiles=match[0].metadata.get("smiles") or "unknown",
-                            inchikey=match[0].metadata.get("inchikey") or "unknown",
+                        self.create_match(
+                            match, feature.mz, source.library_name, source.kcb_results
                         )
                     )
 
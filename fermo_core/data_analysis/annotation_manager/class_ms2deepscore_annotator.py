@@ -22,20 +22,27 @@ SOFTWARE.
 """
 
 import logging
+from collections.abc import Iterator
+from itertools import islice
+from pathlib import Path
 from typing import Any, Optional, Self
 from urllib.parse import urlparse
 
-import matchms
-from ms2deepscore import MS2DeepScore
-from ms2deepscore.models import load_model
+import numpy as np
 from pydantic import BaseModel
 
 from fermo_core.config.class_default_settings import DefaultPaths
+from fermo_core.data_analysis.annotation_manager.class_library_source import (
+    LibrarySource,
+)
 from fermo_core.data_processing.builder_feature.dataclass_feature import (
     Annotations,
     Match,
 )
 from fermo_core.data_processing.class_repository import Repository
+from fermo_core.utils.class_embedding_cache import CachedMS2DeepScore
+from fermo_core.utils.class_library_embeddings import LibraryEmbeddings
+from fermo_core.utils.class_spectrum_deduplicator import SpectrumDeduplicator
 from fermo_core.utils.utility_method_manager import UtilityMethodManager
 
 logger = logging.getLogger("fermo_core")
@@ -50,10 +57,21 @@ class Ms2deepscoreAnnotator(BaseModel):
         polarity: the ion mode polarity
         library: a list of Spectrum object representing the library to match against
         library_name: the name of the library that is matched against
+        library_path: the library dir or file to store embeddings next to (or None)
         queries: a list of Spectra for which to perform matching
-        scores: a matchms.Scores object storing the raw results of the matching
+        scores: a dict of arrays storing the scored reference-query pairs
         score_cutoff: minimum score for a match
         max_precursor_mass_diff: maximum precursor mass difference
+        max_nr_matches: maximum number of best-scoring matches per feature (or None)
+        search: the library search ('exact', 'ivf')
+        nr_candidates: the approximate nearest library spectra per query with 'ivf'
+        nr_probe: the number of IVF lists scored per query with 'ivf'
+        backend: the MS2DeepScore inference backend ('keras', 'numpy')
+        batch_size: the number of spectra embedded per inference batch
+        nr_threads: the CPU threads used for inference, 0 for the library default
+        sources: the LibrarySource objects of a combined library (or None)
+        source_idx: the index of the source of each library spectrum (or None)
+        deduplicator: scores identical query spectra once if given (or None)
     """
 
     features: Repository
@@ -61,10 +79,83 @@ class Ms2deepscoreAnnotator(BaseModel):
     polarity: str
     library: list
     library_name: str
+    library_path: Optional[Path] = None
     queries: Optional[list] = None
     scores: Optional[Any] = None
     score_cutoff: float
     max_precursor_mass_diff: float
+    max_nr_matches: Optional[int] = None
+    search: str = "exact"
+    nr_candidates: int = 100
+    nr_probe: int = 8
+    backend: str = "keras"
+    batch_size: int = 1024
+    nr_threads: int = 0
+    sources: Optional[list] = None
+    source_idx: Optional[Any] = None
+    deduplicator: Optional[SpectrumDeduplicator] = None
+
+    @classmethod
+    def from_sources(
+        cls,
+        features: Repository,
+        active_features: set,
+        polarity: str,
+        sources: list,
+        backend: str = "keras",
+        batch_size: int = 1024,
+        nr_threads: int = 0,
+        deduplicator: Optional[SpectrumDeduplicator] = None,
+    ) -> Self:
+        """Create an annotator matching against the combined library of sources
+
+        The scalar filters are set to the most permissive ones of the sources; the
+        filters of each source are applied when extracting its matches.
+
+        Arguments:
+            features: Repository object, holds "General Feature" objects
+            active_features: a set of active features
+            polarity: the ion mode polarity
+            sources: a list of LibrarySource objects
+            backend: the MS2DeepScore inference backend ('keras', 'numpy')
+            batch_size: the number of spectra embedded per inference batch
+            nr_threads: the CPU threads used for inference, 0 for the library default
+            deduplicator: scores identical query spectra once if given (or None)
+
+        Returns:
+            A Ms2deepscoreAnnotator instance
+        """
+        library, source_idx = LibrarySource.combine(sources)
+        return cls(
+            features=features,
+            active_features=active_features,
+            polarity=polarity,
+            library=library,
+            library_name="|".join(source.library_name for source in sources),
+            score_cutoff=min(source.score_cutoff for source in sources),
+            max_precursor_mass_diff=max(s.max_precursor_mass_diff for s in sources),
+            backend=backend,
+            batch_size=batch_size,
+            nr_threads=nr_threads,
+            sources=sources,
+            source_idx=source_idx,
+            deduplicator=deduplicator,
+        )
+
+    def ref_settings(self: Self, name: str) -> np.ndarray:
+        """Return the value of a match filter for each library spectrum
+
+        Arguments:
+            name: the name of the filter attribute
+
+        Returns:
+            An array with the filter value of the source of each library spectrum
+        """
+        if self.sources is None:
+            return np.full(len(self.library), getattr(self, name), dtype=float)
+        return np.array([getattr(s, name) for s in self.sources], dtype=float)[
+            self.source_idx
+        ]
 
     def return_features(self: Self) -> Repository:
         """Return the modified Feature objects as Repository object
@@ -117,40 +208,321 @@ class Ms2deepscoreAnnotator(BaseModel):
             )
 
         file = urlparse(DefaultPaths().url_ms2deepscore_pos).path.split("/")[-1]
-        model = load_model(DefaultPaths().dirpath_ms2deepscore_pos.joinpath(file))
+        model_path = DefaultPaths().dirpath_ms2deepscore_pos.joinpath(file)
+        sim_algorithm = CachedMS2DeepScore(
+            model_path=model_path,
+            backend=self.backend,
+            batch_size=self.batch_size,
+            nr_threads=self.nr_threads,
+        )
 
-        sim_algorithm = MS2DeepScore(model=model, progress_bar=False)
+        ref_idx, query_idx = self.collect_candidates()
 
         logger.info(
-            "'AnnotationManager/Ms2deepscoreAnnotator': Started ms2deepscore "
-            "library matching "
+            f"'AnnotationManager/Ms2deepscoreAnnotator': Started ms2deepscore "
+            f"library matching on '{len(ref_idx)}' of "
+            f"'{len(self.library) * len(self.queries)}' pairs inside the precursor "
+            f"m/z window"
         )
-        self.scores = matchms.calculate_scores(
-            references=self.library,
-            queries=self.queries,
-            similarity_function=sim_algorithm,
+        if len(ref_idx) == 0:
+            scores = np.zeros(0, dtype=float)
+        elif self.deduplicator is None:
+            scores = self.score_pairs(sim_algorithm, ref_idx, query_idx)
+        else:
+            pair_ref, pair_query, inverse = self.deduplicator.unique_pairs(
+                self.queries, ref_idx, query_idx, sim_algorithm.metadata_keys
+            )
+            scores = self.score_pairs(sim_algorithm, pair_ref, pair_query)[inverse]
+
+        keep = scores != 0
+        ref_idx, query_idx, scores = ref_idx[keep], query_idx[keep], scores[keep]
+
+        order = np.lexsort((-scores, query_idx))
+        self.scores = {
+            "ref": ref_idx[order],
+            "query": query_idx[order],
+            "score": scores[order],
+        }
+
+    def score_pairs(
+        self: Self,
+        sim_algorithm: CachedMS2DeepScore,
+        ref_idx: np.ndarray,
+        query_idx: np.ndarray,
+    ) -> np.ndarray:
+        """Calculate the ms2deepscore of the candidate pairs
+
+        The queries are embedded once. The library is scored by 'score_library',
+        per source if matching against a combined library.
+
+        Arguments:
+            sim_algorithm: the CachedMS2DeepScore object holding the model
+            ref_idx: the library indices of the candidate pairs
+            query_idx: the query indices of the candidate pairs
+
+        Returns:
+            An array with the cosine similarity of the embeddings per pair
+        """
+        uniq_query, inv_query = np.unique(query_idx, return_inverse=True)
+        query_vectors = sim_algorithm.calculate_vectors(
+            [self.queries[i] for i in uniq_query]
+        )
+        query_vectors = query_vectors / np.linalg.norm(
+            query_vectors, axis=1, keepdims=True
         )
 
-    def filter_match(self: Self, match: tuple, f_mz: float) -> bool:
+        if self.sources is None:
+            return self.score_library(
+                sim_algorithm, query_vectors, inv_query, ref_idx, self
+            )
+
+        scores = np.zeros(len(ref_idx), dtype=float)
+        offsets = np.cumsum([0] + [len(source.library) for source in self.sources])
+        for source_nr, source in enumerate(self.sources):
+            in_source = self.source_idx[ref_idx] == source_nr
+            if np.any(in_source):
+                scores[in_source] = self.score_library(
+                    sim_algorithm,
+                    query_vectors,
+                    inv_query[in_source],
+                    ref_idx[in_source] - offsets[source_nr],
+                    source,
+                )
+        return scores
+
+    def score_library(
+        self: Self,
+        sim_algorithm: CachedMS2DeepScore,
+        query_vectors: np.ndarray,
+        inv_query: np.ndarray,
+        ref_idx: np.ndarray,
+        settings: Any,
+    ) -> np.ndarray:
+        """Calculate the ms2deepscore of the candidate pairs of a library
+
+        If 'library_path' is set, the library embeddings stored next to the library
+        are used (and stored if missing) and only the queries are embedded. Else,
+        only the spectra taking part in at least one pair are embedded. Only the
+        candidate pairs are scored.
+
+        With search 'ivf', only the pairs among the 'nr_candidates' approximate
+        nearest library spectra of a query are rescored exactly; all other pairs
+        are scored 0 and their number is logged. The IVF index is persisted next
+        to the library, so 'ivf' needs 'library_path'; without, the exact search
+        is used.
+
+        Arguments:
+            sim_algorithm: the CachedMS2DeepScore object holding the model
+            query_vectors: the unit-length embeddings of the queries
+            inv_query: the row in query_vectors of the candidate pairs
+            ref_idx: the library indices of the candidate pairs
+            settings: self or the LibrarySource holding library, library_path,
+                search, nr_candidates and nr_probe
+
+        Returns:
+            An array with the cosine similarity of the embeddings per pair
+        """
+        library = settings.library
+
+        if settings.library_path is None and settings.search == "ivf":
+            logger.warning(
+                "'Ms2deepscoreAnnotator': search 'ivf' needs a library stored on "
+                "disk to persist its index, using search 'exact' instead - SKIP"
+            )
+
+        if settings.library_path is None:
+            uniq_ref, inv_ref = np.unique(ref_idx, return_inverse=True)
+            ref_vectors = sim_algorithm.calculate_vectors(
+                [library[i] for i in uniq_ref]
+            )
+            ref_vectors = ref_vectors / np.linalg.norm(
+                ref_vectors, axis=1, keepdims=True
+            )
+            return np.einsum(
+                "ij,ij->i", ref_vectors[inv_ref], query_vectors[inv_query]
+            ).astype(float)
+
+        embeddings = LibraryEmbeddings(
+            location=settings.library_path,
+            file_hash=sim_algorithm.cache.file_hash,
+        ).load()
+        library_vectors = embeddings.get_vectors(
+            library,
+            sim_algorithm.calculate_vectors,
+            sim_algorithm.metadata_keys,
+        )
+        library_vectors = library_vectors / np.linalg.norm(
+            library_vectors, axis=1, keepdims=True
+        )
+
+        if settings.search == "exact":
+            return np.einsum(
+                "ij,ij->i", query_vectors[inv_query], library_vectors[ref_idx]
+            ).astype(float)
+
+        index = embeddings.ivf_index(
+            library, library_vectors, sim_algorithm.metadata_keys
+        )
+        hit_query, hit_ref = index.search(
+            library_vectors,
+            query_vectors,
+            k=settings.nr_candidates,
+            nr_probe=settings.nr_probe,
+        )
+        hit = np.isin(
+            inv_query * len(library) + ref_idx,
+            hit_query * len(library) + hit_ref,
+        )
+        if not hit.all():
+            logger.info(
+                f"'Ms2deepscoreAnnotator': '{np.count_nonzero(~hit)}' of "
+                f"'{len(hit)}' library-query pairs in the precursor m/z window were "
+                f"not among the '{settings.nr_candidates}' IVF candidates and were "
+                "not rescored; increase 'nr_candidates' or 'nr_probe' to include them."
+            )
+        scores = np.zeros(len(ref_idx), dtype=float)
+        scores[hit] = np.einsum(
+            "ij,ij->i", query_vectors[inv_query[hit]], library_vectors[ref_idx[hit]]
+        )
+        return scores
+
+    def collect_candidates(self: Self) -> tuple[np.ndarray, np.ndarray]:
+        """Collect the library-query pairs inside the precursor m/z window
+
+        Returns:
+            A tuple of library indices and query indices of the candidate pairs
+        """
+        ref_mz = [s.metadata.get("precursor_mz") or np.nan for s in self.library]
+        query_mz = [
+            self.features.get(int(s.metadata.get("id"))).mz for s in self.queries
+        ]
+        ref_idx, query_idx = UtilityMethodManager.precursor_window_pairs(
+            ref_mz=ref_mz, query_mz=query_mz, max_diff=self.max_precursor_mass_diff
+        )
+        if self.sources is None:
+            return ref_idx, query_idx
+
+        diff = np.abs(
+            np.asarray(ref_mz, dtype=float)[ref_idx]
+            - np.asarray(query_mz, dtype=float)[query_idx]
+        )
+        keep = diff <= self.ref_settings("max_precursor_mass_diff")[ref_idx]
+        return ref_idx[keep], query_idx[keep]
+
+    def matches_by_query(
+        self: Self, q_idx: int, source_nr: Optional[int] = None
+    ) -> Iterator[tuple]:
+        """Yield the scored library matches of a query, sorted by descending score
+
+        Arguments:
+            q_idx: the index of the query spectrum in self.queries
+            source_nr: only yield matches of this source of self.sources (or None)
+
+        Yields:
+            Tuples (matchms.Spectrum, score)
+        """
+        start, stop = np.searchsorted(self.scores["query"], [q_idx, q_idx + 1])
+        for i in range(start, stop):
+            ref = self.scores["ref"][i]
+            if source_nr is None or self.source_idx[ref] == source_nr:
+                yield self.library[ref], self.scores["score"][i]
+
+    def filter_match(
+        self: Self, match: tuple, f_mz: float, settings: Optional[Any] = None
+    ) -> bool:
         """Filter ms2deepscore-derived matches for user-specified params
 
         Arguments:
             match: a tuple of (matchms.Spectrum, score)
             f_mz: the m/z of the matched feature
+            settings: the LibrarySource holding the filters, by default self
 
         Returns:
             A bool indicating if match is inside the settings (True) or not (False)
         """
-        if match[1] < self.score_cutoff:
+        settings = self if settings is None else settings
+        if match[1] < settings.score_cutoff:
             return False
         elif (
             abs(match[0].metadata.get("precursor_mz") - f_mz)
-            > self.max_precursor_mass_diff
+            > settings.max_precursor_mass_diff
         ):
             return False
         else:
             return True
 
+    def best_matches(
+        self: Self, q_idx: int, f_mz: float, source_nr: Optional[int] = None
+    ) -> list:
+        """Return the best-scoring matches of a query that pass the filters
+
+        Since matches are sorted by descending score, collection stops after
+        'max_nr_matches' accepted matches.
+
+        Arguments:
+            q_idx: the index of the query spectrum in self.queries
+            f_mz: the m/z of the matched feature
+            source_nr: only return matches of this source of self.sources (or None)
+
+        Returns:
+            A list of at most 'max_nr_matches' tuples (matchms.Spectrum, score)
+        """
+        settings = self if source_nr is None else self.sources[source_nr]
+        matches = (
+            match
+            for match in self.matches_by_query(q_idx, source_nr)
+            if self.filter_match(match, f_mz, settings)
+        )
+        return list(islice(matches, settings.max_nr_matches))
+
+    @staticmethod
+    def create_match(
+        match: tuple, f_mz: float, library_name: str, kcb_results: Optional[dict]
+    ) -> Match:
+        """Create the Match of a library match
+
+        Arguments:
+            match: a tuple of (matchms.Spectrum, score)
+            f_mz: the m/z of the matched feature
+            library_name: the name of the library
+            kcb_results: the knownclusterblast results for MIBiG matches, else None
+
+        Returns:
+            A Match object of module 'user_library_annotation' or
+            'antismash_kcb_annotation'
+        """
+        if kcb_results is None:
+            match_id = match[0].metadata.get("compound_name")
+            module = "user_library_annotation"
+        else:
+            similarity = ""
+            region = ""
+            mibig_id = ""
+            for id in match[0].metadata.get("mibigaccession").split(","):
+                if id in kcb_results:
+                    similarity = kcb_results[id].get("bgc_sim")
+                    region = kcb_results[id].get("region")
+                    mibig_id = id
+            match_id = (
+                f'{match[0].metadata.get("id")}|'
+                f"{mibig_id}|"
+                f"sim%:{similarity}|"
+                f"{region}"
+            )
+            module = "antismash_kcb_annotation"
+
+        return Match(
+            id=match_id,
+            library=library_name,
+            algorithm="ms2deepscore",
+            score=float(match[1].round(2)),
+            mz=match[0].metadata.get("precursor_mz"),
+            diff_mz=round(abs(match[0].metadata.get("precursor_mz") - f_mz), 4),
+            module=module,
+            smiles=match[0].metadata.get("smiles") or "unknown",
+            inchikey=match[0].metadata.get("inchikey") or "unknown",
+        )
+
     def extract_userlib_scores(self: Self):
         """Extract best matches against user library
 
@@ -166,35 +538,18 @@ class Ms2deepscoreAnnotator(BaseModel):
                 "Did you run 'self.calculate_scores_ms2deepscore()'?"
             )
 
-        for spectrum in self.queries:
+        for q_idx, spectrum in enumerate(self.queries):
             feature = self.features.get(int(spectrum.metadata.get("id")))
 
-            sorted_matches = self.scores.scores_by_query(
-                spectrum, name="MS2DeepScore", sort=True
-            )
-            for match in sorted_matches:
-                if self.filter_match(match, feature.mz):
-                    if feature.Annotations is None:
-                        feature.Annotations = Annotations()
-                    if feature.Annotations.matches is None:
-                        feature.Annotations.matches = []
+            for match in self.best_matches(q_idx, feature.mz):
+                if feature.Annotations is None:
+                    feature.Annotations = Annotations()
+                if feature.Annotations.matches is None:
+                    feature.Annotations.matches = []
 
-                    feature.Annotations.matches.append(
-                        Match(
-                            id=match[0].metadata.get("compound_name"),
-                            library=self.library_name,
-                            algorithm="ms2deepscore",
-                            score=float(match[1].round(2)),
-                            mz=match[0].metadata.get("precursor_mz"),
-                            diff_mz=round(
-                                abs(match[0].metadata.get("precursor_mz") - feature.mz),
-                                4,
-                            ),
-                            module="user_library_annotation",
-                            smiles=match[0].metadata.get("smiles") or "unknown",
-                            inchikey=match[0].metadata.get("inchikey") or "unknown",
-                        )
-                    )
+                feature.Annotations.matches.append(
+                    self.create_match(match, feature.mz, self.library_name, None)
+                )
 
             self.features.modify(int(spectrum.metadata.get("id")), feature)
 
@@ -213,49 +568,50 @@ class Ms2deepscoreAnnotator(BaseModel):
                 "Did you run 'self.calculate_scores_ms2deepscore()'?"
             )
 
-        for spectrum in self.queries:
+        for q_idx, spectrum in enumerate(self.queries):
             feature = self.features.get(int(spectrum.metadata.get("id")))
 
-            sorted_matches = self.scores.scores_by_query(
-                spectrum, name="MS2DeepScore", sort=True
+            for match in self.best_matches(q_idx, feature.mz):
+                if feature.Annotations is None:
+                    feature.Annotations = Annotations()
+                if feature.Annotations.matches is None:
+                    feature.Annotations.matches = []
+
+                feature.Annotations.matches.append(
+                    self.create_match(match, feature.mz, self.library_name, kcb_results)
+                )
+
+            self.features.modify(int(spectrum.metadata.get("id")), feature)
+
+    def extract_source_scores(self: Self):
+        """Extract best matches per source of a combined library
+
+        Matches are filtered with the settings of their source and assigned to its
+        annotation module.
+
+        Raises:
+            RuntimeError: 'self.scores' None - no scores calculated
+        """
+        if self.scores is None or self.sources is None:
+            raise RuntimeError(
+                "'AnnotationManager/Ms2deepscoreAnnotator': 'self.scores' or "
+                "'self.sources' is None. Did you run 'from_sources()' and "
+                "'self.calculate_scores_ms2deepscore()'?"
             )
-            for match in sorted_matches:
-                if self.filter_match(match, feature.mz):
+
+        for q_idx, spectrum in enumerate(self.queries):
+            feature = self.features.get(int(spectrum.metadata.get("id")))
+
+            for source_nr, source in enumerate(self.sources):
+                for match in self.best_matches(q_idx, feature.mz, source_nr):
                     if feature.Annotations is None:
                         feature.Annotations = Annotations()
                     if feature.Annotations.matches is None:
                         feature.Annotations.matches = []
 
-                    mibig_id_list = match[0].metadata.get("mibigaccession").split(",")
-
-                    similarity = ""
-                    region = ""
-                    mibig_id = ""
-                    for id in mibig_id_list:
-                        if id in kcb_results:
-                            similarity = kcb_results[id].get("bgc_sim")
-                            region = kcb_results[id].get("region")
-                            mibig_id = id
-
                     feature.Annotations.matches.append(
-                        Match(
-                            id=(
-                                f'{match[0].metadata.get("id")}|'
-                                f"{mibig_id}|"
-                                f"sim%:{similarity}|"
-                                f"{region}"
-                            ),
-                            library=self.library_name,
-                            algorithm="ms2deepscore",
-                            score=float(match[1].round(2)),
-                            mz=match[0].metadata.get("precursor_mz"),
-                            diff_mz=round(
-                                abs(match[0].metadata.get("precursor_mz") - feature.mz),
-                                4,
-                            ),
-                            module="antismash_kcb_annotation",
-                            smiles=match[0].metadata.get("smiles") or "unknown",
-                            inchikey=match[0].metadata.get("inchikey") or "unknown",
+                        self.create_match(
+                            match, feature.mz, source.library_name, source.kcb_results
                         )
                     )
 
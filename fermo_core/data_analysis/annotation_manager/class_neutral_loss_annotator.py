@@ -22,11 +22,12 @@ SOFTWARE.
 """
 
 import logging
-from typing import Self
+from typing import Any, Optional, Self
 
+import numpy as np
 from pydantic import BaseModel
 
-from fermo_core.config.class_default_settings import NeutralLosses
+from fermo_core.config.class_default_settings import MassLibrary, load_neutral_losses
 from fermo_core.data_processing.builder_feature.dataclass_feature import (
     Annotations,
     Feature,
@@ -48,14 +49,16 @@ class NeutralLossAnnotator(BaseModel):
         stats: Stats object, holds stats on molecular features and samples
         features: Repository object, holds "General Feature" objects
         samples: Repository object, holds "Sample" objects
-        mass: NeutralMasses object storing hardcoded values
+        mass: MassLibrary of all reference losses, loaded lazily once per process
+        references: MassLibrary per tuple of categories
     """
 
     params: ParameterManager
     stats: Stats
     features: Repository
     samples: Repository
-    mass: NeutralLosses = NeutralLosses()
+    mass: Optional[Any] = None
+    references: dict = {}
 
     def return_attributes(self: Self) -> tuple[Repository, ParameterManager]:
         """Returns modified attributes
@@ -99,33 +102,100 @@ class NeutralLossAnnotator(BaseModel):
             feature.Annotations.losses = []
         return feature
 
-    def validate_gen_other_neg_losses(self: Self, feature: Feature) -> Feature:
-        """Validate losses against a list of generic losses of biol/synth origin
+    @staticmethod
+    def format_loss_id(ctgr: str, descr: str, abbr: str) -> str:
+        """Create the neutral loss identifier depending on the reference category
+
+        Arguments:
+            ctgr: the NeutralLosses attribute the reference loss is derived from
+            descr: the reference loss description
+            abbr: the reference loss abbreviation
+
+        Returns:
+            The neutral loss identifier
+        """
+        match ctgr:
+            case "ribosomal":
+                return f"{descr}(ribosomal, putatively from AAs {abbr})"
+            case "nonribo":
+                return f"{descr}({abbr}, putatively from nonribosomal peptide)"
+            case "glycoside":
+                return f"{descr}({abbr}, putatively from glycoside)"
+            case "gen_bio_pos":
+                return f"{descr}({abbr}, putatively from metabolite)"
+            case _:
+                return f"{descr}({abbr})"
+
+    def compile_references(self: Self, ctgrs: tuple[str, ...]) -> MassLibrary:
+        """Select the reference losses of categories from the reference library
+
+        Arguments:
+            ctgrs: a tuple of NeutralLosses attributes holding reference losses
+
+        Returns:
+            A MassLibrary of the reference losses, sorted by mass
+        """
+        if ctgrs not in self.references:
+            if self.mass is None:
+                self.mass = load_neutral_losses()
+            self.references[ctgrs] = self.mass.select(ctgrs)
+        return self.references[ctgrs]
+
+    def validate_losses(
+        self: Self, feature: Feature, ctgrs: tuple[str, ...]
+    ) -> Feature:
+        """Validate losses against the reference losses of one or more categories
 
         Arguments:
             feature: a feature object instance
+            ctgrs: a tuple of NeutralLosses attributes holding reference losses
 
         Returns:
             the modified feature object instance
+
+        Notes:
+            Matches are added in the order of categories, detected losses and
+            reference losses, same as looping over each category separately.
         """
-        for loss in feature.Spectrum.losses.mz:
-            for ref_loss in self.mass.gen_other_neg:
-                ppm = Utils().mass_deviation(
-                    m1=loss, m2=ref_loss.loss, f_id_m2=ref_loss.descr
+        refs = self.compile_references(ctgrs)
+        losses = feature.Spectrum.losses.mz
+
+        l_idx, r_idx, ppm = Utils.match_masses_ppm(
+            queries=losses,
+            refs=refs.mass,
+            mass_dev_ppm=self.params.NeutralLossParameters.mass_dev_ppm,
+        )
+        if len(l_idx) == 0:
+            return feature
+
+        feature = self.add_annotation(feature)
+        for i in np.lexsort((refs.idx[r_idx], l_idx, refs.ctgr[r_idx])):
+            ref = r_idx[i]
+            loss = losses[l_idx[i]]
+            feature.Annotations.losses.append(
+                NeutralLoss(
+                    id=self.format_loss_id(
+                        ctgrs[refs.ctgr[ref]], refs.descr[ref], refs.abbr[ref]
+                    ),
+                    loss_det=loss,
+                    loss_ex=refs.mass[ref],
+                    mz_frag=(feature.mz - loss),
+                    diff=ppm[i],
                 )
-                if ppm < self.params.NeutralLossParameters.mass_dev_ppm:
-                    feature = self.add_annotation(feature)
-                    feature.Annotations.losses.append(
-                        NeutralLoss(
-                            id=f"{ref_loss.descr}({ref_loss.abbr})",
-                            loss_det=loss,
-                            loss_ex=ref_loss.loss,
-                            mz_frag=(feature.mz - loss),
-                            diff=ppm,
-                        )
-                    )
+            )
         return feature
 
+    def validate_gen_other_neg_losses(self: Self, feature: Feature) -> Feature:
+        """Validate losses against a list of generic losses of biol/synth origin
+
+        Arguments:
+            feature: a feature object instance
+
+        Returns:
+            the modified feature object instance
+        """
+        return self.validate_losses(feature, ("gen_other_neg",))
+
     def annotate_feature_pos(self: Self, f_id: int):
         """Annotate neutral losses of feature and store data in General Feature
 
@@ -141,11 +211,10 @@ class NeutralLossAnnotator(BaseModel):
             )
             return
 
-        feature = self.validate_ribosomal_losses(feature)
-        feature = self.validate_nonribosomal_losses(feature)
-        feature = self.validate_glycoside_losses(feature)
-        feature = self.validate_gen_bio_pos_losses(feature)
-        feature = self.validate_gen_other_pos_losses(feature)
+        feature = self.validate_losses(
+            feature,
+            ("ribosomal", "nonribo", "glycoside", "gen_bio_pos", "gen_other_pos"),
+        )
 
         self.features.modify(f_id, feature)
 
@@ -158,26 +227,7 @@ class NeutralLossAnnotator(BaseModel):
         Returns:
             the modified feature object instance
         """
-        for loss in feature.Spectrum.losses.mz:
-            for ref_loss in self.mass.ribosomal:
-                ppm = Utils().mass_deviation(
-                    m1=loss, m2=ref_loss.loss, f_id_m2=ref_loss.descr
-                )
-                if ppm < self.params.NeutralLossParameters.mass_dev_ppm:
-                    feature = self.add_annotation(feature)
-                    feature.Annotations.losses.append(
-                        NeutralLoss(
-                            id=(
-                                f"{ref_loss.descr}(ribosomal, putatively from AAs "
-                                f"{ref_loss.abbr})"
-                            ),
-                            loss_det=loss,
-                            loss_ex=ref_loss.loss,
-                            mz_frag=(feature.mz - loss),
-                            diff=ppm,
-                        )
-                    )
-        return feature
+        return self.validate_losses(feature, ("ribosomal",))
 
     def validate_nonribosomal_losses(self: Self, feature: Feature) -> Feature:
         """Validate losses against a list of losses derived from nonribosomal peptides
@@ -188,26 +238,7 @@ class NeutralLossAnnotator(BaseModel):
         Returns:
             the modified feature object instance
         """
-        for loss in feature.Spectrum.losses.mz:
-            for ref_loss in self.mass.nonribo:
-                ppm = Utils().mass_deviation(
-                    m1=loss, m2=ref_loss.loss, f_id_m2=ref_loss.descr
-                )
-                if ppm < self.params.NeutralLossParameters.mass_dev_ppm:
-                    feature = self.add_annotation(feature)
-                    feature.Annotations.losses.append(
-                        NeutralLoss(
-                            id=(
-                                f"{ref_loss.descr}({ref_loss.abbr}, putatively from "
-                                f"nonribosomal peptide)"
-                            ),
-                            loss_det=loss,
-                            loss_ex=ref_loss.loss,
-                            mz_frag=(feature.mz - loss),
-                            diff=ppm,
-                        )
-                    )
-        return feature
+        return self.validate_losses(feature, ("nonribo",))
 
     def validate_glycoside_losses(self: Self, feature: Feature) -> Feature:
         """Validate losses against a list of glycoside losses
@@ -218,26 +249,7 @@ class NeutralLossAnnotator(BaseModel):
         Returns:
             the modified feature object instance
         """
-        for loss in feature.Spectrum.losses.mz:
-            for ref_loss in self.mass.glycoside:
-                ppm = Utils().mass_deviation(
-                    m1=loss, m2=ref_loss.loss, f_id_m2=ref_loss.descr
-                )
-                if ppm < self.params.NeutralLossParameters.mass_dev_ppm:
-                    feature = self.add_annotation(feature)
-                    feature.Annotations.losses.append(
-                        NeutralLoss(
-                            id=(
-                                f"{ref_loss.descr}({ref_loss.abbr}, putatively from "
-                                f"glycoside)"
-                            ),
-                            loss_det=loss,
-                            loss_ex=ref_loss.loss,
-                            mz_frag=(feature.mz - loss),
-                            diff=ppm,
-                        )
-                    )
-        return feature
+        return self.validate_losses(feature, ("glycoside",))
 
     def validate_gen_bio_pos_losses(self: Self, feature: Feature) -> Feature:
         """Validate losses against a list of generic losses of biological origin
@@ -248,26 +260,7 @@ class NeutralLossAnnotator(BaseModel):
         Returns:
             the modified feature object instance
         """
-        for loss in feature.Spectrum.losses.mz:
-            for ref_loss in self.mass.gen_bio_pos:
-                ppm = Utils().mass_deviation(
-                    m1=loss, m2=ref_loss.loss, f_id_m2=ref_loss.descr
-                )
-                if ppm < self.params.NeutralLossParameters.mass_dev_ppm:
-                    feature = self.add_annotation(feature)
-                    feature.Annotations.losses.append(
-                        NeutralLoss(
-                            id=(
-                                f"{ref_loss.descr}({ref_loss.abbr}, putatively from "
-                                f"metabolite)"
-                            ),
-                            loss_det=loss,
-                            loss_ex=ref_loss.loss,
-                            mz_frag=(feature.mz - loss),
-                            diff=ppm,
-                        )
-                    )
-        return feature
+        return self.validate_losses(feature, ("gen_bio_pos",))
 
     def validate_gen_other_pos_losses(self: Self, feature: Feature) -> Feature:
         """Validate losses against a list of generic losses of biol/synth origin
@@ -278,23 +271,7 @@ class NeutralLossAnnotator(BaseModel):
         Returns:
             the modified feature object instance
         """
-        for loss in feature.Spectrum.losses.mz:
-            for ref_loss in self.mass.gen_other_pos:
-                ppm = Utils().mass_deviation(
-                    m1=loss, m2=ref_loss.loss, f_id_m2=ref_loss.descr
-                )
-                if ppm < self.params.NeutralLossParameters.mass_dev_ppm:
-                    feature = self.add_annotation(feature)
-                    feature.Annotations.losses.append(
-                        NeutralLoss(
-                            id=f"{ref_loss.descr}({ref_loss.abbr})",
-                            loss_det=loss,
-                            loss_ex=ref_loss.loss,
-                            mz_frag=(feature.mz - loss),
-                            diff=ppm,
-                        )
-                    )
-        return feature
+        return self.validate_losses(feature, ("gen_other_pos",))
 
     def run_analysis(self: Self):
         """Organizes calling of data analysis steps."""
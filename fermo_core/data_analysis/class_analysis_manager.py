@@ -85,6 +85,11 @@ class AnalysisManager(BaseModel):
         self.run_sample_group_analysis()
         self.run_phenotype_manager()
         self.run_sim_networks_manager()
+        if getattr(self.params.ShardNetworkingParameters, "step", None) == "plan":
+            logger.info(
+                "'AnalysisManager': planned sharded networking - stopped analysis."
+            )
+            return
         self.run_annotation_manager()
         self.run_score_assignment()
         self.run_chrom_trace_calculator()
@@ -316,3 +321,36 @@ class AnalysisManager(BaseModel):
             logger.error(f"ChromTraceCalculator failed: {e}")
             logger.error("ChromTraceCalculator terminated prematurely - SKIP")
             return
+
+    def rethreshold_networks(self: Self, score_cutoff: float, max_nr_links: int):
+        """Rebuild the modified cosine network of an analyzed run for new thresholds
+
+        The network is created from the candidate edges stored with the run
+        ('store_candidates'); the sample scores are assigned again.
+
+        Arguments:
+            score_cutoff: the new minimum similarity score between two spectra
+            max_nr_links: the new max nr of connections from a node
+
+        Raises:
+            RuntimeError: no candidate edges stored that reach down to score_cutoff
+        """
+        sim_networks_manager = SimNetworksManager(
+            params=self.params,
+            stats=self.stats,
+            features=self.features,
+            samples=self.samples,
+        )
+        sim_networks_manager.rethreshold(score_cutoff, max_nr_links)
+        (self.stats, self.features, self.samples, self.params) = (
+            sim_networks_manager.return_attrs()
+        )
+
+        score_assigner = ScoreAssigner(
+            params=self.params,
+            stats=self.stats,
+            features=self.features,
+            samples=self.samples,
+        )
+        score_assigner.assign_sample_scores()
+        self.features, self.samples = score_assigner.return_attributes()
@@ -22,6 +22,7 @@ SOFTWARE.
 """
 
 import logging
+from collections import Counter
 from statistics import mean
 from typing import Self
 
@@ -105,22 +106,21 @@ class ScoreAssigner(BaseModel):
             if len(network.summary) == 0:
                 continue
 
+            clusters = network.feature_clusters()
             self.networks[algorithm] = {}
             for s_id in self.stats.samples:
-                self.networks[algorithm][s_id] = set()
-
                 sample = self.samples.get(s_id)
-                for cluster_id, f_id_set in network.summary.items():
-                    if not f_id_set.isdisjoint(sample.feature_ids):
-                        self.networks[algorithm][s_id].add(cluster_id)
-
-                        if sample.networks is None:
-                            sample.networks = {}
-                        if sample.networks.get(algorithm) is None:
-                            sample.networks[algorithm] = {cluster_id}
-                        else:
-                            sample.networks[algorithm].add(cluster_id)
-                        self.samples.modify(s_id, sample)
+                self.networks[algorithm][s_id] = {
+                    clusters[f_id] for f_id in sample.feature_ids if f_id in clusters
+                }
+
+                if len(self.networks[algorithm][s_id]) != 0:
+                    if sample.networks is None:
+                        sample.networks = {}
+                    sample.networks[algorithm] = set(self.networks[algorithm][s_id])
+                elif sample.networks is not None:
+                    sample.networks.pop(algorithm, None)
+                self.samples.modify(s_id, sample)
 
     def assign_sample_scores(self: Self):
         """Assign scores to sample objects"""
@@ -134,6 +134,13 @@ class ScoreAssigner(BaseModel):
             )
             return
 
+        nr_samples = {
+            algorithm: Counter(
+                cluster_id for nw_set in network.values() for cluster_id in nw_set
+            )
+            for algorithm, network in self.networks.items()
+        }
+
         for s_id in self.stats.samples:
             sample = self.samples.get(s_id)
             sample.Scores = SampleScores()
@@ -147,12 +154,9 @@ class ScoreAssigner(BaseModel):
 
             nm_specificity = {}
             for algorithm, network in self.networks.items():
-                nws_other_samples = set()
-                for sample_id, nw_set in network.items():
-                    if sample_id != s_id:
-                        nws_other_samples.update(nw_set)
-                nm_specificity[algorithm] = len(
-                    network[s_id].difference(nws_other_samples)
+                nm_specificity[algorithm] = sum(
+                    nr_samples[algorithm][cluster_id] == 1
+                    for cluster_id in network[s_id]
                 ) / len(self.stats.networks[algorithm].summary)
             sample.Scores.specificity = max(
                 [val for key, val in nm_specificity.items()]
@@ -0,0 +1,193 @@
+"""Spectral similarity networks built on edge arrays.
+
+Copyright (c) 2022 to present Mitja Maximilian Zdouc, PhD
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from collections.abc import Iterator
+from typing import Any, Optional, Self
+
+import networkx
+import numpy as np
+from pydantic import BaseModel
+from scipy import sparse
+
+from fermo_core.utils.class_sparse_scores import SparseScores
+
+
+class ArrayNetwork(BaseModel):
+    """Pydantic-based class to organize a spectral similarity network as edge arrays
+
+    Links are selected as by the 'mutual' link method of the matchms
+    SimilarityNetwork: a pair is linked if both spectra rank each other among their
+    'max_nr_links' highest-scoring partners reaching the cutoff (ties ranked by the
+    higher index first). Clusters are the connected components, unconnected spectra
+    forming single-node clusters. networkx Graph objects are only created on demand.
+
+    Attributes:
+        ids: the feature ID of each node, by index
+        rows: the first node index of each link
+        cols: the second node index of each link
+        weights: the score of each link
+        labels: the cluster ID of each node, by index
+    """
+
+    ids: list
+    rows: Optional[Any] = None
+    cols: Optional[Any] = None
+    weights: Optional[Any] = None
+    labels: Optional[Any] = None
+
+    def build(
+        self: Self, scores: SparseScores, score_cutoff: float, max_nr_links: int
+    ) -> Self:
+        """Select the mutual top-n links and label the connected components
+
+        Arguments:
+            scores: the SparseScores of the networked spectra
+            score_cutoff: the minimum score of a link
+            max_nr_links: the max nr of highest-scoring partners linked per node
+
+        Returns:
+            The ArrayNetwork instance
+        """
+        keep = scores.scores >= score_cutoff
+        rows, cols, weights = (
+            scores.rows[keep],
+            scores.cols[keep],
+            scores.scores[keep],
+        )
+        nr_pairs = len(rows)
+
+        source = np.concatenate((rows, cols))
+        target = np.concatenate((cols, rows))
+        order = np.lexsort((-target, -np.tile(weights, 2), source))
+        starts = np.searchsorted(source[order], source[order], side="left")
+        rank = np.empty(2 * nr_pairs, dtype=int)
+        rank[order] = np.arange(2 * nr_pairs) - starts
+
+        mutual = (rank[:nr_pairs] < max_nr_links) & (rank[nr_pairs:] < max_nr_links)
+        self.rows, self.cols, self.weights = rows[mutual], cols[mutual], weights[mutual]
+
+        adjacency = sparse.coo_matrix(
+            (np.ones(len(self.rows)), (self.rows, self.cols)),
+            shape=(len(self.ids), len(self.ids)),
+        )
+        _, self.labels = sparse.csgraph.connected_components(adjacency, directed=False)
+        return self
+
+    @staticmethod
+    def group(labels: np.ndarray, nr_groups: int) -> tuple[np.ndarray, np.ndarray]:
+        """Order indices by their label
+
+        Arguments:
+            labels: the label of each index
+            nr_groups: the number of labels
+
+        Returns:
+            A tuple of the indices ordered by label and the start of each label
+        """
+        order = np.argsort(labels, kind="stable")
+        return order, np.searchsorted(labels[order], np.arange(nr_groups + 1))
+
+    def clusters(self: Self) -> dict[int, set]:
+        """Return the feature IDs of each cluster
+
+        Returns:
+            A dict of cluster IDs and the contained feature IDs
+        """
+        ids = np.asarray(self.ids)
+        nr_clusters = self.labels.max(initial=-1) + 1
+        order, bounds = self.group(self.labels, nr_clusters)
+        return {
+            label: set(ids[order[bounds[label] : bounds[label + 1]]].tolist())
+            for label in range(nr_clusters)
+        }
+
+    def create_graph(
+        self: Self, nodes: np.ndarray, links: np.ndarray
+    ) -> networkx.Graph:
+        """Create a networkx Graph of the given nodes and links
+
+        Arguments:
+            nodes: the node indices
+            links: the link indices
+
+        Returns:
+            A networkx Graph with feature IDs as nodes and scores as 'weight'
+        """
+        ids = np.asarray(self.ids)
+        graph = networkx.Graph()
+        graph.add_nodes_from(ids[nodes].tolist())
+        graph.add_weighted_edges_from(
+            zip(
+                ids[self.rows[links]].tolist(),
+                ids[self.cols[links]].tolist(),
+                self.weights[links].astype(float).tolist(),
+            )
+        )
+        return graph
+
+    def to_networkx(self: Self) -> networkx.Graph:
+        """Create a networkx Graph of the full network
+
+        Returns:
+            A networkx Graph with feature IDs as nodes and scores as 'weight'
+        """
+        return self.create_graph(np.arange(len(self.ids)), np.arange(len(self.rows)))
+
+    def iter_subnetworks(self: Self) -> Iterator[tuple[int, networkx.Graph]]:
+        """Create a networkx Graph per cluster, one at a time
+
+        Yields:
+            A tuple of the cluster ID and a Graph object named by the cluster ID
+        """
+        nr_clusters = self.labels.max(initial=-1) + 1
+        nodes, node_bounds = self.group(self.labels, nr_clusters)
+        links, link_bounds = self.group(self.labels[self.rows], nr_clusters)
+
+        for label in range(nr_clusters):
+            subnetwork = self.create_graph(
+                nodes[node_bounds[label] : node_bounds[label + 1]],
+                links[link_bounds[label] : link_bounds[label + 1]],
+            )
+            subnetwork.graph["name"] = label
+            yield label, subnetwork
+
+    def subnetworks(self: Self) -> dict[int, networkx.Graph]:
+        """Create a networkx Graph per cluster
+
+        Returns:
+            A dict of cluster IDs and Graph objects named by the cluster ID
+        """
+        return dict(self.iter_subnetworks())
+
+    def to_cytoscape(self: Self) -> dict[int, dict]:
+        """Create the cytoscape JSON data of each cluster
+
+        The subnetwork Graph objects are discarded after conversion.
+
+        Returns:
+            A dict of cluster IDs and cytoscape JSON data
+        """
+        return {
+            label: networkx.cytoscape_data(subnetwork)
+            for label, subnetwork in self.iter_subnetworks()
+        }
@@ -0,0 +1,226 @@
+"""Persisted candidate edges of a spectral similarity network.
+
+Copyright (c) 2022 to present Mitja Maximilian Zdouc, PhD
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import json
+import logging
+from pathlib import Path
+from typing import Optional, Self
+
+import numpy as np
+from pydantic import BaseModel
+
+from fermo_core.utils.class_embedding_cache import EmbeddingCache
+from fermo_core.utils.class_sparse_scores import SparseScores
+
+logger = logging.getLogger("fermo_core")
+
+
+class EdgeStore(BaseModel):
+    """Pydantic-based class to organize the persisted candidate edges of a network
+
+    The candidate edges (the SparseScores of a networking run) are saved as a npz
+    file together with the keys of the networked spectra and the settings they
+    were calculated with. A later run with the same settings only scores the
+    spectra not stored yet against all spectra; stored spectra are recognized by
+    their key, independent of their feature ID.
+
+    Attributes:
+        filepath: the npz file holding the edges
+        settings: the settings the edges depend on
+        keys: the keys of the stored spectra, by index
+        scores: the stored SparseScores (or None)
+    """
+
+    filepath: Path
+    settings: dict
+    keys: list = []
+    scores: Optional[SparseScores] = None
+
+    @staticmethod
+    def spectrum_keys(spectra: list) -> list[str]:
+        """Return the keys identifying the peaks and precursor of spectra
+
+        Arguments:
+            spectra: a list of matchms Spectrum objects
+
+        Returns:
+            A list of keys in the order of spectra
+        """
+        return [EmbeddingCache.spectrum_key(s, ("precursor_mz",)) for s in spectra]
+
+    def load(self: Self, min_score: Optional[float] = None) -> Self:
+        """Load the stored edges if calculated with the same settings
+
+        With 'min_score', edges stored with any 'score_cutoff' up to 'min_score'
+        are accepted too: they hold all pairs reaching 'min_score'.
+
+        Arguments:
+            min_score: the minimum score of the pairs needed (or None)
+
+        Returns:
+            The EdgeStore instance
+        """
+        self.keys = []
+        self.scores = None
+        if not self.filepath.exists():
+            return self
+
+        try:
+            with np.load(self.filepath) as data:
+                if not self.covers(json.loads(str(data["settings"])), min_score):
+                    logger.info(
+                        f"'EdgeStore': edges in '{self.filepath.name}' were "
+                        f"calculated with other settings - SKIP"
+                    )
+                    return self
+                self.keys = data["keys"].tolist()
+                self.scores = SparseScores(
+                    ids=list(range(len(self.keys))),
+                    score_cutoff=float(data["score_cutoff"]),
+                    rows=data["rows"],
+                    cols=data["cols"],
+                    scores=data["scores"],
+                )
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(str(e))
+            logger.warning(f"'EdgeStore': could not read '{self.filepath.name}' - SKIP")
+        return self
+
+    def covers(self: Self, stored: dict, min_score: Optional[float]) -> bool:
+        """Check if stored edges hold the pairs of the current settings
+
+        Arguments:
+            stored: the settings the stored edges were calculated with
+            min_score: the minimum score of the pairs needed (or None)
+
+        Returns:
+            A bool indicating if the stored edges can be used
+        """
+        settings = json.loads(json.dumps(self.settings))
+        if min_score is None:
+            return stored == settings
+        return {**stored, "score_cutoff": None} == {
+            **settings,
+            "score_cutoff": None,
+        } and stored.get("score_cutoff", 1.0) <= min_score
+
+    def save(self: Self, keys: list, scores: SparseScores):
+        """Write the edges and spectrum keys, replacing the previous file
+
+        Arguments:
+            keys: the keys of the networked spectra, by index
+            scores: the SparseScores of the networked spectra
+        """
+        temp = self.filepath.with_name(f".{self.filepath.name}.tmp.npz")
+        try:
+            np.savez(
+                temp,
+                settings=np.array(json.dumps(self.settings, sort_keys=True)),
+                keys=np.array(keys, dtype=str),
+                score_cutoff=np.array(scores.score_cutoff),
+                rows=scores.rows,
+                cols=scores.cols,
+                scores=scores.scores,
+            )
+            temp.replace(self.filepath)
+        except OSError as e:
+            logger.warning(str(e))
+            logger.warning(
+                f"'EdgeStore': could not write '{self.filepath.name}' - SKIP"
+            )
+            temp.unlink(missing_ok=True)
+
+    def reorder(
+        self: Self, features: tuple, keys: list, top_n: bool = False
+    ) -> tuple[tuple, list, int, np.ndarray, np.ndarray, np.ndarray]:
+        """Order the features stored ones first and map the stored edges to them
+
+        With 'top_n', the stored edges of a spectrum are only its highest-scoring
+        partners; if one of them is no longer networked, the others do not hold
+        its current top partners anymore and the spectrum is scored again as new.
+
+        Arguments:
+            features: the feature IDs to network
+            keys: the spectrum keys of the features
+            top_n: the stored edges are the top partners of each spectrum
+
+        Returns:
+            A tuple of the ordered features, their keys, the number of stored
+            features and the rows, columns and scores of their stored edges
+        """
+        if self.scores is None:
+            empty = np.zeros(0, dtype=int)
+            return features, keys, 0, empty, empty, np.zeros(0, dtype=np.float32)
+
+        stored = {}
+        for row, key in enumerate(self.keys):
+            stored.setdefault(key, row)
+
+        old, new, matched = [], [], set()
+        for f_id, key in zip(features, keys):
+            if key in stored and key not in matched:
+                matched.add(key)
+                old.append((f_id, key))
+            else:
+                new.append((f_id, key))
+
+        position = self.positions(stored, old)
+        if top_n:
+            removed = position < 0
+            stale = np.concatenate(
+                (
+                    position[self.scores.rows[removed[self.scores.cols]]],
+                    position[self.scores.cols[removed[self.scores.rows]]],
+                )
+            )
+            stale = set(stale[stale >= 0].tolist())
+            if len(stale) != 0:
+                new = [old[i] for i in sorted(stale)] + new
+                old = [entry for i, entry in enumerate(old) if i not in stale]
+                position = self.positions(stored, old)
+
+        rows, cols = position[self.scores.rows], position[self.scores.cols]
+        keep = (rows >= 0) & (cols >= 0)
+
+        return (
+            tuple(f_id for f_id, _ in old + new),
+            [key for _, key in old + new],
+            len(old),
+            rows[keep],
+            cols[keep],
+            self.scores.scores[keep],
+        )
+
+    def positions(self: Self, stored: dict, old: list) -> np.ndarray:
+        """Map the stored spectra to their index among the stored features
+
+        Arguments:
+            stored: the keys of the stored spectra, key to row
+            old: the (feature ID, key) tuples of the stored features, in order
+
+        Returns:
+            The index of each stored spectrum, -1 if no longer networked
+        """
+        position = np.full(len(self.keys), -1)
+        position[[stored[key] for _, key in old]] = np.arange(len(old))
+        return position
@@ -22,15 +22,24 @@ SOFTWARE.
 """
 
 import logging
+from concurrent.futures import ProcessPoolExecutor
 
 import matchms
-import networkx
+import numpy as np
 
+from fermo_core.data_analysis.sim_networks_manager.class_array_network import (
+    ArrayNetwork,
+)
 from fermo_core.data_processing.class_repository import Repository
 from fermo_core.input_output.param_handlers import SpecSimNetworkCosineParameters
+from fermo_core.utils.class_batched_mod_cosine import BatchedModifiedCosine
+from fermo_core.utils.class_cosine_prescreen import CosinePrescreen
+from fermo_core.utils.class_sparse_scores import SparseScores
 
 logger = logging.getLogger("fermo_core")
 
+WORKER_STATE: dict = {}
+
 
 class ModCosineNetworker:
     """Class for calling and logging modified cosine spect. sim. networking"""
@@ -40,18 +49,25 @@ class ModCosineNetworker:
         features: tuple,
         feature_repo: Repository,
         settings: SpecSimNetworkCosineParameters,
-    ) -> matchms.Scores:
+        nr_old: int = 0,
+    ) -> SparseScores:
         """Calls modified cosine based spectral similarity networking.
 
+        The upper triangle of the all-vs-all matrix is scored tile-wise and only
+        pairs reaching 'score_cutoff' are kept ('candidate_floor' if lower and
+        'store_candidates'). With 'prescreen', only pairs whose binned upper bound
+        reaches this cutoff are scored exactly. With
+        'nr_workers' > 1, the tiles are scored in a process pool. With 'nr_old',
+        pairs among the first 'nr_old' features are not scored.
+
         Arguments:
             features: a tuple of feature IDs to consider in networking
             feature_repo: containing GeneralFeature objects with feature info
             settings: containing given filter parameters
+            nr_old: the number of leading features whose pairs are already scored
 
         Returns:
-            A matchms Scores object
-
-
+            A SparseScores object of the retained pairs
         """
         spectra = []
 
@@ -59,38 +75,181 @@ class ModCosineNetworker:
             feature = feature_repo.get(f_id)
             spectra.append(feature.Spectrum)
 
-        sim_algorithm = matchms.similarity.ModifiedCosine(
-            tolerance=settings.fragment_tol
+        scores = SparseScores(
+            ids=[s.get("id") for s in spectra],
+            score_cutoff=ModCosineNetworker.candidate_cutoff(settings),
         )
+        tiles = ModCosineNetworker.create_tiles(
+            len(spectra), settings.tile_size, nr_old
+        )
+        prescreen = None
+        if settings.prescreen:
+            prescreen = CosinePrescreen(tolerance=settings.fragment_tol).build(spectra)
+
+        if settings.nr_workers > 1:
+            logger.info(
+                f"'ModCosineNetworker': scoring '{len(spectra)}' spectra in "
+                f"'{len(tiles)}' tiles on '{settings.nr_workers}' worker processes"
+            )
+            with ProcessPoolExecutor(
+                max_workers=settings.nr_workers,
+                initializer=ModCosineNetworker.init_worker,
+                initargs=(spectra, settings, prescreen),
+            ) as executor:
+                for result in executor.map(ModCosineNetworker.score_tile, tiles):
+                    scores.append(*result)
+        else:
+            for tile in tiles:
+                scores.append(
+                    *ModCosineNetworker.score_block(spectra, settings, tile, prescreen)
+                )
+
+        return scores.finalize()
+
+    @staticmethod
+    def edge_settings(settings: SpecSimNetworkCosineParameters) -> dict:
+        """Return the settings the retained pairs depend on
+
+        Arguments:
+            settings: containing given filter parameters
+
+        Returns:
+            A dict of the settings
+        """
+        return {
+            "algorithm": "modified_cosine",
+            "fragment_tol": settings.fragment_tol,
+            "score_cutoff": ModCosineNetworker.candidate_cutoff(settings),
+        }
+
+    @staticmethod
+    def candidate_cutoff(settings: SpecSimNetworkCosineParameters) -> float:
+        """Return the minimum score of the retained pairs
+
+        With 'store_candidates', pairs down to 'candidate_floor' are retained to
+        allow re-thresholding the network later without scoring again.
+
+        Arguments:
+            settings: containing given filter parameters
+
+        Returns:
+            The minimum score of a retained pair
+        """
+        if settings.store_candidates:
+            return min(settings.candidate_floor, settings.score_cutoff)
+        return settings.score_cutoff
+
+    @staticmethod
+    def create_tiles(nr_spectra: int, tile_size: int, nr_old: int = 0) -> list[tuple]:
+        """Split the upper triangle of the all-vs-all matrix into tiles
+
+        Arguments:
+            nr_spectra: the number of spectra
+            tile_size: the number of rows and columns per tile
+            nr_old: the number of leading spectra whose pairs are left out
+
+        Returns:
+            A list of tuples (row start, row stop, column start, column stop)
+        """
+        old = [(r, min(r + tile_size, nr_old)) for r in range(0, nr_old, tile_size)]
+        new = [
+            (c, min(c + tile_size, nr_spectra))
+            for c in range(nr_old, nr_spectra, tile_size)
+        ]
+        return [(*r, *c) for r in old + new for c in new if c[0] >= r[0]]
+
+    @staticmethod
+    def init_worker(
+        spectra: list,
+        settings: SpecSimNetworkCosineParameters,
+        prescreen: CosinePrescreen | None = None,
+    ):
+        """Store the spectra, settings and prescreen once per worker process
+
+        Arguments:
+            spectra: the matchms Spectrum objects to network
+            settings: containing given filter parameters
+            prescreen: the CosinePrescreen of the spectra (or None)
+        """
+        WORKER_STATE["spectra"] = spectra
+        WORKER_STATE["settings"] = settings
+        WORKER_STATE["prescreen"] = prescreen
+
+    @staticmethod
+    def score_tile(tile: tuple) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Score a tile of the all-vs-all matrix in a worker process
 
-        return matchms.calculate_scores(
-            references=spectra,
-            queries=spectra,
-            similarity_function=sim_algorithm,
-            is_symmetric=True,
+        Arguments:
+            tile: a tuple (row start, row stop, column start, column stop)
+
+        Returns:
+            A tuple of rows, columns and scores of the pairs reaching the cutoff
+        """
+        return ModCosineNetworker.score_block(
+            WORKER_STATE["spectra"],
+            WORKER_STATE["settings"],
+            tile,
+            WORKER_STATE.get("prescreen"),
         )
 
+    @staticmethod
+    def score_block(
+        spectra: list,
+        settings: SpecSimNetworkCosineParameters,
+        tile: tuple,
+        prescreen: CosinePrescreen | None = None,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Score a tile of the all-vs-all matrix
+
+        With a prescreen, only the candidate pairs of the tile are scored.
+
+        Arguments:
+            spectra: the matchms Spectrum objects to network
+            settings: containing given filter parameters
+            tile: a tuple (row start, row stop, column start, column stop)
+            prescreen: the CosinePrescreen of the spectra (or None)
+
+        Returns:
+            A tuple of rows, columns and scores of the pairs reaching the cutoff
+        """
+        r_start, r_stop, c_start, c_stop = tile
+
+        if settings.backend == "numpy":
+            sim_algorithm = BatchedModifiedCosine(tolerance=settings.fragment_tol)
+        else:
+            sim_algorithm = matchms.similarity.ModifiedCosine(
+                tolerance=settings.fragment_tol
+            )
+
+        cutoff = ModCosineNetworker.candidate_cutoff(settings)
+        if prescreen is not None:
+            rows, cols = prescreen.candidates(tile, cutoff)
+            scores = sim_algorithm.sparse_array(spectra, spectra, rows, cols)["score"]
+            keep = scores >= cutoff
+            return rows[keep], cols[keep], scores[keep]
+
+        diagonal = r_start == c_start
+        scores = sim_algorithm.matrix(
+            spectra[r_start:r_stop], spectra[c_start:c_stop], is_symmetric=diagonal
+        )["score"]
+        rows, cols = np.nonzero(scores >= cutoff)
+        if diagonal:
+            rows, cols = rows[rows < cols], cols[rows < cols]
+        return rows + r_start, cols + c_start, scores[rows, cols]
+
     @staticmethod
     def create_network(
-        scores: matchms.Scores, settings: SpecSimNetworkCosineParameters
-    ) -> networkx.Graph:
-        """Process scores object and generate network
+        scores: SparseScores, settings: SpecSimNetworkCosineParameters
+    ) -> ArrayNetwork:
+        """Select the mutual top-n links of the scores and label the clusters
 
         Arguments:
             scores: holding spectral similarity scores information
             settings: parameter settings
 
         Returns:
-            A networkx Graph object of the created network
+            An ArrayNetwork object of the created network
         """
-        network = matchms.networking.SimilarityNetwork(
-            identifier_key="id",
-            score_cutoff=settings.score_cutoff,
-            max_links=settings.max_nr_links,
-            top_n=settings.max_nr_links,
-            link_method="mutual",
+        return ArrayNetwork(ids=[int(f_id) for f_id in scores.ids]).build(
+            scores, settings.score_cutoff, settings.max_nr_links
         )
-
-        network.create_network(scores, "ModifiedCosine_score")
-
-        return network.graph
@@ -24,14 +24,16 @@ SOFTWARE.
 import logging
 from urllib.parse import urlparse
 
-import matchms
-import networkx
-from ms2deepscore import MS2DeepScore
-from ms2deepscore.models import load_model
+import numpy as np
 
 from fermo_core.config.class_default_settings import DefaultPaths
+from fermo_core.data_analysis.sim_networks_manager.class_array_network import (
+    ArrayNetwork,
+)
 from fermo_core.data_processing.class_repository import Repository
 from fermo_core.input_output.param_handlers import SpecSimNetworkDeepscoreParameters
+from fermo_core.utils.class_embedding_cache import CachedMS2DeepScore
+from fermo_core.utils.class_sparse_scores import SparseScores
 
 logger = logging.getLogger("fermo_core")
 
@@ -44,16 +46,25 @@ class Ms2deepscoreNetworker:
         features: tuple,
         feature_repo: Repository,
         settings: SpecSimNetworkDeepscoreParameters,
-    ) -> matchms.Scores:
+        nr_old: int = 0,
+    ) -> SparseScores:
         """Calls ms2deepscore based spectral similarity networking.
 
+        The spectra are embedded once and normalized; the cosine similarity matrix
+        is calculated in row blocks as float32 matrix products. Per row, only the
+        'max_nr_links' highest-scoring partners (and their ties) reaching
+        'score_cutoff' are kept: all candidates of the mutual top-n links. With
+        'nr_old', the first 'nr_old' features are only compared to the others,
+        whose rows are complete.
+
         Arguments:
             features: a tuple of feature IDs to consider in networking
             feature_repo: containing GeneralFeature objects with feature info
             settings: containing given filter parameters
+            nr_old: the number of leading features whose pairs are already scored
 
         Returns:
-            A matchms Scores object
+            A SparseScores object of the retained pairs
 
         Raises:
             FileNotFoundError: could not open model file
@@ -67,39 +78,114 @@ class Ms2deepscoreNetworker:
             feature = feature_repo.get(f_id)
             spectra.append(feature.Spectrum)
 
-        file = urlparse(DefaultPaths().url_ms2deepscore_pos).path.split("/")[-1]
-        model = load_model(DefaultPaths().dirpath_ms2deepscore_pos.joinpath(file))
+        vectors = Ms2deepscoreNetworker.embed(spectra, settings)
+
+        scores = SparseScores(
+            ids=[s.get("id") for s in spectra], score_cutoff=settings.score_cutoff
+        )
+        block_size = max(1, min(1024, 2**24 // max(len(vectors), 1)))
+        for first, stop, col_start in ((0, nr_old, nr_old), (nr_old, len(vectors), 0)):
+            for start in range(first, stop, block_size):
+                scores.append(
+                    *Ms2deepscoreNetworker.top_links(
+                        vectors,
+                        start,
+                        min(block_size, stop - start),
+                        settings.max_nr_links,
+                        col_start,
+                    )
+                )
+        return scores.finalize()
+
+    @staticmethod
+    def embed(spectra: list, settings: SpecSimNetworkDeepscoreParameters) -> np.ndarray:
+        """Calculate the unit-length float32 embeddings of spectra
+
+        Arguments:
+            spectra: a list of matchms Spectrum objects
+            settings: containing given filter parameters
 
-        sim_algorithm = MS2DeepScore(model=model, progress_bar=False)
+        Returns:
+            An array of embeddings in the order of spectra
 
-        return matchms.calculate_scores(
-            references=spectra,
-            queries=spectra,
-            similarity_function=sim_algorithm,
-            is_symmetric=True,
+        Raises:
+            FileNotFoundError: could not open model file
+        """
+        file = urlparse(DefaultPaths().url_ms2deepscore_pos).path.split("/")[-1]
+        model_path = DefaultPaths().dirpath_ms2deepscore_pos.joinpath(file)
+        sim_algorithm = CachedMS2DeepScore(
+            model_path=model_path,
+            backend=settings.backend,
+            batch_size=settings.batch_size,
+            nr_threads=settings.nr_threads,
         )
 
+        vectors = sim_algorithm.calculate_vectors(spectra).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+    @staticmethod
+    def edge_settings(settings: SpecSimNetworkDeepscoreParameters) -> dict:
+        """Return the settings the retained pairs depend on
+
+        Arguments:
+            settings: containing given filter parameters
+
+        Returns:
+            A dict of the settings
+        """
+        return {
+            "algorithm": "ms2deepscore",
+            "model": urlparse(DefaultPaths().url_ms2deepscore_pos).path.split("/")[-1],
+            "score_cutoff": settings.score_cutoff,
+            "max_nr_links": settings.max_nr_links,
+        }
+
+    @staticmethod
+    def top_links(
+        vectors: np.ndarray,
+        start: int,
+        block_size: int,
+        max_nr_links: int,
+        col_start: int = 0,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Calculate a row block of the similarity matrix and keep the top partners
+
+        Arguments:
+            vectors: the unit-length float32 embeddings of all spectra
+            start: the first row of the block
+            block_size: the number of rows of the block
+            max_nr_links: the number of highest-scoring partners kept per row
+            col_start: the first column compared to
+
+        Returns:
+            A tuple of rows, columns and scores of the kept pairs, ties included
+        """
+        block = vectors[start : start + block_size] @ vectors[col_start:].T
+        block_rows = np.arange(len(block))
+        diagonal = block_rows + start >= col_start
+        block[block_rows[diagonal], block_rows[diagonal] + start - col_start] = -np.inf
+
+        if max_nr_links < block.shape[1]:
+            kth = -np.partition(-block, max_nr_links - 1, axis=1)[:, max_nr_links - 1]
+            rows, cols = np.nonzero(block >= kth[:, np.newaxis])
+        else:
+            rows, cols = np.nonzero(block > -np.inf)
+        return rows + start, cols + col_start, block[rows, cols]
+
     @staticmethod
     def create_network(
-        scores: matchms.Scores, settings: SpecSimNetworkDeepscoreParameters
-    ) -> networkx.Graph:
-        """Process scores object and generate network
+        scores: SparseScores, settings: SpecSimNetworkDeepscoreParameters
+    ) -> ArrayNetwork:
+        """Select the mutual top-n links of the scores and label the clusters
 
         Arguments:
             scores: holding spectral similarity scores information
             settings: parameter settings
 
         Returns:
-            A networkx Graph object of the created network
+            An ArrayNetwork object of the created network
         """
-        network = matchms.networking.SimilarityNetwork(
-            identifier_key="id",
-            score_cutoff=settings.score_cutoff,
-            max_links=settings.max_nr_links,
-            top_n=settings.max_nr_links,
-            link_method="mutual",
+        return ArrayNetwork(ids=[int(f_id) for f_id in scores.ids]).build(
+            scores, settings.score_cutoff, settings.max_nr_links
         )
-
-        network.create_network(scores, "MS2DeepScore")
-
-        return network.graph
@@ -0,0 +1,322 @@
+"""Spectral similarity networking split into plan, work and merge steps on files.
+
+Copyright (c) 2022 to present Mitja Maximilian Zdouc, PhD
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import json
+import logging
+from pathlib import Path
+from typing import Any, Optional, Self
+
+import matchms
+import numpy as np
+from pydantic import BaseModel
+
+from fermo_core.data_analysis.sim_networks_manager.class_edge_store import EdgeStore
+from fermo_core.data_analysis.sim_networks_manager.class_mod_cosine_networker import (
+    ModCosineNetworker,
+)
+from fermo_core.data_analysis.sim_networks_manager.class_ms2deepscore_networker import (
+    Ms2deepscoreNetworker,
+)
+from fermo_core.input_output.param_handlers import (
+    SpecSimNetworkCosineParameters,
+    SpecSimNetworkDeepscoreParameters,
+)
+from fermo_core.utils.class_cosine_prescreen import CosinePrescreen
+from fermo_core.utils.class_sparse_scores import SparseScores
+
+logger = logging.getLogger("fermo_core")
+
+
+class ShardManager(BaseModel):
+    """Pydantic-based class to organize sharded networking of one algorithm
+
+    The 'plan' step writes 'manifest.json' (settings, spectrum keys and pair
+    blocks) and 'spectra.npz' (the peaks for modified cosine, the embeddings for
+    ms2deepscore) to the directory. Each 'work' invocation scores one block and
+    writes 'shards/block_<nr>.npz'; invocations are independent and can run on
+    any machine sharing the directory. The 'merge' step joins the shards.
+
+    Attributes:
+        directory_path: the directory of the algorithm
+    """
+
+    directory_path: Path
+
+    def path_manifest(self: Self) -> Path:
+        """Return the path of the manifest"""
+        return self.directory_path.joinpath("manifest.json")
+
+    def path_spectra(self: Self) -> Path:
+        """Return the path of the preprocessed spectra"""
+        return self.directory_path.joinpath("spectra.npz")
+
+    def path_shard(self: Self, block_nr: int) -> Path:
+        """Return the path of the edge shard of a block"""
+        return self.directory_path.joinpath("shards", f"block_{block_nr}.npz")
+
+    def load_manifest(self: Self) -> dict:
+        """Read the manifest
+
+        Returns:
+            The manifest as dict
+
+        Raises:
+            RuntimeError: no manifest in the directory
+        """
+        try:
+            return json.loads(self.path_manifest().read_text())
+        except (OSError, ValueError) as e:
+            raise RuntimeError(
+                f"'ShardManager': could not read manifest in "
+                f"'{self.directory_path}' - run the 'plan' step first."
+            ) from e
+
+    @staticmethod
+    def create_blocks(algorithm: str, nr_spectra: int, settings: Any, nr_blocks: int):
+        """Split the pairs of the spectra into blocks of tiles
+
+        The tiles (modified cosine, of 'tile_size') or row blocks (ms2deepscore)
+        of the networkers are dealt out to the blocks in turn.
+
+        Arguments:
+            algorithm: 'modified_cosine' or 'ms2deepscore'
+            nr_spectra: the number of spectra
+            settings: the parameters of the networking algorithm
+            nr_blocks: the maximum number of blocks
+
+        Returns:
+            A list of blocks, each a list of (row start, row stop, column start,
+            column stop) tiles
+        """
+        if algorithm == "modified_cosine":
+            tiles = ModCosineNetworker.create_tiles(nr_spectra, settings.tile_size)
+        else:
+            block_size = max(
+                1,
+                min(1024, 2**24 // max(nr_spectra, 1), -(-nr_spectra // nr_blocks)),
+            )
+            tiles = [
+                (r, min(r + block_size, nr_spectra), 0, nr_spectra)
+                for r in range(0, nr_spectra, block_size)
+            ]
+        blocks = [tiles[nr::nr_blocks] for nr in range(nr_blocks)]
+        return [block for block in blocks if len(block) != 0]
+
+    def plan(
+        self: Self,
+        spectra: list,
+        settings: Any,
+        edge_settings: dict,
+        nr_blocks: int,
+        vectors: Optional[np.ndarray] = None,
+    ):
+        """Write the manifest and the preprocessed spectra, removing old shards
+
+        Arguments:
+            spectra: the matchms Spectrum objects to network
+            settings: the parameters of the networking algorithm
+            edge_settings: the settings the retained pairs depend on
+            nr_blocks: the maximum number of blocks
+            vectors: the unit-length embeddings of the spectra (ms2deepscore)
+        """
+        self.directory_path.joinpath("shards").mkdir(parents=True, exist_ok=True)
+        for shard in self.directory_path.joinpath("shards").glob("block_*.npz"):
+            shard.unlink()
+
+        algorithm = edge_settings["algorithm"]
+        ids = np.array([s.get("id") for s in spectra])
+        if algorithm == "modified_cosine":
+            np.savez(
+                self.path_spectra(),
+                ids=ids,
+                mz=np.concatenate([s.peaks.mz for s in spectra] + [np.zeros(0)]),
+                intensities=np.concatenate(
+                    [s.peaks.intensities for s in spectra] + [np.zeros(0)]
+                ),
+                offsets=np.cumsum([0] + [len(s.peaks.mz) for s in spectra]),
+                precursor_mz=np.array(
+                    [s.get("precursor_mz") or np.nan for s in spectra], dtype=float
+                ),
+            )
+        else:
+            np.savez(self.path_spectra(), ids=ids, vectors=vectors)
+
+        blocks = self.create_blocks(algorithm, len(spectra), settings, nr_blocks)
+        self.path_manifest().write_text(
+            json.dumps(
+                {
+                    "algorithm": algorithm,
+                    "settings": settings.to_json(),
+                    "edge_settings": edge_settings,
+                    "keys": EdgeStore.spectrum_keys(spectra),
+                    "blocks": blocks,
+                }
+            )
+        )
+        logger.info(
+            f"'ShardManager': planned '{len(blocks)}' blocks of '{len(spectra)}' "
+            f"spectra in '{self.path_manifest()}'."
+        )
+
+    def load_spectra(self: Self) -> dict:
+        """Read the preprocessed spectra
+
+        Returns:
+            A dict with the 'ids' and the matchms Spectrum objects ('spectra') or
+            the embeddings ('vectors')
+        """
+        with np.load(self.path_spectra()) as data:
+            if "vectors" in data:
+                return {"ids": data["ids"].tolist(), "vectors": data["vectors"]}
+
+            offsets = data["offsets"]
+            return {
+                "ids": data["ids"].tolist(),
+                "spectra": [
+                    matchms.Spectrum(
+                        mz=data["mz"][offsets[i] : offsets[i + 1]],
+                        intensities=data["intensities"][offsets[i] : offsets[i + 1]],
+                        metadata=self.spectrum_metadata(
+                            f_id, float(data["precursor_mz"][i])
+                        ),
+                        metadata_harmonization=False,
+                    )
+                    for i, f_id in enumerate(data["ids"].tolist())
+                ],
+            }
+
+    @staticmethod
+    def spectrum_metadata(f_id: Any, precursor_mz: float) -> dict:
+        """Return the metadata of a rebuilt spectrum, without missing precursor"""
+        if np.isnan(precursor_mz):
+            return {"id": f_id}
+        return {"id": f_id, "precursor_mz": precursor_mz}
+
+    def work(self: Self, block_nr: Optional[int] = None):
+        """Score a block (or all blocks without shard) and write the edge shards
+
+        Arguments:
+            block_nr: the number of the block (or None)
+
+        Raises:
+            RuntimeError: no manifest in the directory or unknown block number
+        """
+        manifest = self.load_manifest()
+        if block_nr is None:
+            todo = [
+                nr
+                for nr in range(len(manifest["blocks"]))
+                if not self.path_shard(nr).exists()
+            ]
+        elif 0 <= block_nr < len(manifest["blocks"]):
+            todo = [block_nr]
+        else:
+            raise RuntimeError(
+                f"'ShardManager': block '{block_nr}' not in manifest "
+                f"('{len(manifest['blocks'])}' blocks)."
+            )
+
+        data = self.load_spectra()
+        if manifest["algorithm"] == "modified_cosine":
+            settings = SpecSimNetworkCosineParameters(**manifest["settings"])
+            prescreen = None
+            if settings.prescreen:
+                prescreen = CosinePrescreen(tolerance=settings.fragment_tol).build(
+                    data["spectra"]
+                )
+        else:
+            settings = SpecSimNetworkDeepscoreParameters(**manifest["settings"])
+
+        for nr in todo:
+            scores = SparseScores(
+                ids=data["ids"], score_cutoff=manifest["edge_settings"]["score_cutoff"]
+            )
+            for tile in manifest["blocks"][nr]:
+                if manifest["algorithm"] == "modified_cosine":
+                    scores.append(
+                        *ModCosineNetworker.score_block(
+                            data["spectra"], settings, tuple(tile), prescreen
+                        )
+                    )
+                else:
+                    scores.append(
+                        *Ms2deepscoreNetworker.top_links(
+                            data["vectors"],
+                            tile[0],
+                            tile[1] - tile[0],
+                            settings.max_nr_links,
+                        )
+                    )
+            scores.finalize()
+
+            temp = self.path_shard(nr).with_name(f".block_{nr}.tmp.npz")
+            np.savez(temp, rows=scores.rows, cols=scores.cols, scores=scores.scores)
+            temp.replace(self.path_shard(nr))
+            logger.info(
+                f"'ShardManager': scored block '{nr}' of "
+                f"'{len(manifest['blocks'])}' ('{len(scores.rows)}' edges)."
+            )
+
+    def merge(self: Self, keys: list, edge_settings: dict) -> SparseScores:
+        """Join the edge shards of all blocks
+
+        Arguments:
+            keys: the spectrum keys of the features to network, in order
+            edge_settings: the settings the retained pairs depend on
+
+        Returns:
+            A SparseScores object of the retained pairs
+
+        Raises:
+            RuntimeError: no manifest, spectra or settings differ from the plan,
+                missing shards
+        """
+        manifest = self.load_manifest()
+        if manifest["keys"] != keys or manifest["edge_settings"] != json.loads(
+            json.dumps(edge_settings)
+        ):
+            raise RuntimeError(
+                f"'ShardManager': the spectra or settings differ from the ones "
+                f"planned in '{self.path_manifest()}' - run the 'plan' step again."
+            )
+
+        missing = [
+            nr
+            for nr in range(len(manifest["blocks"]))
+            if not self.path_shard(nr).exists()
+        ]
+        if len(missing) != 0:
+            raise RuntimeError(
+                f"'ShardManager': missing edge shards of blocks '{missing}' in "
+                f"'{self.directory_path}' - run the 'work' step for them."
+            )
+
+        with np.load(self.path_spectra()) as data:
+            ids = data["ids"].tolist()
+        scores = SparseScores(
+            ids=ids, score_cutoff=manifest["edge_settings"]["score_cutoff"]
+        )
+        for nr in range(len(manifest["blocks"])):
+            with np.load(self.path_shard(nr)) as shard:
+                scores.append(shard["rows"], shard["cols"], shard["scores"])
+        return scores.finalize()
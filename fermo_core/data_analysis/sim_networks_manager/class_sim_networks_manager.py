@@ -23,22 +23,32 @@ SOFTWARE.
 
 import logging
 import urllib.error
-from typing import Self
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Self
 
-import networkx
 import numpy as np
 from pydantic import BaseModel
 
+from fermo_core.data_analysis.sim_networks_manager.class_array_network import (
+    ArrayNetwork,
+)
+from fermo_core.data_analysis.sim_networks_manager.class_edge_store import EdgeStore
 from fermo_core.data_analysis.sim_networks_manager.class_mod_cosine_networker import (
     ModCosineNetworker,
 )
 from fermo_core.data_analysis.sim_networks_manager.class_ms2deepscore_networker import (
     Ms2deepscoreNetworker,
 )
+from fermo_core.data_analysis.sim_networks_manager.class_shard_manager import (
+    ShardManager,
+)
 from fermo_core.data_processing.builder_feature.dataclass_feature import SimNetworks
 from fermo_core.data_processing.class_repository import Repository
 from fermo_core.data_processing.class_stats import SpecSimNet, Stats
 from fermo_core.input_output.class_parameter_manager import ParameterManager
+from fermo_core.input_output.param_handlers import SpecSimNetworkCosineParameters
+from fermo_core.utils.class_sparse_scores import SparseScores
+from fermo_core.utils.class_spectrum_deduplicator import SpectrumDeduplicator
 from fermo_core.utils.utility_method_manager import UtilityMethodManager
 
 logger = logging.getLogger("fermo_core")
@@ -103,25 +113,157 @@ class SimNetworksManager(BaseModel):
         """Organizes calling of data analysis steps."""
         logger.info("'SimNetworksManager': started analysis steps.")
 
-        modules = (
+        cosine = getattr(
+            self.params.SpecSimNetworkCosineParameters, "activate_module", False
+        )
+        deepscore = getattr(
+            self.params.SpecSimNetworkDeepscoreParameters, "activate_module", False
+        )
+
+        if self.shard_step() == "plan":
+            self.plan_shards(cosine, deepscore)
+        elif (
+            cosine
+            and deepscore
+            and self.params.SpecSimNetworkDeepscoreParameters.concurrent
+        ):
+            self.run_concurrently()
+        else:
+            if cosine:
+                self.run_modified_cosine_alg()
+            if deepscore:
+                self.run_ms2deepscore_alg()
+
+        logger.info("'SimNetworksManager': completed analysis steps.")
+
+    def shard_step(self: Self) -> str | None:
+        """Return the step of sharded networking ('plan', 'merge') or None"""
+        return getattr(self.params.ShardNetworkingParameters, "step", None)
+
+    def shard_manager(self: Self, algorithm: str) -> ShardManager:
+        """Return the ShardManager of an algorithm in the shared directory
+
+        Arguments:
+            algorithm: 'modified_cosine' or 'ms2deepscore'
+
+        Returns:
+            A ShardManager object
+        """
+        return ShardManager(
+            directory_path=self.params.ShardNetworkingParameters.directory_path.joinpath(
+                algorithm
+            )
+        )
+
+    def plan_shards(self: Self, cosine: bool, deepscore: bool):
+        """Write the manifests of sharded networking for the activated algorithms
+
+        The ms2deepscore embeddings are calculated here, so that the 'work' steps
+        only need the embeddings and no model.
+
+        Arguments:
+            cosine: modified cosine networking is activated
+            deepscore: ms2deepscore networking is activated
+        """
+        planned = []
+        for algorithm, active, networker, settings in (
             (
+                "modified_cosine",
+                cosine,
+                ModCosineNetworker,
                 self.params.SpecSimNetworkCosineParameters,
-                self.run_modified_cosine_alg,
             ),
             (
+                "ms2deepscore",
+                deepscore,
+                Ms2deepscoreNetworker,
                 self.params.SpecSimNetworkDeepscoreParameters,
-                self.run_ms2deepscore_alg,
             ),
-        )
+        ):
+            if not active:
+                continue
+
+            features = self.filter_input_spectra(
+                features=tuple(self.stats.active_features),
+                feature_repo=self.features,
+                msms_min_frag_nr=settings.msms_min_frag_nr,
+                algorithm=algorithm,
+            )
+            features, _ = self.representatives(
+                tuple(sorted(features["included"])), algorithm
+            )
+            spectra = [self.features.get(f_id).Spectrum for f_id in features]
 
-        for module in modules:
-            if getattr(module[0], "activate_module", False):
-                module[1]()
+            vectors = None
+            if algorithm == "ms2deepscore":
+                try:
+                    UtilityMethodManager().check_ms2deepscore_req(
+                        self.params.PeaktableParameters.polarity
+                    )
+                    vectors = networker.embed(spectra, settings)
+                except (urllib.error.URLError, RuntimeError, FileNotFoundError):
+                    logger.warning(
+                        "'SimNetworksManager': could not embed spectra for sharded "
+                        "ms2deepscore networking - SKIP"
+                    )
+                    continue
+
+            manager = self.shard_manager(algorithm)
+            manager.plan(
+                spectra,
+                settings,
+                networker.edge_settings(settings),
+                self.params.ShardNetworkingParameters.nr_blocks,
+                vectors,
+            )
+            planned.append(manager.path_manifest())
 
-        logger.info("'SimNetworksManager': completed analysis steps.")
+        for manifest in planned:
+            logger.info(
+                f"'SimNetworksManager': run 'fermo_core --shard_work {manifest} "
+                f"--shard_block <nr>' for each block, then rerun with "
+                f"'--shard_step merge'."
+            )
+
+    def run_concurrently(self: Self):
+        """Run modified cosine and ms2deepscore networking at the same time
+
+        The calculations only read the features and run in two threads; the
+        networks are stored afterwards. With modified cosine networking in a process
+        pool ('nr_workers' > 1), the algorithms run one after the other instead, not
+        to fork worker processes while tensorflow runs in another thread.
+        """
+        if self.params.SpecSimNetworkCosineParameters.nr_workers > 1:
+            logger.info(
+                "'SimNetworksManager': modified cosine networking uses worker "
+                "processes - running algorithms one after the other."
+            )
+            self.run_modified_cosine_alg()
+            self.run_ms2deepscore_alg()
+            return
+
+        logger.info(
+            "'SimNetworksManager': running modified cosine and ms2deepscore "
+            "networking concurrently."
+        )
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            cosine = executor.submit(self.calculate_modified_cosine)
+            deepscore = executor.submit(self.calculate_ms2deepscore)
+            cosine_result, deepscore_result = cosine.result(), deepscore.result()
+
+        self.store_modified_cosine(cosine_result)
+        self.store_ms2deepscore(deepscore_result)
 
     def run_modified_cosine_alg(self: Self):
         """Run modified cosine-based spectral similarity networking on features."""
+        self.store_modified_cosine(self.calculate_modified_cosine())
+
+    def calculate_modified_cosine(self: Self) -> tuple[dict, tuple] | None:
+        """Calculate the modified cosine-based spectral similarity network
+
+        Returns:
+            A tuple of the network data and the IDs of the networked features or None
+        """
         logger.info("'SimNetworksManager/ModCosineNetworker': started calculation")
 
         filtered_features = self.filter_input_spectra(
@@ -132,30 +274,124 @@ class SimNetworksManager(BaseModel):
         )
 
         mod_cosine_networker = ModCosineNetworker()
-        scores = mod_cosine_networker.spec_sim_networking(
-            tuple(filtered_features["included"]),
-            self.features,
-            self.params.SpecSimNetworkCosineParameters,
-        )
+        try:
+            scores = self.score_features(
+                mod_cosine_networker,
+                tuple(filtered_features["included"]),
+                self.params.SpecSimNetworkCosineParameters,
+            )
+        except RuntimeError as e:
+            logger.error(str(e))
+            return
+
+        if self.params.SpecSimNetworkCosineParameters.store_candidates:
+            self.save_candidates(scores)
 
         network = mod_cosine_networker.create_network(
             scores, self.params.SpecSimNetworkCosineParameters
         )
 
-        try:
-            network_data = self.format_network_for_storage(network)
-        except RuntimeError as e:
-            logger.error(str(e))
+        network_data = self.format_network_for_storage(network)
+        return network_data, tuple(filtered_features.get("included"))
+
+    def store_modified_cosine(self: Self, result: tuple[dict, tuple] | None):
+        """Store the modified cosine-based network if calculated
+
+        Arguments:
+            result: a tuple of the network data and the IDs of the networked features
+        """
+        if result is None:
+            return
+
+        self.store_network_data("modified_cosine", *result)
+        self.params.SpecSimNetworkCosineParameters.module_passed = True
+        self.deduplication_passed()
+        logger.info("'SimNetworksManager/ModCosineNetworker': completed calculation")
+
+    def candidate_store(self: Self) -> EdgeStore:
+        """Return the EdgeStore of the modified cosine candidate edges of the run"""
+        return EdgeStore(
+            filepath=self.params.OutputParameters.directory_path.joinpath(
+                "out.fermo.modified_cosine.candidates.npz"
+            ),
+            settings=ModCosineNetworker.edge_settings(
+                self.params.SpecSimNetworkCosineParameters
+            ),
+        )
+
+    def save_candidates(self: Self, scores: SparseScores):
+        """Store the candidate edges of the run by feature ID for re-thresholding
+
+        Arguments:
+            scores: the SparseScores of the networked features
+        """
+        if self.params.OutputParameters is None:
+            logger.warning(
+                "'SimNetworksManager': no output directory - candidate edges not "
+                "stored - SKIP"
+            )
             return
 
+        self.candidate_store().save([str(f_id) for f_id in scores.ids], scores)
+        logger.info(
+            f"'SimNetworksManager': stored '{len(scores.rows)}' candidate edges "
+            f"reaching '{scores.score_cutoff}'."
+        )
+
+    def rethreshold(self: Self, score_cutoff: float, max_nr_links: int):
+        """Rebuild the modified cosine network from the stored candidate edges
+
+        No similarities are calculated: links, clusters and the feature network
+        entries are recreated for the new thresholds, which replace the ones in
+        the parameters.
+
+        Arguments:
+            score_cutoff: the new minimum similarity score between two spectra
+            max_nr_links: the new max nr of connections from a node
+
+        Raises:
+            RuntimeError: no candidate edges stored that reach down to score_cutoff
+        """
+        store = self.candidate_store().load(min_score=score_cutoff)
+        if store.scores is None:
+            raise RuntimeError(
+                f"'SimNetworksManager': no candidate edges reaching down to "
+                f"'{score_cutoff}' in '{store.filepath}' - rerun networking with "
+                f"'store_candidates' and a lower 'candidate_floor'."
+            )
+
+        self.params.SpecSimNetworkCosineParameters = SpecSimNetworkCosineParameters(
+            **{
+                **self.params.SpecSimNetworkCosineParameters.model_dump(),
+                "score_cutoff": score_cutoff,
+                "max_nr_links": max_nr_links,
+            }
+        )
+        store.scores.ids = [int(key) for key in store.keys]
+        network = ModCosineNetworker.create_network(
+            store.scores, self.params.SpecSimNetworkCosineParameters
+        )
         self.store_network_data(
-            "modified_cosine", network_data, tuple(filtered_features.get("included"))
+            "modified_cosine",
+            self.format_network_for_storage(network),
+            tuple(store.scores.ids),
         )
         self.params.SpecSimNetworkCosineParameters.module_passed = True
-        logger.info("'SimNetworksManager/ModCosineNetworker': completed calculation")
+        logger.info(
+            f"'SimNetworksManager': re-thresholded 'modified_cosine' network at "
+            f"'{score_cutoff}' with max. '{max_nr_links}' links per node."
+        )
 
     def run_ms2deepscore_alg(self: Self):
         """Run ms2deepscore-based spectral similarity networking on features."""
+        self.store_ms2deepscore(self.calculate_ms2deepscore())
+
+    def calculate_ms2deepscore(self: Self) -> tuple[dict, tuple] | None:
+        """Calculate the ms2deepscore-based spectral similarity network
+
+        Returns:
+            A tuple of the network data and the IDs of the networked features or None
+        """
         logger.info("'SimNetworksManager/Ms2deepscoreNetworker': started calculation.")
 
         try:
@@ -176,9 +412,9 @@ class SimNetworksManager(BaseModel):
 
         try:
             ms2deepscore_networker = Ms2deepscoreNetworker()
-            scores = ms2deepscore_networker.spec_sim_networking(
+            scores = self.score_features(
+                ms2deepscore_networker,
                 tuple(filtered_features["included"]),
-                self.features,
                 self.params.SpecSimNetworkDeepscoreParameters,
             )
         except FileNotFoundError:
@@ -186,25 +422,154 @@ class SimNetworksManager(BaseModel):
                 "'SimNetworksManager/Ms2deepscoreNetworker': no embedding file - SKIP"
             )
             return
+        except RuntimeError as e:
+            logger.error(str(e))
+            return
 
         network = ms2deepscore_networker.create_network(
             scores, self.params.SpecSimNetworkDeepscoreParameters
         )
 
-        try:
-            network_data = self.format_network_for_storage(
-                network,
-            )
-        except RuntimeError as e:
-            logger.error(str(e))
+        network_data = self.format_network_for_storage(network)
+        return network_data, tuple(filtered_features.get("included"))
+
+    def store_ms2deepscore(self: Self, result: tuple[dict, tuple] | None):
+        """Store the ms2deepscore-based network if calculated
+
+        Arguments:
+            result: a tuple of the network data and the IDs of the networked features
+        """
+        if result is None:
             return
 
-        self.store_network_data(
-            "ms2deepscore", network_data, tuple(filtered_features.get("included"))
-        )
+        self.store_network_data("ms2deepscore", *result)
         self.params.SpecSimNetworkDeepscoreParameters.module_passed = True
+        self.deduplication_passed()
         logger.info("'SimNetworksManager/Ms2deepscoreNetworker': completed calculation")
 
+    def deduplication_passed(self: Self):
+        """Flag spectrum deduplication as passed once a network was stored"""
+        params = self.params.SpectrumDeduplicationParameters
+        if getattr(params, "activate_module", False):
+            params.module_passed = True
+
+    def representatives(
+        self: Self, features: tuple, algorithm: str
+    ) -> tuple[tuple, np.ndarray | None]:
+        """Collapse features with identical (or near-identical) spectra if activated
+
+        For modified cosine, identical spectra must share the precursor m/z too.
+
+        Arguments:
+            features: a tuple of feature IDs to consider in networking
+            algorithm: 'modified_cosine' or 'ms2deepscore'
+
+        Returns:
+            A tuple of the representative feature IDs and the index of the
+            representative of each feature (or None if not activated)
+        """
+        params = self.params.SpectrumDeduplicationParameters
+        if not getattr(params, "activate_module", False):
+            return features, None
+
+        rep = SpectrumDeduplicator(
+            min_cosine=params.min_cosine, fragment_tol=params.fragment_tol
+        ).group(
+            [self.features.get(f_id).Spectrum for f_id in features],
+            ("precursor_mz",) if algorithm == "modified_cosine" else (),
+        )
+        return tuple(features[i] for i in np.unique(rep)), rep
+
+    def score_features(
+        self: Self, networker: Any, features: tuple, settings: Any
+    ) -> SparseScores:
+        """Score the pairs of features, on deduplicated spectra if activated
+
+        Only the representatives of identical spectra are scored; their pairs are
+        fanned back out to all member features.
+
+        Arguments:
+            networker: a ModCosineNetworker or Ms2deepscoreNetworker object
+            features: a tuple of feature IDs to consider in networking
+            settings: the parameters of the networking algorithm
+
+        Returns:
+            A SparseScores object of the retained pairs
+
+        Raises:
+            RuntimeError: edge shards missing or planned for other spectra
+        """
+        features = tuple(sorted(features))
+        algorithm = networker.edge_settings(settings)["algorithm"]
+        representatives, rep = self.representatives(features, algorithm)
+        if rep is None:
+            return self.score_representatives(networker, features, settings)
+
+        logger.info(
+            f"'SimNetworksManager': scoring '{len(representatives)}' representative "
+            f"spectra of '{len(features)}' features."
+        )
+        return SpectrumDeduplicator.fan_out(
+            self.score_representatives(networker, representatives, settings),
+            [self.features.get(f_id).Spectrum.get("id") for f_id in features],
+            rep,
+        )
+
+    def score_representatives(
+        self: Self, networker: Any, features: tuple, settings: Any
+    ) -> SparseScores:
+        """Score the pairs of features, incrementally or from shards if activated
+
+        With 'incremental', the edges are stored in the output directory; features
+        whose spectra are stored already are only scored against the new ones. In
+        the 'merge' step of sharded networking, the edge shards are joined.
+
+        Arguments:
+            networker: a ModCosineNetworker or Ms2deepscoreNetworker object
+            features: a tuple of feature IDs to consider in networking
+            settings: the parameters of the networking algorithm
+
+        Returns:
+            A SparseScores object of the retained pairs
+
+        Raises:
+            RuntimeError: edge shards missing or planned for other spectra
+        """
+        if self.shard_step() == "merge":
+            edge_settings = networker.edge_settings(settings)
+            spectra = [self.features.get(f_id).Spectrum for f_id in features]
+            return self.shard_manager(edge_settings["algorithm"]).merge(
+                EdgeStore.spectrum_keys(spectra), edge_settings
+            )
+
+        if not settings.incremental or self.params.OutputParameters is None:
+            return networker.spec_sim_networking(features, self.features, settings)
+
+        edge_settings = networker.edge_settings(settings)
+        store = EdgeStore(
+            filepath=self.params.OutputParameters.directory_path.joinpath(
+                f"out.fermo.{edge_settings['algorithm']}.edges.npz"
+            ),
+            settings=edge_settings,
+        ).load()
+
+        keys = store.spectrum_keys([self.features.get(f).Spectrum for f in features])
+        features, keys, nr_old, rows, cols, old_scores = store.reorder(
+            features, keys, top_n=edge_settings["algorithm"] == "ms2deepscore"
+        )
+        logger.info(
+            f"'SimNetworksManager': incremental networking: scoring "
+            f"'{len(features) - nr_old}' new of '{len(features)}' spectra."
+        )
+
+        scores = networker.spec_sim_networking(
+            features, self.features, settings, nr_old
+        )
+        scores.append(rows, cols, old_scores)
+        scores.finalize()
+        store.save(keys, scores)
+        return scores
+
     @staticmethod
     def filter_for_ms2deepscore(mz_array: np.ndarray) -> bool:
         """Filters features that have no peaks between 10 and 1000.
@@ -264,45 +629,20 @@ class SimNetworksManager(BaseModel):
         return {"included": included, "excluded": excluded}
 
     @staticmethod
-    def format_network_for_storage(
-        graph: networkx.Graph,
-    ) -> dict:
-        """Process networkx Graph object, remove redundant clusters, extract info
+    def format_network_for_storage(graph: ArrayNetwork) -> dict:
+        """Extract the edge arrays and clusters of an ArrayNetwork
 
         Arguments:
             graph: holding spectral similarity networking information
 
         Returns:
-            dict of full network, subnetworks, dict of clusters/contained features
-
-        Raises:
-            RuntimeError: detected overlap between subclusters in terms of feature IDs
+            dict of the ArrayNetwork, dict of clusters/contained features
 
         Notes:
-            Matchms introduces "stringified" feature IDs in network - need to be
-            removed by `networkx.relabel_nodes`
+            Clusters are the connected components of the network and therefore
+            never share feature IDs. networkx Graph objects are not created here.
         """
-        mapping = {node: int(node) for node in graph.nodes}
-        graph = networkx.relabel_nodes(graph, mapping)
-
-        subnetworks = {}
-        for i, component in enumerate(networkx.connected_components(graph)):
-            subnetworks[i] = graph.subgraph(component).copy()
-            subnetworks[i].graph["name"] = i
-
-        clusters = {}
-        for sub in subnetworks:
-            ids = {int(node) for node in subnetworks[sub].nodes}
-            for cluster in clusters.values():
-                if len(output := ids.intersection(cluster)) != 0:
-                    raise RuntimeError(
-                        f"'SimNetworksManager': detected overlap between subclusters: "
-                        f"cluster with ids '{ids}' and cluster with ids '{cluster}' "
-                        f"share ids '{output}'. This is unexpected - ABORT."
-                    )
-            clusters[sub] = ids
-
-        return {"network": graph, "subnetworks": subnetworks, "summary": clusters}
+        return {"graph": graph, "summary": graph.clusters()}
 
     def store_network_data(
         self: Self, network_name: str, network_data: dict, features: tuple
@@ -311,28 +651,30 @@ class SimNetworksManager(BaseModel):
 
         Arguments:
             network_name: name of networking algorithm
-            network_data: dict of network, subnetworks, summary
+            network_data: dict of the ArrayNetwork and summary
             features: tuple of features included in networking
+
+        Notes:
+            The feature-to-cluster index of the network is built once here.
         """
         if self.stats.networks is None:
             self.stats.networks = {}
 
         self.stats.networks[network_name] = SpecSimNet(
             algorithm=network_name,
-            network=network_data["network"],
-            subnetworks=network_data["subnetworks"],
+            graph=network_data["graph"],
             summary=network_data["summary"],
         )
+        clusters = self.stats.networks[network_name].feature_clusters()
 
         for f_id in features:
             feature = self.features.get(f_id)
             if feature.networks is None:
                 feature.networks = {}
 
-            for cluster_id in network_data["summary"]:
-                if f_id in network_data["summary"][cluster_id]:
-                    feature.networks[network_name] = SimNetworks(
-                        algorithm=network_name, network_id=cluster_id
-                    )
+            if (cluster_id := clusters.get(f_id)) is not None:
+                feature.networks[network_name] = SimNetworks(
+                    algorithm=network_name, network_id=cluster_id
+                )
 
             self.features.modify(f_id, feature)
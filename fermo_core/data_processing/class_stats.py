@@ -134,26 +134,44 @@ class PhenoData(BaseModel):
 class SpecSimNet(BaseModel):
     """Pydantic-based class to organize info on a spectral similarity analysis run
 
+    The network is kept as edge arrays (first node, second node, score) and a
+    node-to-cluster array; networkx and cytoscape views are only created on export.
+
     Attributes:
         algorithm: the identifier of the algorithm
-        network: the full network as networkx Graph object for later cytoscape export
-        subnetworks: a dict of subnetwork Graph objects with subnetwork int id as keys
+        graph: the ArrayNetwork holding the edge and node-to-cluster arrays
         summary: a dict of clusters and associated features
+        membership: the cluster of each feature, indexed once from summary
     """
 
     algorithm: str
-    network: Any
-    subnetworks: dict
+    graph: Any
     summary: dict[int, set]
+    membership: Optional[dict[int, int]] = None
+
+    def feature_clusters(self: Self) -> dict[int, int]:
+        """Return the cluster of each networked feature
+
+        Returns:
+            A dict of feature IDs and their cluster IDs
+        """
+        if self.membership is None:
+            self.membership = {
+                f_id: cluster_id
+                for cluster_id, f_ids in self.summary.items()
+                for f_id in f_ids
+            }
+        return self.membership
+
+    def network(self: Self) -> nx.Graph:
+        """Create the full network as networkx Graph object for cytoscape export"""
+        return self.graph.to_networkx()
 
     def to_json(self: Self) -> dict:
         """Convert attributes to json-compatible ones."""
         return {
             "algorithm": self.algorithm,
-            "subnetworks": {
-                key: nx.cytoscape_data(value)
-                for (key, value) in self.subnetworks.items()
-            },
+            "subnetworks": self.graph.to_cytoscape(),
             "summary": {key: list(value) for (key, value) in self.summary.items()},
         }
 
@@ -39,7 +39,15 @@ class ArgparseManager:
             Namespace containing the command line params.
         """
         parser = self.define_argparse_args(version)
-        return parser.parse_args(args)
+        namespace = parser.parse_args(args)
+        if (
+            namespace.parameters is None
+            and namespace.shard_work is None
+            and namespace.rethreshold is None
+            and namespace.precompute_embeddings is None
+        ):
+            parser.error("the following arguments are required: -p/--parameters")
+        return namespace
 
     @staticmethod
     def define_argparse_args(version: str) -> argparse.ArgumentParser:
@@ -66,10 +74,12 @@ class ArgparseManager:
             "-p",
             "--parameters",
             type=str,
-            required=True,
+            required=False,
             help=(
                 "(Mandatory) Provide a FERMO parameter .json file.\n"
                 "For more information, consult the documentation.\n"
+                "Not needed with '--shard_work', '--rethreshold' or\n"
+                "'--precompute_embeddings'.\n"
             ),
         )
 
@@ -83,4 +93,118 @@ class ArgparseManager:
             help=("(Optional) Specify the verboseness of logging. Default: 'INFO'."),
         )
 
+        parser.add_argument(
+            "--shard_step",
+            type=str,
+            default=None,
+            choices=["plan", "merge"],
+            required=False,
+            help=(
+                "(Optional) Sharded spectral similarity networking step.\n"
+                "'plan' writes the manifests and stops, 'merge' builds the networks\n"
+                "from the edge shards and completes the run.\n"
+            ),
+        )
+
+        parser.add_argument(
+            "--shard_dir",
+            type=str,
+            default=None,
+            required=False,
+            help=(
+                "(Optional) Directory shared by all steps of sharded networking.\n"
+                "Default: 'shards' in the results directory.\n"
+            ),
+        )
+
+        parser.add_argument(
+            "--shard_nr_blocks",
+            type=int,
+            default=100,
+            required=False,
+            help=(
+                "(Optional) Number of blocks per networking algorithm. Default: 100."
+            ),
+        )
+
+        parser.add_argument(
+            "--shard_work",
+            type=str,
+            default=None,
+            required=False,
+            help=(
+                "(Optional) Score blocks of a 'manifest.json' written by the 'plan'\n"
+                "step and exit; the scored blocks are written as edge shards.\n"
+            ),
+        )
+
+        parser.add_argument(
+            "--shard_block",
+            type=int,
+            default=None,
+            required=False,
+            help=(
+                "(Optional) The block to score with '--shard_work'.\n"
+                "Default: all blocks not yet scored.\n"
+            ),
+        )
+
+        parser.add_argument(
+            "--rethreshold",
+            type=str,
+            default=None,
+            required=False,
+            help=(
+                "(Optional) Rebuild the modified cosine network of the run of an\n"
+                "'out.fermo.session.json' from its stored candidate edges and exit.\n"
+                "Requires 'store_candidates' in 'SpecSimNetworkCosineParameters'.\n"
+            ),
+        )
+
+        parser.add_argument(
+            "--score_cutoff",
+            type=float,
+            default=None,
+            required=False,
+            help=(
+                "(Optional) The new 'score_cutoff' with '--rethreshold'.\n"
+                "Default: the 'score_cutoff' of the run.\n"
+            ),
+        )
+
+        parser.add_argument(
+            "--max_nr_links",
+            type=int,
+            default=None,
+            required=False,
+            help=(
+                "(Optional) The new 'max_nr_links' with '--rethreshold'.\n"
+                "Default: the 'max_nr_links' of the run.\n"
+            ),
+        )
+
+        parser.add_argument(
+            "--precompute_embeddings",
+            type=str,
+            default=None,
+            required=False,
+            help=(
+                "(Optional) Embed a spectral library with the default MS2DeepScore\n"
+                "model, store the embeddings next to it and exit. Either a\n"
+                "directory of .mgf files or 'mibig' for the bundled MIBiG library.\n"
+            ),
+        )
+
+        parser.add_argument(
+            "--embedding_backend",
+            type=str,
+            default="keras",
+            choices=["keras", "numpy"],
+            required=False,
+            help=(
+                "(Optional) The MS2DeepScore inference backend with\n"
+                "'--precompute_embeddings'. Default: 'keras'.\n"
+            ),
+        )
+
         return parser
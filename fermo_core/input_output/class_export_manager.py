@@ -486,7 +486,7 @@ class ExportManager(BaseModel):
             path_graphml = self.params.OutputParameters.directory_path.joinpath(
                 f"out.fermo.{network}.graphml"
             )
-            nx.write_graphml(self.stats.networks[network].network, path_graphml)
+            nx.write_graphml(self.stats.networks[network].network(), path_graphml)
             ValidationManager().validate_output_created(path_graphml)
 
         self.log_complete_module(".graphml")
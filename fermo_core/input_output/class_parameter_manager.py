@@ -48,11 +48,13 @@ from fermo_core.input_output.param_handlers import (
     PhenoQuantConcAssgnParams,
     PhenoQuantPercentAssgnParams,
     PhenotypeParameters,
+    ShardNetworkingParameters,
     SpecLibParameters,
     SpecSimNetworkCosineParameters,
     SpecSimNetworkDeepscoreParameters,
     SpectralLibMatchingCosineParameters,
     SpectralLibMatchingDeepscoreParameters,
+    SpectrumDeduplicationParameters,
 )
 
 logger = logging.getLogger("fermo_core")
@@ -84,6 +86,8 @@ class ParameterManager(BaseModel):
     SpectralLibMatchingDeepscoreParameters: Any | None = None
     AsKcbCosineMatchingParams: Any | None = None
     AsKcbDeepscoreMatchingParams: Any | None = None
+    ShardNetworkingParameters: Any | None = None
+    SpectrumDeduplicationParameters: Any | None = None
 
     def to_json(self: Self) -> dict:
         """Export class attributes to json-dump compatible dict.
@@ -123,6 +127,11 @@ class ParameterManager(BaseModel):
             ),
             (self.AsKcbCosineMatchingParams, "AsKcbCosineMatchingParameters"),
             (self.AsKcbDeepscoreMatchingParams, "AsKcbDeepscoreMatchingParameters"),
+            (self.ShardNetworkingParameters, "ShardNetworkingParameters"),
+            (
+                self.SpectrumDeduplicationParameters,
+                "SpectrumDeduplicationParameters",
+            ),
         )
 
         json_dict = {}
@@ -300,6 +309,11 @@ class ParameterManager(BaseModel):
                 self.assign_as_kcb_matching_deepscore,
                 "AsKcbDeepscoreMatchingParameters",
             ),
+            (
+                user_params.get("SpectrumDeduplicationParameters"),
+                self.assign_spectrum_deduplication,
+                "SpectrumDeduplicationParameters",
+            ),
         )
 
         for module in modules:
@@ -649,3 +663,30 @@ class ParameterManager(BaseModel):
             logger.warning(str(e))
             self.log_malformed_parameters_skip("AsKcbDeepscoreMatchingParameters")
             self.AsKcbDeepscoreMatchingParams = None
+
+    def assign_spectrum_deduplication(self: Self, user_params: dict):
+        """Assign spectrum deduplication params to self.SpectrumDeduplicationParameters
+
+        Parameters:
+            user_params: user-provided params, read from json file
+        """
+        try:
+            self.SpectrumDeduplicationParameters = SpectrumDeduplicationParameters(
+                **user_params
+            )
+            self.log_passed_modules("SpectrumDeduplicationParameters")
+        except Exception as e:
+            logger.warning(str(e))
+            self.log_malformed_parameters_skip("SpectrumDeduplicationParameters")
+            self.SpectrumDeduplicationParameters = None
+
+    def assign_shard_networking(self: Self, user_params: dict):
+        """Assign sharded networking parameters to self.ShardNetworkingParameters.
+
+        Given on the command line; malformed values raise instead of being skipped.
+
+        Parameters:
+            user_params: user-provided params (directory_path, step, nr_blocks)
+        """
+        self.ShardNetworkingParameters = ShardNetworkingParameters(**user_params)
+        self.log_passed_modules("ShardNetworkingParameters")
@@ -0,0 +1,276 @@
+"""Re-thresholding of the spectral similarity network of a finished run.
+
+Copyright (c) 2022 to present Mitja Maximilian Zdouc, PhD
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import json
+import logging
+from pathlib import Path
+from typing import Optional, Self
+
+import networkx as nx
+import pandas as pd
+from pydantic import BaseModel
+
+from fermo_core.data_analysis.class_analysis_manager import AnalysisManager
+from fermo_core.data_processing.builder_feature.dataclass_feature import Feature
+from fermo_core.data_processing.builder_sample.dataclass_sample import Sample
+from fermo_core.data_processing.class_repository import Repository
+from fermo_core.data_processing.class_stats import SpecSimNet, Stats
+from fermo_core.input_output.class_parameter_manager import ParameterManager
+from fermo_core.input_output.class_summary_writer import SummaryWriter
+from fermo_core.input_output.param_handlers import (
+    OutputParameters,
+    SpecSimNetworkCosineParameters,
+)
+
+logger = logging.getLogger("fermo_core")
+
+
+class SessionRethresholder(BaseModel):
+    """Pydantic-based class to re-threshold the network of a finished run
+
+    The run is restored from its session file as far as needed: the networks and
+    the features of the samples. The modified cosine network is rebuilt from the
+    candidate edges stored next to the session file and replaces the network in
+    the session file, the csv output and the graphml file. Neither the input data
+    nor the parameters file are needed.
+
+    Attributes:
+        session_path: the 'out.fermo.session.json' file of the run
+        session: the content of the session file
+        algorithm: the re-thresholded network
+    """
+
+    session_path: Path
+    session: dict = {}
+    algorithm: str = "modified_cosine"
+
+    def load_session(self: Self) -> Self:
+        """Read the session file
+
+        Returns:
+            The SessionRethresholder instance
+
+        Raises:
+            RuntimeError: the session file is missing or was run without networking
+        """
+        if not self.session_path.exists():
+            raise RuntimeError(
+                f"'SessionRethresholder': could not find '{self.session_path}'."
+            )
+
+        with open(self.session_path, encoding="utf-8") as infile:
+            self.session = json.load(infile)
+
+        if not self.session["parameters"]["SpecSimNetworkCosineParameters"].get(
+            "activate_module"
+        ):
+            raise RuntimeError(
+                f"'SessionRethresholder': no modified cosine networking in "
+                f"'{self.session_path.name}' - SKIP"
+            )
+        return self
+
+    def restore_run(
+        self: Self,
+    ) -> tuple[ParameterManager, Stats, Repository, Repository]:
+        """Create the objects of the run needed for re-thresholding from the session
+
+        Returns:
+            Tuple containing ParameterManager, Stats, Feature and Sample Repository
+        """
+        params = ParameterManager()
+        params.OutputParameters = OutputParameters.model_construct(
+            directory_path=self.session_path.parent
+        )
+        params.SpecSimNetworkCosineParameters = SpecSimNetworkCosineParameters(
+            **self.session["parameters"]["SpecSimNetworkCosineParameters"]
+        )
+
+        stats = Stats(
+            samples=tuple(self.session["stats"].get("samples", [])),
+            active_features=set(self.session["stats"].get("active_features", [])),
+            networks={
+                algorithm: SpecSimNet(
+                    algorithm=algorithm, graph=None, summary=network["summary"]
+                )
+                for algorithm, network in self.session["stats"]["networks"].items()
+            },
+        )
+
+        features = Repository()
+        samples = Repository()
+        for s_id, entry in self.session.get("samples", {}).items():
+            samples.add(
+                s_id,
+                Sample(
+                    s_id=s_id,
+                    feature_ids=set(entry.get("feature_ids", [])),
+                    networks={
+                        key: set(val) for key, val in entry.get("networks", {}).items()
+                    },
+                ),
+            )
+        f_ids = {int(f_id) for f_id in self.session.get("general_features", {})}
+        for sample in samples.entries.values():
+            f_ids.update(sample.feature_ids)
+        for f_id in f_ids:
+            features.add(f_id, Feature(f_id=f_id))
+
+        return params, stats, features, samples
+
+    def update_session(self: Self, analysis_manager: AnalysisManager):
+        """Replace the network data of the session by the re-thresholded network
+
+        Arguments:
+            analysis_manager: holding the objects of the re-thresholded run
+        """
+        params, stats, features, samples = (
+            analysis_manager.params,
+            analysis_manager.stats,
+            analysis_manager.features,
+            analysis_manager.samples,
+        )
+        cosine_params = params.SpecSimNetworkCosineParameters.to_json()
+        self.session["parameters"]["SpecSimNetworkCosineParameters"] = cosine_params
+        self.session["stats"]["networks"][self.algorithm] = stats.networks[
+            self.algorithm
+        ].to_json()
+
+        for f_id, entry in self.session.get("general_features", {}).items():
+            networks = features.get(int(f_id)).networks
+            if networks is not None and self.algorithm in networks:
+                entry.setdefault("networks", {})[self.algorithm] = networks[
+                    self.algorithm
+                ].to_json()
+            else:
+                entry.get("networks", {}).pop(self.algorithm, None)
+
+        for s_id, entry in self.session.get("samples", {}).items():
+            sample = samples.get(s_id)
+            if sample.networks is not None and self.algorithm in sample.networks:
+                entry.setdefault("networks", {})[self.algorithm] = list(
+                    sample.networks[self.algorithm]
+                )
+            else:
+                entry.get("networks", {}).pop(self.algorithm, None)
+            if sample.Scores is not None:
+                scores = sample.Scores.to_json()
+                entry.setdefault("scores", {}).update(
+                    {
+                        "diversity": scores["diversity"],
+                        "specificity": scores["specificity"],
+                    }
+                )
+
+    def write_summary(self: Self, analysis_manager: AnalysisManager):
+        """Replace the modified cosine networking paragraph of the summary file
+
+        The session does not hold all parameters of the run, so only the
+        networking paragraph is rewritten; the rest of the summary is kept.
+
+        Arguments:
+            analysis_manager: holding the objects of the re-thresholded run
+        """
+        path_summary = self.session_path.parent.joinpath("out.fermo.summary.txt")
+        if not path_summary.exists():
+            return
+
+        summary_writer = SummaryWriter(
+            params=analysis_manager.params, destination=path_summary, summary=[]
+        )
+        summary_writer.summarize_specsimnetworkcosineparameters()
+        old_summary = path_summary.read_text().split("\n")
+        summary_writer.summary = [
+            (
+                summary_writer.summary[0]
+                if (
+                    "scored using the 'modified cosine' algorithm" in line
+                    and "a network was created" in line
+                )
+                or line.startswith(
+                    "During spectral similarity networking calculation using the "
+                    "modified cosine algorithm"
+                )
+                else line
+            )
+            for line in old_summary
+        ]
+        summary_writer.write_summary()
+
+    def write_output(self: Self, analysis_manager: AnalysisManager):
+        """Write the session file, the csv output, the graphml and summary file
+
+        Arguments:
+            analysis_manager: holding the objects of the re-thresholded run
+        """
+        with open(self.session_path, "w", encoding="utf-8") as outfile:
+            outfile.write(json.dumps(self.session, indent=2, ensure_ascii=False))
+
+        column = f"fermo:networks:{self.algorithm}:network_id"
+        clusters = analysis_manager.stats.networks[self.algorithm].feature_clusters()
+        for name in ("out.fermo.full.csv", "out.fermo.abbrev.csv"):
+            path_csv = self.session_path.parent.joinpath(name)
+            if not path_csv.exists():
+                continue
+            df = pd.read_csv(path_csv)
+            df[column] = df["id"].map(clusters.get)
+            df.to_csv(path_csv, encoding="utf-8", index=False, sep=",")
+
+        nx.write_graphml(
+            analysis_manager.stats.networks[self.algorithm].network(),
+            self.session_path.parent.joinpath(f"out.fermo.{self.algorithm}.graphml"),
+        )
+        self.write_summary(analysis_manager)
+
+    def run(
+        self: Self,
+        score_cutoff: Optional[float] = None,
+        max_nr_links: Optional[int] = None,
+    ):
+        """Re-threshold the network of the run and rewrite its output
+
+        Arguments:
+            score_cutoff: the new minimum similarity score (default: of the run)
+            max_nr_links: the new max nr of connections per node (default: of the run)
+
+        Raises:
+            RuntimeError: session file or candidate edges missing or insufficient
+        """
+        self.load_session()
+        params, stats, features, samples = self.restore_run()
+        settings = params.SpecSimNetworkCosineParameters
+
+        analysis_manager = AnalysisManager(
+            params=params, stats=stats, features=features, samples=samples
+        )
+        analysis_manager.rethreshold_networks(
+            score_cutoff if score_cutoff is not None else settings.score_cutoff,
+            max_nr_links if max_nr_links is not None else settings.max_nr_links,
+        )
+
+        self.update_session(analysis_manager)
+        self.write_output(analysis_manager)
+        logger.info(
+            f"'SessionRethresholder': re-thresholded '{self.algorithm}' network "
+            f"of '{self.session_path.name}' - DONE"
+        )
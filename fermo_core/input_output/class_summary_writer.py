@@ -23,7 +23,7 @@ SOFTWARE.
 
 import logging
 from pathlib import Path
-from typing import Self
+from typing import Any, Self
 
 from pydantic import BaseModel
 
@@ -50,6 +50,23 @@ class SummaryWriter(BaseModel):
         with open(self.destination, "w") as outfile:
             outfile.write("\n".join(self.summary))
 
+    @staticmethod
+    def summarize_max_nr_matches(params: Any) -> str:
+        """Describe the limit of retained library matches per feature, if any
+
+        Arguments:
+            params: the library matching parameters
+
+        Returns:
+            A sentence on the max nr of matches or an empty string if unlimited
+        """
+        if params.max_nr_matches is None:
+            return ""
+        return (
+            f" Per feature, at most '{params.max_nr_matches}' matches with the "
+            "highest scores were retained."
+        )
+
     def summarize_peaktableparameters(self: Self):
         if self.params.PeaktableParameters is not None:
             self.summary.append(
@@ -449,6 +466,7 @@ class SummaryWriter(BaseModel):
                 f"and the maximum precursor m/z difference of "
                 f"'{self.params.SpectralLibMatchingCosineParameters.max_precursor_mass_diff}"
                 f"' was not exceeded."
+                f"{self.summarize_max_nr_matches(self.params.SpectralLibMatchingCosineParameters)}"
             )
         else:
             self.summary.append(
@@ -477,7 +495,17 @@ class SummaryWriter(BaseModel):
                 f"and the maximum precursor m/z difference of "
                 f"'{self.params.SpectralLibMatchingDeepscoreParameters.max_precursor_mass_diff}"
                 f"' was not exceeded."
+                f"{self.summarize_max_nr_matches(self.params.SpectralLibMatchingDeepscoreParameters)}"
             )
+            if self.params.SpectralLibMatchingDeepscoreParameters.search == "ivf":
+                self.summary.append(
+                    f"Library spectra were searched approximately using an inverted "
+                    f"file index, probing the "
+                    f"'{self.params.SpectralLibMatchingDeepscoreParameters.nr_probe}' closest lists; per "
+                    f"feature, the "
+                    f"'{self.params.SpectralLibMatchingDeepscoreParameters.nr_candidates}' nearest library "
+                    f"spectra were rescored exactly."
+                )
         else:
             self.summary.append(
                 f"During spectral library matching using the MS2DeepScore "
@@ -511,6 +539,7 @@ class SummaryWriter(BaseModel):
                 f"and the maximum precursor m/z difference of "
                 f"'{self.params.AsKcbCosineMatchingParams.max_precursor_mass_diff}"
                 f"' was not exceeded."
+                f"{self.summarize_max_nr_matches(self.params.AsKcbCosineMatchingParams)}"
             )
         else:
             self.summary.append(
@@ -541,7 +570,17 @@ class SummaryWriter(BaseModel):
                 f"and the maximum precursor m/z difference of "
                 f"'{self.params.AsKcbDeepscoreMatchingParams.max_precursor_mass_diff}"
                 f"' was not exceeded."
+                f"{self.summarize_max_nr_matches(self.params.AsKcbDeepscoreMatchingParams)}"
             )
+            if self.params.AsKcbDeepscoreMatchingParams.search == "ivf":
+                self.summary.append(
+                    f"Library spectra were searched approximately using an inverted "
+                    f"file index, probing the "
+                    f"'{self.params.AsKcbDeepscoreMatchingParams.nr_probe}' closest lists; per "
+                    f"feature, the "
+                    f"'{self.params.AsKcbDeepscoreMatchingParams.nr_candidates}' nearest library "
+                    f"spectra were rescored exactly."
+                )
         else:
             self.summary.append(
                 f"During annotation using the antiSMASH KnownClusterBlast results, "
@@ -22,12 +22,14 @@ SOFTWARE.
 """
 
 import logging
+from pathlib import Path
 from typing import Self
 
 from pydantic import (
     BaseModel,
     DirectoryPath,
     FilePath,
+    NonNegativeInt,
     PositiveFloat,
     PositiveInt,
     model_validator,
@@ -331,6 +333,73 @@ class OutputParameters(BaseModel):
             return {"directory_path": "not specified"}
 
 
+class ShardNetworkingParameters(BaseModel):
+    """A Pydantic-based class for repr. and valid. of sharded networking params.
+
+    Spectral similarity networking split into a 'plan' run, independent 'work'
+    invocations and a 'merge' run sharing a directory.
+
+    Attributes:
+        directory_path: the shared directory of manifests, spectra and edge shards
+        step: 'plan' to write the manifests, 'merge' to build networks from shards
+        nr_blocks: the number of blocks (work invocations) per algorithm
+    """
+
+    directory_path: Path
+    step: str
+    nr_blocks: PositiveInt = 100
+
+    @model_validator(mode="after")
+    def val(self):
+        ValidationManager.validate_allowed(self.step, ["plan", "merge"])
+        if self.step == "plan":
+            self.directory_path.mkdir(parents=True, exist_ok=True)
+        return self
+
+    def to_json(self: Self) -> dict:
+        """Convert attributes to json-compatible ones."""
+        return {
+            "directory_path": str(self.directory_path),
+            "step": self.step,
+            "nr_blocks": int(self.nr_blocks),
+        }
+
+
+class SpectrumDeduplicationParameters(BaseModel):
+    """A Pydantic-based class for repr. and valid. of spectrum deduplication params.
+
+    Applied before spectral similarity networking and library matching.
+
+    Attributes:
+        activate_module: bool to indicate if module should be executed.
+        min_cosine: min. cosine of near-duplicate spectra; 1.0 for identical only.
+        fragment_tol: the bin width of near-duplicate detection, in m/z units.
+        module_passed: indicates that the module ran without errors
+    """
+
+    activate_module: bool = False
+    min_cosine: PositiveFloat = 1.0
+    fragment_tol: PositiveFloat = 0.1
+    module_passed: bool = False
+
+    @model_validator(mode="after")
+    def val(self):
+        ValidationManager.validate_float_zero_one(self.min_cosine)
+        return self
+
+    def to_json(self: Self) -> dict:
+        """Convert attributes to json-compatible ones."""
+        if self.activate_module:
+            return {
+                "activate_module": self.activate_module,
+                "min_cosine": float(self.min_cosine),
+                "fragment_tol": float(self.fragment_tol),
+                "module_passed": self.module_passed,
+            }
+        else:
+            return {"activate_module": self.activate_module}
+
+
 class AdductAnnotationParameters(BaseModel):
     """A Pydantic-based class for repr. and valid. of adduct annotation parameters.
 
@@ -432,6 +501,13 @@ class SpecSimNetworkCosineParameters(BaseModel):
         fragment_tol: the tolerance between matched fragments, in m/z units.
         score_cutoff: the minimum similarity score between two spectra.
         max_nr_links: max nr of connections from a node.
+        backend: the modified cosine implementation ('matchms', 'numpy')
+        nr_workers: the worker processes; with more than 1, pairs are scored in tiles
+        tile_size: the number of spectra per tile side of the scored matrix
+        prescreen: only score pairs whose binned upper bound reaches score_cutoff
+        incremental: persist the edges and only score spectra not stored yet
+        store_candidates: persist the candidate edges for later re-thresholding
+        candidate_floor: the minimum score of candidate edges if below score_cutoff
         module_passed: indicates that the module ran without errors
     """
 
@@ -440,11 +516,20 @@ class SpecSimNetworkCosineParameters(BaseModel):
     fragment_tol: PositiveFloat
     score_cutoff: PositiveFloat
     max_nr_links: PositiveInt
+    backend: str = "matchms"
+    nr_workers: PositiveInt = 1
+    tile_size: PositiveInt = 1000
+    prescreen: bool = True
+    incremental: bool = False
+    store_candidates: bool = False
+    candidate_floor: PositiveFloat = 0.5
     module_passed: bool = False
 
     @model_validator(mode="after")
     def val(self):
         ValidationManager.validate_float_zero_one(self.score_cutoff)
+        ValidationManager.validate_allowed(self.backend, ["matchms", "numpy"])
+        ValidationManager.validate_float_zero_one(self.candidate_floor)
         return self
 
     def to_json(self: Self) -> dict:
@@ -456,6 +541,13 @@ class SpecSimNetworkCosineParameters(BaseModel):
                 "fragment_tol": float(self.fragment_tol),
                 "score_cutoff": float(self.score_cutoff),
                 "max_nr_links": int(self.max_nr_links),
+                "backend": str(self.backend),
+                "nr_workers": int(self.nr_workers),
+                "tile_size": int(self.tile_size),
+                "prescreen": self.prescreen,
+                "incremental": self.incremental,
+                "store_candidates": self.store_candidates,
+                "candidate_floor": float(self.candidate_floor),
                 "module_passed": self.module_passed,
             }
         else:
@@ -472,6 +564,11 @@ class SpecSimNetworkDeepscoreParameters(BaseModel):
         score_cutoff: the minimum similarity score between two spectra.
         max_nr_links: max links to a single spectra.
         msms_min_frag_nr: minimum number of fragments in MS2 to run it in analysis
+        backend: the MS2DeepScore inference backend ('keras', 'numpy')
+        batch_size: the number of spectra embedded per inference batch
+        nr_threads: the CPU threads used for inference, 0 for the library default
+        concurrent: run alongside modified cosine networking, in a separate thread
+        incremental: persist the edges and only score spectra not stored yet
         module_passed: indicates that the module ran without errors
     """
 
@@ -479,11 +576,17 @@ class SpecSimNetworkDeepscoreParameters(BaseModel):
     score_cutoff: PositiveFloat
     max_nr_links: PositiveInt
     msms_min_frag_nr: PositiveInt
+    backend: str = "keras"
+    batch_size: PositiveInt = 1024
+    nr_threads: NonNegativeInt = 0
+    concurrent: bool = True
+    incremental: bool = False
     module_passed: bool = False
 
     @model_validator(mode="after")
     def val(self):
         ValidationManager.validate_float_zero_one(self.score_cutoff)
+        ValidationManager.validate_allowed(self.backend, ["keras", "numpy"])
         return self
 
     def to_json(self: Self) -> dict:
@@ -494,6 +597,11 @@ class SpecSimNetworkDeepscoreParameters(BaseModel):
                 "score_cutoff": float(self.score_cutoff),
                 "max_nr_links": int(self.max_nr_links),
                 "msms_min_frag_nr": int(self.msms_min_frag_nr),
+                "backend": str(self.backend),
+                "batch_size": int(self.batch_size),
+                "nr_threads": int(self.nr_threads),
+                "concurrent": self.concurrent,
+                "incremental": self.incremental,
                 "module_passed": self.module_passed,
             }
         else:
@@ -790,6 +898,8 @@ class SpectralLibMatchingCosineParameters(BaseModel):
         min_nr_matched_peaks: peak cutoff to consider a match of two MS/MS spectra
         score_cutoff: score cutoff to consider a match of two MS/MS spectra
         max_precursor_mass_diff: maximum precursor mass difference
+        max_nr_matches: max nr of best-scoring matches per feature, None for all
+        backend: the modified cosine implementation ('matchms', 'numpy')
         module_passed: indicates that the module ran without errors
     """
 
@@ -798,8 +908,15 @@ class SpectralLibMatchingCosineParameters(BaseModel):
     min_nr_matched_peaks: PositiveInt
     score_cutoff: PositiveFloat
     max_precursor_mass_diff: PositiveInt
+    max_nr_matches: PositiveInt | None = None
+    backend: str = "matchms"
     module_passed: bool = False
 
+    @model_validator(mode="after")
+    def val(self):
+        ValidationManager.validate_allowed(self.backend, ["matchms", "numpy"])
+        return self
+
     def to_json(self: Self) -> dict:
         """Convert attributes to json-compatible ones."""
         if self.activate_module:
@@ -809,6 +926,8 @@ class SpectralLibMatchingCosineParameters(BaseModel):
                 "min_nr_matched_peaks": int(self.min_nr_matched_peaks),
                 "score_cutoff": float(self.score_cutoff),
                 "max_precursor_mass_diff": int(self.max_precursor_mass_diff),
+                "max_nr_matches": self.max_nr_matches,
+                "backend": str(self.backend),
                 "module_passed": self.module_passed,
             }
         else:
@@ -824,14 +943,34 @@ class SpectralLibMatchingDeepscoreParameters(BaseModel):
         activate_module: bool to indicate if module should be executed.
         score_cutoff: score cutoff to consider a match of two MS/MS spectra.
         max_precursor_mass_diff: max allowed precursor mz difference to accept a match
+        max_nr_matches: max nr of best-scoring matches per feature, None for all
+        search: the library search ('exact', 'ivf')
+        nr_candidates: approximate nearest library spectra rescored per feature ('ivf')
+        nr_probe: the inverted file index lists searched per feature ('ivf')
+        backend: the MS2DeepScore inference backend ('keras', 'numpy')
+        batch_size: the number of spectra embedded per inference batch
+        nr_threads: the CPU threads used for inference, 0 for the library default
         module_passed: indicates that the module ran without errors
     """
 
     activate_module: bool = False
     score_cutoff: PositiveFloat
     max_precursor_mass_diff: PositiveInt
+    max_nr_matches: PositiveInt | None = None
+    search: str = "exact"
+    nr_candidates: PositiveInt = 100
+    nr_probe: PositiveInt = 8
+    backend: str = "keras"
+    batch_size: PositiveInt = 1024
+    nr_threads: NonNegativeInt = 0
     module_passed: bool = False
 
+    @model_validator(mode="after")
+    def val(self):
+        ValidationManager.validate_allowed(self.search, ["exact", "ivf"])
+        ValidationManager.validate_allowed(self.backend, ["keras", "numpy"])
+        return self
+
     def to_json(self: Self) -> dict:
         """Convert attributes to json-compatible ones."""
         if self.activate_module:
@@ -839,6 +978,13 @@ class SpectralLibMatchingDeepscoreParameters(BaseModel):
                 "activate_module": self.activate_module,
                 "score_cutoff": float(self.score_cutoff),
                 "max_precursor_mass_diff": int(self.max_precursor_mass_diff),
+                "max_nr_matches": self.max_nr_matches,
+                "search": str(self.search),
+                "nr_candidates": int(self.nr_candidates),
+                "nr_probe": int(self.nr_probe),
+                "backend": str(self.backend),
+                "batch_size": int(self.batch_size),
+                "nr_threads": int(self.nr_threads),
                 "module_passed": self.module_passed,
             }
         else:
@@ -854,6 +1000,8 @@ class AsKcbCosineMatchingParams(BaseModel):
         min_nr_matched_peaks: peak cutoff to consider a match of two MS/MS spectra
         score_cutoff: score cutoff to consider a match of two MS/MS spectra
         max_precursor_mass_diff: maximum precursor mass difference
+        max_nr_matches: max nr of best-scoring matches per feature, None for all
+        backend: the modified cosine implementation ('matchms', 'numpy')
         module_passed: indicates that the module ran without errors
     """
 
@@ -862,8 +1010,15 @@ class AsKcbCosineMatchingParams(BaseModel):
     min_nr_matched_peaks: PositiveInt
     score_cutoff: PositiveFloat
     max_precursor_mass_diff: PositiveInt
+    max_nr_matches: PositiveInt | None = None
+    backend: str = "matchms"
     module_passed: bool = False
 
+    @model_validator(mode="after")
+    def val(self):
+        ValidationManager.validate_allowed(self.backend, ["matchms", "numpy"])
+        return self
+
     def to_json(self: Self) -> dict:
         """Convert attributes to json-compatible ones."""
         if self.activate_module:
@@ -873,6 +1028,8 @@ class AsKcbCosineMatchingParams(BaseModel):
                 "min_nr_matched_peaks": int(self.min_nr_matched_peaks),
                 "score_cutoff": float(self.score_cutoff),
                 "max_precursor_mass_diff": int(self.max_precursor_mass_diff),
+                "max_nr_matches": self.max_nr_matches,
+                "backend": str(self.backend),
                 "module_passed": self.module_passed,
             }
         else:
@@ -886,6 +1043,13 @@ class AsKcbDeepscoreMatchingParams(BaseModel):
         activate_module: bool to indicate if module should be executed.
         score_cutoff: score cutoff to consider a match of two MS/MS spectra.
         max_precursor_mass_diff: max allowed precursor mz difference to accept a match
+        max_nr_matches: max nr of best-scoring matches per feature, None for all
+        search: the library search ('exact', 'ivf')
+        nr_candidates: approximate nearest library spectra rescored per feature ('ivf')
+        nr_probe: the inverted file index lists searched per feature ('ivf')
+        backend: the MS2DeepScore inference backend ('keras', 'numpy')
+        batch_size: the number of spectra embedded per inference batch
+        nr_threads: the CPU threads used for inference, 0 for the library default
         module_passed: indicates that the module ran without errors
 
     Raise:
@@ -895,8 +1059,21 @@ class AsKcbDeepscoreMatchingParams(BaseModel):
     activate_module: bool = False
     score_cutoff: PositiveFloat
     max_precursor_mass_diff: PositiveInt
+    max_nr_matches: PositiveInt | None = None
+    search: str = "exact"
+    nr_candidates: PositiveInt = 100
+    nr_probe: PositiveInt = 8
+    backend: str = "keras"
+    batch_size: PositiveInt = 1024
+    nr_threads: NonNegativeInt = 0
     module_passed: bool = False
 
+    @model_validator(mode="after")
+    def val(self):
+        ValidationManager.validate_allowed(self.search, ["exact", "ivf"])
+        ValidationManager.validate_allowed(self.backend, ["keras", "numpy"])
+        return self
+
     def to_json(self: Self) -> dict:
         """Convert attributes to json-compatible ones."""
         if self.activate_module:
@@ -904,6 +1081,13 @@ class AsKcbDeepscoreMatchingParams(BaseModel):
                 "activate_module": self.activate_module,
                 "score_cutoff": float(self.score_cutoff),
                 "max_precursor_mass_diff": int(self.max_precursor_mass_diff),
+                "max_nr_matches": self.max_nr_matches,
+                "search": str(self.search),
+                "nr_candidates": int(self.nr_candidates),
+                "nr_probe": int(self.nr_probe),
+                "backend": str(self.backend),
+                "batch_size": int(self.batch_size),
+                "nr_threads": int(self.nr_threads),
                 "module_passed": self.module_passed,
             }
         else:
@@ -31,14 +31,28 @@ from importlib import metadata
 from pathlib import Path
 
 import coloredlogs
+from pydantic import ValidationError
 
 from fermo_core.data_analysis.class_analysis_manager import AnalysisManager
+from fermo_core.data_analysis.sim_networks_manager.class_shard_manager import (
+    ShardManager,
+)
+from fermo_core.data_processing.class_stats import Stats
 from fermo_core.data_processing.parser.class_general_parser import GeneralParser
+from fermo_core.data_processing.parser.spec_library_parser.class_spec_lib_mgf_parser import (
+    SpecLibMgfParser,
+)
 from fermo_core.input_output.class_argparse_manager import ArgparseManager
 from fermo_core.input_output.class_export_manager import ExportManager
 from fermo_core.input_output.class_file_manager import FileManager
 from fermo_core.input_output.class_parameter_manager import ParameterManager
+from fermo_core.input_output.class_session_rethresholder import SessionRethresholder
 from fermo_core.input_output.class_validation_manager import ValidationManager
+from fermo_core.input_output.param_handlers import SpecLibParameters
+from fermo_core.utils.class_library_embeddings import (
+    precompute_library_embeddings,
+    precompute_mibig_embeddings,
+)
 
 
 def main(params: ParameterManager, starttime: datetime, logger: logging.Logger):
@@ -62,6 +76,10 @@ def main(params: ParameterManager, starttime: datetime, logger: logging.Logger):
         analysis_manager.analyze()
         stats, features, samples, params = analysis_manager.return_attributes()
 
+        if getattr(params.ShardNetworkingParameters, "step", None) == "plan":
+            logger.info("'main': planned sharded networking - DONE")
+            return
+
         export_manager = ExportManager(
             params=params, stats=stats, features=features, samples=samples
         )
@@ -119,11 +137,129 @@ def configure_logger_results(args: Namespace) -> logging.Logger:
     return logger
 
 
+def configure_logger_console(args: Namespace) -> logging.Logger:
+    """Set up logging to the console only, for runs without a parameters file
+
+    Arguments:
+        args: the argparse object containing user params
+    """
+    logger = logging.getLogger("fermo_core")
+    logger.setLevel(logging.DEBUG)
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(getattr(logging, args.verboseness))
+    console_handler.setFormatter(
+        coloredlogs.ColoredFormatter(
+            "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+        )
+    )
+    logger.addHandler(console_handler)
+    return logger
+
+
+def run_shard_work(args: Namespace):
+    """Score blocks of a sharded networking manifest and write the edge shards.
+
+    Needs neither the parameters file nor the input data; the manifest directory
+    holds the preprocessed spectra.
+
+    Arguments:
+        args: the argparse object containing user params
+    """
+    logger = configure_logger_console(args)
+    try:
+        ShardManager(directory_path=Path(args.shard_work).parent).work(args.shard_block)
+    except (RuntimeError, OSError, ValueError) as e:
+        logger.error(str(e))
+        logger.error(
+            f"'main': could not score the blocks of '{args.shard_work}' - SKIP"
+        )
+        sys.exit(1)
+
+
+def run_rethreshold(args: Namespace):
+    """Rebuild the modified cosine network of a finished run for new thresholds.
+
+    Needs neither the parameters file nor the input data; the session file and the
+    candidate edges stored next to it hold the run.
+
+    Arguments:
+        args: the argparse object containing user params
+    """
+    logger = configure_logger_console(args)
+    try:
+        SessionRethresholder(session_path=Path(args.rethreshold)).run(
+            args.score_cutoff, args.max_nr_links
+        )
+    except (RuntimeError, ValidationError) as e:
+        logger.error(str(e))
+        logger.error(
+            f"'main': could not re-threshold the network of '{args.rethreshold}' "
+            "- SKIP"
+        )
+        sys.exit(1)
+
+
+def run_precompute_embeddings(args: Namespace):
+    """Embed a spectral library with the default MS2DeepScore model and exit.
+
+    The embeddings are stored next to the library ('mibig' for the bundled MIBiG
+    library) and reused by all following ms2deepscore library matching runs.
+
+    Arguments:
+        args: the argparse object containing user params
+    """
+    logger = configure_logger_console(args)
+    try:
+        if args.precompute_embeddings == "mibig":
+            embeddings = precompute_mibig_embeddings(backend=args.embedding_backend)
+        else:
+            params = ParameterManager()
+            params.SpecLibParameters = SpecLibParameters(
+                dirpath=args.precompute_embeddings, format="mgf"
+            )
+            parser = SpecLibMgfParser(params=params, stats=Stats())
+            parser.parse()
+            spectra = parser.return_stats().spectral_library
+            if not spectra:
+                raise RuntimeError(
+                    f"'main': no valid spectra in '{args.precompute_embeddings}'."
+                )
+            embeddings = precompute_library_embeddings(
+                params.SpecLibParameters.dirpath,
+                spectra,
+                backend=args.embedding_backend,
+            )
+    except (RuntimeError, OSError, ValidationError) as e:
+        logger.error(str(e))
+        logger.error(
+            f"'main': could not precompute the embeddings of "
+            f"'{args.precompute_embeddings}' - SKIP"
+        )
+        sys.exit(1)
+
+    logger.info(
+        f"'main': stored '{len(embeddings.keys)}' embeddings in "
+        f"'{embeddings.filepath()}' - DONE"
+    )
+
+
 def main_cli():
     """Interface for installer."""
     start_time = datetime.now()
     args = ArgparseManager().run_argparse(metadata.version("fermo_core"), sys.argv[1:])
 
+    if args.shard_work is not None:
+        run_shard_work(args)
+        return
+
+    if args.rethreshold is not None:
+        run_rethreshold(args)
+        return
+
+    if args.precompute_embeddings is not None:
+        run_precompute_embeddings(args)
+        return
+
     logger = configure_logger_results(args=args)
     logger.info(f"Started 'fermo_core' v'{metadata.version('fermo_core')}' as CLI.")
     logger.debug(
@@ -138,6 +274,17 @@ def main_cli():
 
     param_manager = ParameterManager()
     param_manager.assign_parameters_cli(user_input)
+    if args.shard_step is not None:
+        param_manager.assign_shard_networking(
+            {
+                "directory_path": (
+                    args.shard_dir
+                    or param_manager.OutputParameters.directory_path.joinpath("shards")
+                ),
+                "step": args.shard_step,
+                "nr_blocks": args.shard_nr_blocks,
+            }
+        )
     main(params=param_manager, starttime=start_time, logger=logger)
 
 
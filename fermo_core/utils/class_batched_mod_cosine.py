@@ -0,0 +1,373 @@
+"""Batched modified cosine scoring of spectrum pairs on flat peak arrays.
+
+Copyright (c) 2022 to present Mitja Maximilian Zdouc, PhD
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from typing import Self
+
+import numpy as np
+from matchms.similarity import ModifiedCosine
+from sparsestack import StackedSparseArray
+
+from fermo_core.utils.utility_method_manager import UtilityMethodManager
+
+
+class PeakStore:
+    """Flat peak arrays of a list of spectra
+
+    Attributes:
+        mz: the concatenated fragment m/z of all spectra
+        intens: the concatenated fragment intensities of all spectra
+        offsets: the start of the peaks of each spectrum (and the total as last)
+        precursor: the precursor m/z of each spectrum (NaN if missing)
+        norm: the norm of the intensities of each spectrum
+    """
+
+    def __init__(self: Self, spectra: list):
+        self.mz = np.concatenate([s.peaks.mz for s in spectra] + [np.zeros(0)])
+        self.intens = np.concatenate(
+            [s.peaks.intensities for s in spectra] + [np.zeros(0)]
+        )
+        self.offsets = np.concatenate(
+            ([0], np.cumsum([len(s.peaks.mz) for s in spectra]))
+        ).astype(int)
+        self.precursor = np.array(
+            [s.metadata.get("precursor_mz") or np.nan for s in spectra], dtype=float
+        )
+        self.norm = np.array(
+            [np.sum(s.peaks.intensities**2) ** 0.5 for s in spectra], dtype=float
+        )
+
+
+class BatchedModifiedCosine(ModifiedCosine):
+    """Modified cosine scoring of batches of spectrum pairs
+
+    Drop-in replacement of the matchms ModifiedCosine (mz_power 0, intensity_power
+    1). Instead of matching the peaks of one pair at a time, the peaks of all pairs
+    of a batch are matched in one vectorized tolerance-window search (unshifted and
+    shifted by the precursor m/z difference). The greedy assignment of matched
+    peaks is solved for all pairs at once: in each round, every edge that has the
+    highest intensity product at both of its peaks is accepted, which reproduces the
+    sequential greedy assignment of matchms.
+
+    Attributes:
+        tolerance: peaks are matched when <= tolerance apart
+        batch_size: the number of pairs scored per batch
+    """
+
+    def __init__(self: Self, tolerance: float = 0.1, batch_size: int = 10000):
+        super().__init__(tolerance=tolerance)
+        self.batch_size = batch_size
+
+    def pair(self: Self, reference, query) -> np.ndarray:
+        """Calculate the modified cosine score of a single pair of spectra
+
+        Arguments:
+            reference: the reference matchms Spectrum
+            query: the query matchms Spectrum
+
+        Returns:
+            A structured array of the score and the number of matched peaks
+        """
+        return self.sparse_array(
+            [reference], [query], np.zeros(1, dtype=int), np.zeros(1, dtype=int)
+        )[0]
+
+    def matrix(
+        self: Self,
+        references: list,
+        queries: list,
+        array_type: str = "numpy",
+        is_symmetric: bool = False,
+    ) -> np.ndarray | StackedSparseArray:
+        """Calculate the modified cosine scores of all references against all queries
+
+        Arguments:
+            references: a list of matchms Spectrum objects
+            queries: a list of matchms Spectrum objects
+            array_type: the output type, 'numpy' or 'sparse'
+            is_symmetric: references and queries are identical: only the upper
+                triangle is calculated
+
+        Returns:
+            A dense structured array or a StackedSparseArray of the scores
+
+        Raises:
+            ValueError: unknown array_type
+        """
+        n_rows, n_cols = len(references), len(queries)
+        if is_symmetric:
+            idx_row, idx_col = np.triu_indices(n_rows)
+        else:
+            idx_row, idx_col = np.divmod(np.arange(n_rows * n_cols), n_cols)
+
+        scores = self.sparse_array(references, queries, idx_row, idx_col)
+        keep = (scores["score"] != 0) & (scores["matches"] != 0)
+        idx_row, idx_col, scores = idx_row[keep], idx_col[keep], scores[keep]
+
+        if is_symmetric:
+            off_diag = idx_row != idx_col
+            idx_row, idx_col = (
+                np.concatenate((idx_row, idx_col[off_diag])),
+                np.concatenate((idx_col, idx_row[off_diag])),
+            )
+            scores = np.concatenate((scores, scores[off_diag]))
+
+        if array_type == "numpy":
+            scores_array = np.zeros((n_rows, n_cols), dtype=self.score_datatype)
+            scores_array[idx_row, idx_col] = scores
+            return scores_array
+        if array_type == "sparse":
+            scores_array = StackedSparseArray(n_rows, n_cols)
+            scores_array.add_sparse_data(idx_row, idx_col, scores, "")
+            return scores_array
+        raise ValueError("array_type must be 'numpy' or 'sparse'.")
+
+    def sparse_array(
+        self: Self,
+        references: list,
+        queries: list,
+        idx_row: np.ndarray,
+        idx_col: np.ndarray,
+        is_symmetric: bool = False,
+    ) -> np.ndarray:
+        """Calculate the modified cosine scores of the given reference-query pairs
+
+        Arguments:
+            references: a list of matchms Spectrum objects
+            queries: a list of matchms Spectrum objects
+            idx_row: the reference index of each pair
+            idx_col: the query index of each pair
+            is_symmetric: ignored, kept for compatibility with matchms
+
+        Returns:
+            A structured array of the score and the number of matched peaks per pair
+        """
+        ref_store = PeakStore(references)
+        query_store = ref_store if queries is references else PeakStore(queries)
+
+        idx_row = np.asarray(idx_row, dtype=int)
+        idx_col = np.asarray(idx_col, dtype=int)
+        scores = np.zeros(len(idx_row), dtype=self.score_datatype)
+        for start in range(0, len(idx_row), self.batch_size):
+            stop = start + self.batch_size
+            scores[start:stop] = self.score_batch(
+                ref_store, query_store, idx_row[start:stop], idx_col[start:stop]
+            )
+        return scores
+
+    def match_peaks(
+        self: Self,
+        ref_store: PeakStore,
+        query_store: PeakStore,
+        pair_ref: np.ndarray,
+        pair_query: np.ndarray,
+        shift: np.ndarray,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Find all peak pairs within tolerance for a batch of spectrum pairs
+
+        The reference peaks are searched in one sorted array of keys, in which the
+        peaks of each pair's reference spectrum occupy a separate segment.
+
+        Arguments:
+            ref_store: the flat peaks of the reference spectra
+            query_store: the flat peaks of the query spectra
+            pair_ref: the reference spectrum of each pair
+            pair_query: the query spectrum of each pair
+            shift: the m/z shift applied to the query peaks of each pair
+
+        Returns:
+            A tuple of pair indices, reference peaks and query peaks (flat indices)
+        """
+        pair, query_peak = UtilityMethodManager.expand_index_ranges(
+            start=query_store.offsets[pair_query],
+            stop=query_store.offsets[pair_query + 1],
+        )
+        ref_spec = pair_ref[pair]
+        shifted = query_store.mz[query_peak] + shift[pair]
+
+        if len(ref_store.mz) == 0 or len(shifted) == 0:
+            return pair[:0], pair[:0], pair[:0]
+
+        tol = self.tolerance
+        low, high = ref_store.mz.min(), ref_store.mz.max()
+        span = (high - low) + 4 * tol + 3
+        peak_spec = np.repeat(
+            np.arange(len(ref_store.offsets) - 1), np.diff(ref_store.offsets)
+        )
+        keys = peak_spec * span + (ref_store.mz - low)
+        margin = 10**-6 + 4 * np.spacing(len(ref_store.offsets) * span)
+
+        center = ref_spec * span + np.clip(
+            shifted - low, -2 * tol - 1, span - 2 * tol - 2
+        )
+        hit, pos = UtilityMethodManager.expand_index_ranges(
+            start=np.searchsorted(keys, center - tol - margin, side="left"),
+            stop=np.searchsorted(keys, center + tol + margin, side="right"),
+        )
+
+        ref_mz = ref_store.mz[pos]
+        exact = (shifted[hit] >= ref_mz - tol) & (shifted[hit] <= ref_mz + tol)
+        exact &= peak_spec[pos] == ref_spec[hit]
+        hit, pos = hit[exact], pos[exact]
+        return pair[hit], pos, query_peak[hit]
+
+    def score_batch(
+        self: Self,
+        ref_store: PeakStore,
+        query_store: PeakStore,
+        pair_ref: np.ndarray,
+        pair_query: np.ndarray,
+    ) -> np.ndarray:
+        """Calculate the modified cosine scores of a batch of pairs
+
+        Arguments:
+            ref_store: the flat peaks of the reference spectra
+            query_store: the flat peaks of the query spectra
+            pair_ref: the reference spectrum of each pair
+            pair_query: the query spectrum of each pair
+
+        Returns:
+            A structured array of the score and the number of matched peaks per pair
+
+        Notes:
+            Peaks of spectra without precursor m/z are only matched unshifted.
+            Ties of intensity products are resolved as in matchms for small spectra
+            (later candidate first); the order of larger tied sets is not defined by
+            matchms either.
+        """
+        nr_pairs = len(pair_ref)
+        shifts = (
+            np.zeros(nr_pairs),
+            ref_store.precursor[pair_ref] - query_store.precursor[pair_query],
+        )
+
+        edges = [
+            (*self.match_peaks(ref_store, query_store, pair_ref, pair_query, s), block)
+            for block, s in enumerate(shifts)
+        ]
+        pair = np.concatenate([e[0] for e in edges])
+        ref_peak = np.concatenate([e[1] for e in edges])
+        query_peak = np.concatenate([e[2] for e in edges])
+        block = np.concatenate([np.full(len(e[0]), e[3]) for e in edges])
+        product = ref_store.intens[ref_peak] * query_store.intens[query_peak]
+
+        order = self.priority_order(pair, block, ref_peak, query_peak, product)
+        pair, ref_peak, query_peak, product = (
+            pair[order],
+            ref_peak[order],
+            query_peak[order],
+            product[order],
+        )
+
+        accepted = self.greedy_assignment(pair, ref_peak, query_peak)
+
+        scores = np.zeros(nr_pairs, dtype=self.score_datatype)
+        summed = np.bincount(
+            pair[accepted], weights=product[accepted], minlength=nr_pairs
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores["score"] = np.where(
+                summed != 0,
+                summed / (ref_store.norm[pair_ref] * query_store.norm[pair_query]),
+                0.0,
+            )
+        scores["matches"] = np.bincount(pair[accepted], minlength=nr_pairs)
+        return scores
+
+    @staticmethod
+    def priority_order(
+        pair: np.ndarray,
+        block: np.ndarray,
+        ref_peak: np.ndarray,
+        query_peak: np.ndarray,
+        product: np.ndarray,
+    ) -> np.ndarray:
+        """Order the edges of each pair by descending intensity product
+
+        Arguments:
+            pair: the pair index of each edge
+            block: 0 for unshifted and 1 for shifted edges
+            ref_peak: the reference peak of each edge
+            query_peak: the query peak of each edge
+            product: the intensity product of each edge
+
+        Returns:
+            The edge indices, grouped by pair and sorted by priority
+
+        Notes:
+            matchms sorts the candidates of a pair (unshifted, then shifted, each in
+            peak order) with np.argsort and reverses the result. Pairs with tied
+            products are sorted the same way to resolve the ties identically.
+        """
+        position = np.lexsort((query_peak, ref_peak, block, pair))
+        ranked = np.lexsort((-np.arange(len(pair)), -product[position], pair[position]))
+        order = position[ranked]
+
+        tied = (pair[order][1:] == pair[order][:-1]) & (
+            product[order][1:] == product[order][:-1]
+        )
+        bounds = np.searchsorted(pair[position], np.arange(pair.max(initial=-1) + 2))
+        for p in np.unique(pair[order][1:][tied]):
+            start, stop = bounds[p], bounds[p + 1]
+            order[start:stop] = position[
+                start + np.argsort(product[position[start:stop]])[::-1]
+            ]
+        return order
+
+    @staticmethod
+    def greedy_assignment(
+        pair: np.ndarray, ref_peak: np.ndarray, query_peak: np.ndarray
+    ) -> np.ndarray:
+        """Assign each peak at most once, taking edges in the given order
+
+        Arguments:
+            pair: the pair index of each edge
+            ref_peak: the reference peak of each edge
+            query_peak: the query peak of each edge; edges sorted by priority
+
+        Returns:
+            A boolean mask of the accepted edges
+        """
+        width = max(ref_peak.max(initial=0), query_peak.max(initial=0)) + 1
+        _, ref_node = np.unique(pair * width + ref_peak, return_inverse=True)
+        _, query_node = np.unique(pair * width + query_peak, return_inverse=True)
+
+        accepted = np.zeros(len(pair), dtype=bool)
+        used_ref = np.zeros(ref_node.max(initial=-1) + 1, dtype=bool)
+        used_query = np.zeros(query_node.max(initial=-1) + 1, dtype=bool)
+        active = np.flatnonzero(np.ones(len(pair), dtype=bool))
+
+        while len(active) != 0:
+            first_ref = np.zeros(len(active), dtype=bool)
+            first_ref[np.unique(ref_node[active], return_index=True)[1]] = True
+            first_query = np.zeros(len(active), dtype=bool)
+            first_query[np.unique(query_node[active], return_index=True)[1]] = True
+
+            dominant = active[first_ref & first_query]
+            accepted[dominant] = True
+            used_ref[ref_node[dominant]] = True
+            used_query[query_node[dominant]] = True
+            active = active[
+                ~(used_ref[ref_node[active]] | used_query[query_node[active]])
+            ]
+
+        return accepted
@@ -0,0 +1,120 @@
+"""Sparse-vector upper bound of modified cosine scores to prescreen spectrum pairs.
+
+Copyright (c) 2022 to present Mitja Maximilian Zdouc, PhD
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from typing import Any, Optional, Self
+
+import numpy as np
+from pydantic import BaseModel
+from scipy import sparse
+
+
+class CosinePrescreen(BaseModel):
+    """Pydantic-based class to organize the bound-based prescreen of spectrum pairs
+
+    Each spectrum is binned into a sparse vector over fragment m/z bins and
+    neutral loss (precursor m/z - fragment m/z) bins of width 'tolerance', holding
+    the summed intensities divided by the spectrum norm. Peaks matched by modified
+    cosine lie in the same or adjacent bins: unshifted matches by m/z, shifted
+    matches by neutral loss. The product of a binned vector with the binned vector
+    of another spectrum spread to the adjacent bins therefore sums at least all
+    matched intensity products: it is an upper bound of the modified cosine score.
+    Pairs whose bound stays below the score cutoff are never scored exactly.
+
+    Attributes:
+        tolerance: peaks are matched when <= tolerance apart
+        vectors: the sparse binned vectors, one row per spectrum
+        spread: the binned vectors spread to the adjacent bins
+    """
+
+    tolerance: float
+    vectors: Optional[Any] = None
+    spread: Optional[Any] = None
+
+    def build(self: Self, spectra: list) -> Self:
+        """Bin the spectra into sparse fragment and neutral loss vectors
+
+        Arguments:
+            spectra: a list of matchms Spectrum objects
+
+        Returns:
+            The CosinePrescreen instance
+        """
+        width = self.tolerance * (1 + 1e-6)
+        counts = np.array([len(s.peaks.mz) for s in spectra], dtype=int)
+        owner = np.repeat(np.arange(len(spectra)), counts)
+        mz = np.concatenate([s.peaks.mz for s in spectra] + [np.zeros(0)])
+        intens = np.concatenate([s.peaks.intensities for s in spectra] + [np.zeros(0)])
+        precursor = np.repeat(
+            np.array(
+                [s.metadata.get("precursor_mz") or np.nan for s in spectra],
+                dtype=float,
+            ),
+            counts,
+        )
+        norm = np.sqrt(np.bincount(owner, weights=intens**2, minlength=len(spectra)))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            weights = np.where(norm[owner] != 0, intens / norm[owner], 0.0)
+
+        has_loss = ~np.isnan(precursor)
+        bins = np.concatenate(
+            (
+                np.floor(mz / width),
+                np.floor((precursor[has_loss] - mz[has_loss]) / width),
+            )
+        ).astype(np.int64)
+        kind = np.repeat([0, 1], [len(mz), np.count_nonzero(has_loss)])
+        rows = np.concatenate((owner, owner[has_loss]))
+        values = np.concatenate((weights, weights[has_loss]))
+
+        spread_bins = np.concatenate((bins - 1, bins, bins + 1))
+        columns, inverse = np.unique(
+            np.stack((np.tile(kind, 3), spread_bins)), axis=1, return_inverse=True
+        )
+        inverse = inverse.reshape(-1)
+        shape = (len(spectra), columns.shape[1])
+
+        self.vectors = sparse.csr_matrix(
+            (values, (rows, inverse[len(bins) : 2 * len(bins)])), shape=shape
+        )
+        self.spread = sparse.csr_matrix(
+            (np.tile(values, 3), (np.tile(rows, 3), inverse)), shape=shape
+        )
+        return self
+
+    def candidates(
+        self: Self, tile: tuple, score_cutoff: float
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return the pairs of a tile whose upper bound reaches the cutoff
+
+        Arguments:
+            tile: a tuple (row start, row stop, column start, column stop)
+            score_cutoff: the minimum score of a retained pair
+
+        Returns:
+            A tuple of the row and column indices of the candidate pairs
+        """
+        r_start, r_stop, c_start, c_stop = tile
+        bound = (self.vectors[r_start:r_stop] @ self.spread[c_start:c_stop].T).tocoo()
+        rows, cols = bound.row + r_start, bound.col + c_start
+        keep = (bound.data >= score_cutoff - 1e-9) & (rows < cols)
+        return rows[keep], cols[keep]
@@ -0,0 +1,569 @@
+"""Persistent cache of MS2DeepScore spectrum embeddings.
+
+Copyright (c) 2022 to present Mitja Maximilian Zdouc, PhD
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import hashlib
+import logging
+import time
+from collections.abc import Callable, Iterator
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from functools import cache
+from pathlib import Path
+from typing import Any, Optional, Self
+
+import numpy as np
+from matchms.similarity.BaseSimilarity import BaseSimilarity
+from pydantic import BaseModel
+
+from fermo_core.config.class_default_settings import DefaultPaths
+from fermo_core.utils.class_numpy_ms2deepscore import NumpyMS2DeepScore
+
+logger = logging.getLogger("fermo_core")
+
+
+@cache
+def hash_file(path: str, size: int, mtime_ns: int) -> str:
+    """Calculate the sha256 hash of a file, cached per path, size and mtime
+
+    Arguments:
+        path: the path to the file
+        size: the file size, part of the cache key
+        mtime_ns: the file modification time, part of the cache key
+
+    Returns:
+        The hex digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as infile:
+        for chunk in iter(lambda: infile.read(2**20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@cache
+def get_embedding_cache(
+    file_hash: str, dim: int, cache_dir: Optional[Path], max_size: Optional[int]
+) -> "EmbeddingCache":
+    """Return the process-wide embedding cache of a model
+
+    Arguments:
+        file_hash: the hash of the model file
+        dim: the dimension of the embeddings
+        cache_dir: the directory of the on-disk store or None for memory only
+        max_size: the max. size of the cache directory in bytes or None
+
+    Returns:
+        An EmbeddingCache instance shared by all callers in the process
+    """
+    return EmbeddingCache(
+        file_hash=file_hash, dim=dim, cache_dir=cache_dir, max_size=max_size
+    )
+
+
+class EmbeddingCache(BaseModel):
+    """Pydantic-based class to organize the two-layer cache of spectrum embeddings
+
+    Embeddings are keyed by a hash of the preprocessed peaks (and the model input
+    metadata, if any). Lookups hit the in-memory layer first, then the on-disk
+    store of the model: a float32 array file read as memmap and an index file with
+    one key per row. Both files are append-only and written under a file lock; a
+    store whose files disagree (e.g. after an interrupted write) is dropped. If the
+    stores in the cache directory exceed 'max_size', the least recently written
+    stores are dropped first.
+
+    Attributes:
+        file_hash: the hash of the model file the embeddings were calculated with
+        dim: the dimension of the embeddings
+        cache_dir: the directory of the on-disk store or None for memory only
+        max_size: the max. size of the cache directory in bytes or None (no limit)
+        memory: the in-memory layer, key to embedding
+        disk_index: the keys of the on-disk store, key to row
+        disk_vectors: the memmap of the on-disk store
+    """
+
+    file_hash: str
+    dim: int
+    cache_dir: Optional[Path] = None
+    max_size: Optional[int] = None
+    memory: dict = {}
+    disk_index: Optional[dict] = None
+    disk_vectors: Optional[Any] = None
+
+    def path_vectors(self: Self) -> Path:
+        """Return the path to the embedding array file of the model"""
+        return self.cache_dir.joinpath(f"{self.file_hash}.vectors")
+
+    def path_index(self: Self) -> Path:
+        """Return the path to the index file of the model"""
+        return self.cache_dir.joinpath(f"{self.file_hash}.index")
+
+    def path_lock(self: Self) -> Path:
+        """Return the path to the lock file of the model"""
+        return self.cache_dir.joinpath(f"{self.file_hash}.lock")
+
+    @contextmanager
+    def lock_disk(self: Self, exclusive: bool) -> Iterator[None]:
+        """Hold a lock on the on-disk store of the model
+
+        Without fcntl (e.g. on Windows), the store is used unlocked.
+
+        Arguments:
+            exclusive: take a write lock instead of a shared read lock
+        """
+        try:
+            import fcntl
+        except ImportError:
+            yield
+            return
+
+        with open(self.path_lock(), "a") as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def read_disk(self: Self) -> Optional[list]:
+        """Read the keys of the on-disk store, checking them against the array
+
+        Returns:
+            The keys in row order or None if index and array file disagree
+        """
+        keys = []
+        if self.path_index().exists():
+            keys = self.path_index().read_text().split()
+        size = 0
+        if self.path_vectors().exists():
+            size = self.path_vectors().stat().st_size
+        if size != len(keys) * 4 * self.dim:
+            return None
+        return keys
+
+    def drop_disk(self: Self):
+        """Remove the array and index file of the model"""
+        self.path_vectors().unlink(missing_ok=True)
+        self.path_index().unlink(missing_ok=True)
+
+    def evict_disk(self: Self):
+        """Drop the oldest on-disk stores while the cache directory exceeds max_size
+
+        The stores of all models are ordered by the modification time of their
+        array file; the store written last is dropped last.
+        """
+        if self.cache_dir is None or self.max_size is None:
+            return
+
+        stores = []
+        for path in self.cache_dir.glob("*.vectors"):
+            try:
+                stat = path.stat()
+                size = stat.st_size + path.with_suffix(".index").stat().st_size
+            except FileNotFoundError:
+                continue
+            stores.append((stat.st_mtime_ns, path.stem, size))
+
+        total = sum(size for _, _, size in stores)
+        for _, file_hash, size in sorted(stores):
+            if total <= self.max_size:
+                break
+            store = EmbeddingCache(
+                file_hash=file_hash, dim=self.dim, cache_dir=self.cache_dir
+            )
+            with store.lock_disk(exclusive=True):
+                store.drop_disk()
+            total -= size
+            logger.info(
+                f"'EmbeddingCache': embedding cache exceeds '{self.max_size}' bytes, "
+                f"dropped on-disk store '{file_hash}'."
+            )
+
+    @staticmethod
+    def spectrum_key(spectrum: Any, metadata_keys: tuple = ()) -> str:
+        """Hash the peaks (and input metadata) of a spectrum
+
+        Arguments:
+            spectrum: a matchms Spectrum object
+            metadata_keys: the metadata used as additional model input
+
+        Returns:
+            The hex digest identifying the spectrum
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(np.ascontiguousarray(spectrum.peaks.mz, dtype=float).tobytes())
+        digest.update(
+            np.ascontiguousarray(spectrum.peaks.intensities, dtype=float).tobytes()
+        )
+        for key in metadata_keys:
+            digest.update(repr(spectrum.get(key)).encode())
+        return digest.hexdigest()
+
+    def load_disk(self: Self):
+        """Open the on-disk store of the model, falling back to memory only"""
+        self.disk_index = {}
+        self.disk_vectors = None
+        if self.cache_dir is None or not self.path_index().exists():
+            return
+
+        try:
+            with self.lock_disk(exclusive=False):
+                keys = self.read_disk()
+                if keys:
+                    self.disk_vectors = np.memmap(
+                        self.path_vectors(),
+                        dtype=np.float32,
+                        mode="r",
+                        shape=(len(keys), self.dim),
+                    )
+            if keys is None:
+                logger.warning(
+                    "'EmbeddingCache': index and array file of on-disk embedding "
+                    "store disagree, dropping store - SKIP"
+                )
+                with self.lock_disk(exclusive=True):
+                    if self.read_disk() is None:
+                        self.drop_disk()
+                return
+            self.disk_index = {key: row for row, key in enumerate(keys)}
+        except (OSError, ValueError) as e:
+            logger.warning(str(e))
+            logger.warning(
+                "'EmbeddingCache': could not read on-disk embedding store - SKIP"
+            )
+            self.cache_dir = None
+
+    def write_disk(self: Self, keys: list, vectors: np.ndarray):
+        """Append embeddings to the on-disk store of the model
+
+        Array and index file are appended under an exclusive lock. An inconsistent
+        store left behind by an interrupted write is dropped first, and the oldest
+        stores are dropped afterwards if the cache directory exceeds max_size.
+
+        Arguments:
+            keys: the keys of the new embeddings
+            vectors: the new embeddings
+        """
+        if self.cache_dir is None or len(keys) == 0:
+            return
+
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            with self.lock_disk(exclusive=True):
+                if self.read_disk() is None:
+                    self.drop_disk()
+                with open(self.path_vectors(), "ab") as outfile:
+                    outfile.write(
+                        np.ascontiguousarray(vectors, dtype=np.float32).tobytes()
+                    )
+                with open(self.path_index(), "a") as outfile:
+                    outfile.write("".join(f"{key}\n" for key in keys))
+            self.evict_disk()
+        except OSError as e:
+            logger.warning(str(e))
+            logger.warning(
+                "'EmbeddingCache': could not write on-disk embedding store - SKIP"
+            )
+            self.cache_dir = None
+        self.load_disk()
+
+    def get_vectors(
+        self: Self,
+        spectra: list,
+        embed: Callable[[list], np.ndarray],
+        metadata_keys: tuple = (),
+    ) -> np.ndarray:
+        """Return the embeddings of spectra, inferring only those not cached
+
+        Arguments:
+            spectra: a list of matchms Spectrum objects
+            embed: a function calculating the embeddings of a list of spectra
+            metadata_keys: the metadata used as additional model input
+
+        Returns:
+            An array of embeddings in the order of spectra
+        """
+        if self.disk_index is None:
+            self.load_disk()
+
+        keys = [self.spectrum_key(s, metadata_keys) for s in spectra]
+        for key in keys:
+            if key not in self.memory and key in self.disk_index:
+                self.memory[key] = np.array(
+                    self.disk_vectors[self.disk_index[key]], dtype=float
+                )
+
+        missing = {}
+        for spectrum, key in zip(spectra, keys):
+            if key not in self.memory:
+                missing.setdefault(key, spectrum)
+
+        logger.debug(
+            f"'EmbeddingCache': '{len(spectra) - len(missing)}' of '{len(spectra)}' "
+            f"embeddings found in cache"
+        )
+
+        if len(missing) != 0:
+            vectors = embed(list(missing.values()))
+            self.memory.update(zip(missing.keys(), vectors))
+            self.write_disk(list(missing.keys()), vectors)
+
+        vectors = np.empty((len(spectra), self.dim), dtype=float)
+        for row, key in enumerate(keys):
+            vectors[row] = self.memory[key]
+        return vectors
+
+
+class CachedMS2DeepScore(BaseSimilarity):
+    """MS2DeepScore similarity that embeds each spectrum at most once per model
+
+    Embeddings are inferred by keras via ms2deepscore ('keras') or by
+    NumpyMS2DeepScore ('numpy'); keras and tensorflow are only imported for the
+    'keras' backend. Both backends have separate embedding caches. Uncached
+    spectra are embedded in batches of 'batch_size' on at most 'nr_threads' CPU
+    threads, and the throughput of each inference is logged.
+
+    Attributes:
+        model: the object inferring embeddings ('keras': ms2deepscore MS2DeepScore)
+        backend: the inference backend ('keras', 'numpy')
+        batch_size: the number of spectra embedded per batch
+        nr_threads: the CPU threads used for inference, 0 for the library default
+        output_vector_dim: the dimension of the embeddings
+        metadata_keys: the metadata used as additional model input
+        cache: the EmbeddingCache of the model and backend
+    """
+
+    is_commutative = True
+    score_datatype = np.float64
+
+    def __init__(
+        self: Self,
+        model_path: Path,
+        backend: str = "keras",
+        batch_size: int = 1024,
+        nr_threads: int = 0,
+        persist: bool = True,
+        progress_bar: bool = False,
+    ):
+        """Load the model and attach its embedding cache
+
+        Arguments:
+            model_path: the path to the model file, hashed to identify the model
+            backend: the inference backend ('keras', 'numpy')
+            batch_size: the number of spectra embedded per batch
+            nr_threads: the CPU threads used for inference, 0 for the library default
+            persist: use the on-disk store in DefaultPaths().dirpath_embedding_cache,
+                limited to DefaultPaths().max_mb_embedding_cache
+            progress_bar: show a progress bar during keras spectrum binning
+        """
+        self.backend = backend
+        self.batch_size = batch_size
+        self.nr_threads = nr_threads
+
+        if backend == "numpy":
+            self.model = NumpyMS2DeepScore(batch_size=batch_size).load(model_path)
+            self.metadata_keys = self.model.metadata_keys
+        else:
+            from ms2deepscore import MS2DeepScore
+            from ms2deepscore.models import load_model
+
+            self.set_keras_threads(nr_threads)
+            model = load_model(model_path)
+            self.model = MS2DeepScore(model=model, progress_bar=progress_bar)
+            self.metadata_keys = tuple(
+                m if isinstance(m, str) else m[0]
+                for m in model.spectrum_binner.additional_metadata
+            )
+        self.output_vector_dim = self.model.output_vector_dim
+
+        stat = Path(model_path).stat()
+        file_hash = hash_file(str(model_path), stat.st_size, stat.st_mtime_ns)
+        default_paths = DefaultPaths()
+        self.cache = get_embedding_cache(
+            file_hash if backend == "keras" else f"{file_hash}-{backend}",
+            self.output_vector_dim,
+            default_paths.dirpath_embedding_cache if persist else None,
+            default_paths.max_mb_embedding_cache * 2**20,
+        )
+
+    @staticmethod
+    def set_keras_threads(nr_threads: int):
+        """Set the tensorflow thread pools, possible before its runtime starts
+
+        The intra-op pool runs the matrix products; the base network is a chain of
+        layers, so the inter-op pool is limited to a single thread.
+
+        Arguments:
+            nr_threads: the number of intra-op threads, 0 for the tensorflow default
+        """
+        if nr_threads == 0:
+            return
+
+        import tensorflow as tf
+
+        try:
+            tf.config.threading.set_intra_op_parallelism_threads(nr_threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+        except RuntimeError:
+            if tf.config.threading.get_intra_op_parallelism_threads() != nr_threads:
+                logger.warning(
+                    f"'CachedMS2DeepScore': tensorflow already started with "
+                    f"'{tf.config.threading.get_intra_op_parallelism_threads()}' "
+                    f"threads, could not set '{nr_threads}' threads - SKIP"
+                )
+
+    def limit_threads(self: Self) -> AbstractContextManager:
+        """Return a context limiting the BLAS threads of the 'numpy' backend
+
+        Uses threadpoolctl if installed; otherwise, the BLAS threads are set by
+        the OMP_NUM_THREADS/OPENBLAS_NUM_THREADS environment variables.
+
+        Returns:
+            A context manager to run the inference in
+        """
+        if self.backend != "numpy" or self.nr_threads == 0:
+            return nullcontext()
+
+        try:
+            from threadpoolctl import threadpool_limits
+        except ImportError:
+            logger.debug(
+                "'CachedMS2DeepScore': threadpoolctl not installed, could not limit "
+                "BLAS threads - SKIP"
+            )
+            return nullcontext()
+        return threadpool_limits(limits=self.nr_threads, user_api="blas")
+
+    def keras_vectors(self: Self, spectrum_list: list) -> np.ndarray:
+        """Calculate embeddings with keras, predicting a batch of spectra per call
+
+        Arguments:
+            spectrum_list: a list of matchms Spectrum objects
+
+        Returns:
+            An array of embeddings in the order of spectrum_list
+        """
+        binned_spectra = self.model.model.spectrum_binner.transform(
+            spectrum_list, progress_bar=self.model.progress_bar
+        )
+        vectors = np.empty((len(spectrum_list), self.output_vector_dim))
+        for first in range(0, len(binned_spectra), self.batch_size):
+            inputs = [
+                self.model._create_input_vector(binned)
+                for binned in binned_spectra[first : first + self.batch_size]
+            ]
+            if self.model.multi_inputs:
+                inputs = [np.concatenate(column) for column in zip(*inputs)]
+            else:
+                inputs = np.concatenate(inputs)
+            batch = self.model.model.base.predict_on_batch(inputs)
+            vectors[first : first + len(batch)] = batch
+        return vectors
+
+    def infer_vectors(self: Self, spectrum_list: list) -> np.ndarray:
+        """Calculate the embeddings of the spectra and log the throughput
+
+        Arguments:
+            spectrum_list: a list of matchms Spectrum objects
+
+        Returns:
+            An array of embeddings in the order of spectrum_list
+        """
+        start = time.perf_counter()
+        with self.limit_threads():
+            if self.backend == "numpy":
+                vectors = self.model.calculate_vectors(spectrum_list)
+            else:
+                vectors = self.keras_vectors(spectrum_list)
+        seconds = time.perf_counter() - start
+
+        logger.info(
+            f"'CachedMS2DeepScore': embedded '{len(spectrum_list)}' spectra in "
+            f"'{seconds:.2f}' s ('{len(spectrum_list) / max(seconds, 10**-9):.1f}' "
+            f"spectra/s, backend '{self.backend}', batch size '{self.batch_size}', "
+            f"threads '{self.nr_threads or 'default'}')"
+        )
+        return vectors
+
+    def calculate_vectors(self: Self, spectrum_list: list) -> np.ndarray:
+        """Return the embeddings of the spectra, inferring only uncached ones
+
+        Arguments:
+            spectrum_list: a list of matchms Spectrum objects
+
+        Returns:
+            An array of embeddings in the order of spectrum_list
+        """
+        return self.cache.get_vectors(
+            spectrum_list, self.infer_vectors, self.metadata_keys
+        )
+
+    @staticmethod
+    def cosine_matrix(vectors_1: np.ndarray, vectors_2: np.ndarray) -> np.ndarray:
+        """Calculate the cosine similarity between two arrays of embeddings
+
+        Arguments:
+            vectors_1: an array of embeddings
+            vectors_2: an array of embeddings
+
+        Returns:
+            The cosine similarity matrix
+        """
+        vectors_1 = vectors_1 / np.linalg.norm(vectors_1, axis=1, keepdims=True)
+        vectors_2 = vectors_2 / np.linalg.norm(vectors_2, axis=1, keepdims=True)
+        return vectors_1 @ vectors_2.T
+
+    def pair(self: Self, reference: Any, query: Any) -> float:
+        """Calculate the MS2DeepScore similarity of two spectra
+
+        Arguments:
+            reference: a matchms Spectrum object
+            query: a matchms Spectrum object
+
+        Returns:
+            The MS2DeepScore similarity
+        """
+        vectors = self.calculate_vectors([reference, query])
+        return float(self.cosine_matrix(vectors[:1], vectors[1:])[0, 0])
+
+    def matrix(
+        self: Self,
+        references: list,
+        queries: list,
+        array_type: str = "numpy",
+        is_symmetric: bool = False,
+    ) -> np.ndarray:
+        """Calculate the MS2DeepScore similarities between references and queries
+
+        Arguments:
+            references: a list of matchms Spectrum objects
+            queries: a list of matchms Spectrum objects
+            array_type: only 'numpy' is supported, as by ms2deepscore
+            is_symmetric: references and queries are identical
+
+        Returns:
+            An array of MS2DeepScore similarities
+        """
+        reference_vectors = self.calculate_vectors(references)
+        if is_symmetric:
+            query_vectors = reference_vectors
+        else:
+            query_vectors = self.calculate_vectors(queries)
+        return self.cosine_matrix(reference_vectors, query_vectors)
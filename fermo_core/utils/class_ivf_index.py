@@ -0,0 +1,281 @@
+"""Inverted file index for approximate nearest-neighbour search of embeddings.
+
+Copyright (c) 2022 to present Mitja Maximilian Zdouc, PhD
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import logging
+import time
+from pathlib import Path
+from typing import Any, Optional, Self
+
+import numpy as np
+from pydantic import BaseModel
+from scipy import sparse
+
+logger = logging.getLogger("fermo_core")
+
+
+class IvfIndex(BaseModel):
+    """Pydantic-based class to organize an inverted file index of unit vectors
+
+    The vectors are partitioned by spherical k-means into lists around centroids.
+    A search compares the queries to the centroids, scores only the vectors in the
+    'nr_probe' closest lists and keeps the 'k' best per query.
+
+    Attributes:
+        key: identifies the model and library the index was built for
+        centroids: the unit-length centroid of each list
+        offsets: the start of each list in members
+        members: the vector rows, sorted by list
+    """
+
+    key: str
+    centroids: Optional[Any] = None
+    offsets: Optional[Any] = None
+    members: Optional[Any] = None
+
+    @staticmethod
+    def list_sums(
+        vectors: np.ndarray, assignment: np.ndarray, nr_lists: int
+    ) -> np.ndarray:
+        """Sum the vectors per list as a sparse one-hot product
+
+        Arguments:
+            vectors: the vectors to sum
+            assignment: the list of each vector
+            nr_lists: the number of lists, including empty ones
+
+        Returns:
+            An array with the sum of the vectors of each list, zero if empty
+        """
+        one_hot = sparse.csr_matrix(
+            (
+                np.ones(len(vectors), dtype=vectors.dtype),
+                (assignment, np.arange(len(vectors))),
+            ),
+            shape=(nr_lists, len(vectors)),
+        )
+        return np.asarray(one_hot @ vectors)
+
+    def build(
+        self: Self,
+        vectors: np.ndarray,
+        nr_lists: Optional[int] = None,
+        nr_iter: int = 10,
+        seed: int = 0,
+    ) -> Self:
+        """Partition the vectors into lists by spherical k-means
+
+        Arguments:
+            vectors: the unit-length vectors to index
+            nr_lists: the number of lists, by default the square root of the vectors
+            nr_iter: the number of k-means iterations
+            seed: the seed of the centroid initialization
+
+        Returns:
+            The IvfIndex instance
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if nr_lists is None:
+            nr_lists = int(np.sqrt(len(vectors)))
+        nr_lists = min(max(nr_lists, 1), len(vectors))
+
+        rng = np.random.default_rng(seed)
+        centroids = vectors[rng.choice(len(vectors), nr_lists, replace=False)]
+        for _ in range(nr_iter):
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            counts = np.bincount(assignment, minlength=nr_lists)
+            sums = self.list_sums(vectors, assignment, nr_lists)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = np.where(
+                (counts[:, None] > 0) & (norms > 0),
+                sums / np.maximum(norms, 10**-12),
+                centroids,
+            )
+
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        self.centroids = centroids
+        self.members = np.argsort(assignment, kind="stable")
+        self.offsets = np.concatenate(
+            ([0], np.cumsum(np.bincount(assignment, minlength=nr_lists)))
+        )
+        return self
+
+    def search(
+        self: Self,
+        vectors: np.ndarray,
+        queries: np.ndarray,
+        k: int,
+        nr_probe: int,
+        batch_size: int = 1024,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Find the approximate k nearest vectors of each query by dot product
+
+        Queries are processed in batches; within a batch, each probed list is
+        scored as one matrix product against the queries probing it.
+
+        Arguments:
+            vectors: the indexed unit-length vectors
+            queries: the unit-length query vectors
+            k: the number of neighbours per query
+            nr_probe: the number of lists scored per query
+            batch_size: the number of queries per batch
+
+        Returns:
+            A tuple of query indices and vector rows of the neighbours
+        """
+        nr_probe = min(nr_probe, len(self.centroids))
+        found_query, found_rows = [], []
+
+        for first in range(0, len(queries), batch_size):
+            batch = np.asarray(queries[first : first + batch_size])
+            closeness = batch.astype(np.float32) @ self.centroids.T
+            probe = np.argpartition(-closeness, nr_probe - 1, axis=1)[:, :nr_probe]
+
+            probe_lists = probe.ravel()
+            probe_queries = np.repeat(np.arange(len(batch)), nr_probe)
+            order = np.argsort(probe_lists, kind="stable")
+            probe_lists, probe_queries = probe_lists[order], probe_queries[order]
+            bounds = np.flatnonzero(np.diff(probe_lists)) + 1
+
+            query_idx, rows, scores = [], [], []
+            for group in np.split(np.arange(len(probe_lists)), bounds):
+                if len(group) == 0:
+                    continue
+                list_id = probe_lists[group[0]]
+                members = self.members[
+                    self.offsets[list_id] : self.offsets[list_id + 1]
+                ]
+                if len(members) == 0:
+                    continue
+                q_group = probe_queries[group]
+                query_idx.append(np.repeat(q_group, len(members)))
+                rows.append(np.tile(members, len(q_group)))
+                scores.append((batch[q_group] @ vectors[members].T).ravel())
+
+            if len(query_idx) == 0:
+                continue
+            query_idx = np.concatenate(query_idx)
+            rows = np.concatenate(rows)
+            scores = np.concatenate(scores)
+
+            order = np.lexsort((-scores, query_idx))
+            query_idx, rows = query_idx[order], rows[order]
+            starts = np.searchsorted(query_idx, query_idx, side="left")
+            keep = np.arange(len(query_idx)) - starts < k
+            found_query.append(query_idx[keep] + first)
+            found_rows.append(rows[keep])
+
+        if len(found_query) == 0:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+        return np.concatenate(found_query), np.concatenate(found_rows)
+
+    def save(self: Self, path: Path):
+        """Write the index to a npz file, replacing the previous one; skip on failure
+
+        Arguments:
+            path: the path of the npz file
+        """
+        temp = path.with_name(f".{path.name}.tmp.npz")
+        try:
+            np.savez(
+                temp,
+                key=np.array(self.key),
+                centroids=self.centroids,
+                offsets=self.offsets,
+                members=self.members,
+            )
+            temp.replace(path)
+        except OSError as e:
+            logger.warning(str(e))
+            logger.warning(f"'IvfIndex': could not write '{path.name}' - SKIP")
+            temp.unlink(missing_ok=True)
+
+    def load(self: Self, path: Path) -> Self:
+        """Read the index from a npz file if it was built for the same key
+
+        Arguments:
+            path: the path of the npz file
+
+        Returns:
+            The IvfIndex instance, with centroids None if nothing was loaded
+        """
+        if not path.exists():
+            return self
+
+        try:
+            with np.load(path) as data:
+                if str(data["key"]) == self.key:
+                    self.centroids = data["centroids"]
+                    self.offsets = data["offsets"]
+                    self.members = data["members"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(str(e))
+            logger.warning(f"'IvfIndex': could not read '{path.name}' - SKIP")
+        return self
+
+    def benchmark(
+        self: Self, vectors: np.ndarray, queries: np.ndarray, k: int, nr_probes: list
+    ) -> list[dict]:
+        """Compare recall and search time against exact search
+
+        Arguments:
+            vectors: the indexed unit-length vectors
+            queries: the unit-length query vectors
+            k: the number of neighbours per query
+            nr_probes: the numbers of lists scored per query to compare
+
+        Returns:
+            A list of dicts with nr_probe, recall and seconds, exact search first
+        """
+        k = min(k, len(vectors))
+        start = time.perf_counter()
+        exact = np.concatenate(
+            [
+                np.argpartition(-(queries[i : i + 256] @ vectors.T), k - 1, axis=1)[
+                    :, :k
+                ]
+                for i in range(0, len(queries), 256)
+            ]
+        )
+        results = [
+            {"nr_probe": 0, "recall": 1.0, "seconds": time.perf_counter() - start}
+        ]
+        exact = set(zip(np.repeat(np.arange(len(queries)), k), exact.ravel()))
+
+        for nr_probe in nr_probes:
+            start = time.perf_counter()
+            query_idx, rows = self.search(vectors, queries, k, nr_probe)
+            seconds = time.perf_counter() - start
+            found = len(exact.intersection(zip(query_idx, rows)))
+            results.append(
+                {
+                    "nr_probe": nr_probe,
+                    "recall": found / len(exact),
+                    "seconds": seconds,
+                }
+            )
+            logger.info(
+                f"'IvfIndex': nr_probe '{nr_probe}': recall "
+                f"'{results[-1]['recall']:.3f}' in '{seconds:.3f}' s "
+                f"(exact '{results[0]['seconds']:.3f}' s)"
+            )
+        return results
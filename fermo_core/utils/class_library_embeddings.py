@@ -0,0 +1,263 @@
+"""Precomputed MS2DeepScore embeddings stored next to a spectral library.
+
+Copyright (c) 2022 to present Mitja Maximilian Zdouc, PhD
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import hashlib
+import logging
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any, Optional, Self
+from urllib.parse import urlparse
+
+import numpy as np
+from pydantic import BaseModel
+
+from fermo_core.config.class_default_settings import DefaultPaths
+from fermo_core.utils.class_embedding_cache import CachedMS2DeepScore, EmbeddingCache
+from fermo_core.utils.class_ivf_index import IvfIndex
+from fermo_core.utils.utility_method_manager import UtilityMethodManager
+
+logger = logging.getLogger("fermo_core")
+
+
+class LibraryEmbeddings(BaseModel):
+    """Pydantic-based class to organize the stored embeddings of a spectral library
+
+    The embeddings are saved as a single npz file next to the library: inside a
+    library directory or beside a library file. The file holds the hash of the
+    model, the spectrum keys and the raw float32 embedding matrix. Embeddings of a
+    different model are discarded; spectra not yet stored are embedded and added.
+
+    Attributes:
+        location: the library directory or file
+        file_hash: the hash of the model file
+        keys: the spectrum keys, key to row
+        vectors: the embedding matrix
+    """
+
+    location: Path
+    file_hash: str
+    keys: dict = {}
+    vectors: Optional[Any] = None
+
+    def filepath(self: Self) -> Path:
+        """Return the path of the npz file next to the library"""
+        if self.location.is_dir():
+            return self.location.joinpath("ms2deepscore_embeddings.npz")
+        else:
+            return self.location.with_name(f"{self.location.name}.ms2deepscore.npz")
+
+    def filepath_index(self: Self) -> Path:
+        """Return the path of the npz file of the IVF index next to the library"""
+        if self.location.is_dir():
+            return self.location.joinpath("ms2deepscore_ivf.npz")
+        else:
+            return self.location.with_name(f"{self.location.name}.ms2deepscore_ivf.npz")
+
+    def load(self: Self) -> Self:
+        """Load the stored embeddings if calculated with the same model
+
+        Returns:
+            The LibraryEmbeddings instance
+        """
+        self.keys = {}
+        self.vectors = None
+        if not self.filepath().exists():
+            return self
+
+        try:
+            with np.load(self.filepath()) as data:
+                if str(data["file_hash"]) != self.file_hash:
+                    logger.debug(
+                        f"'LibraryEmbeddings': embeddings in "
+                        f"'{self.filepath().name}' were calculated with another "
+                        f"model - SKIP"
+                    )
+                    return self
+                self.vectors = data["vectors"]
+                self.keys = {str(key): row for row, key in enumerate(data["keys"])}
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(str(e))
+            logger.warning(
+                f"'LibraryEmbeddings': could not read '{self.filepath().name}' - SKIP"
+            )
+        return self
+
+    def save(self: Self):
+        """Write the embeddings next to the library, replacing the previous file"""
+        temp = self.filepath().with_name(f".{self.filepath().name}.tmp.npz")
+        try:
+            np.savez(
+                temp,
+                file_hash=np.array(self.file_hash),
+                keys=np.array(list(self.keys), dtype=str),
+                vectors=self.vectors,
+            )
+            temp.replace(self.filepath())
+        except OSError as e:
+            logger.warning(str(e))
+            logger.warning(
+                f"'LibraryEmbeddings': could not write '{self.filepath().name}' - "
+                f"SKIP"
+            )
+            temp.unlink(missing_ok=True)
+
+    def get_vectors(
+        self: Self,
+        spectra: list,
+        embed: Callable[[list], np.ndarray],
+        metadata_keys: tuple = (),
+    ) -> np.ndarray:
+        """Return the embeddings of library spectra, storing those not yet stored
+
+        Arguments:
+            spectra: a list of matchms Spectrum objects of the library
+            embed: a function calculating the embeddings of a list of spectra
+            metadata_keys: the metadata used as additional model input
+
+        Returns:
+            An array of embeddings in the order of spectra
+        """
+        keys = [EmbeddingCache.spectrum_key(s, metadata_keys) for s in spectra]
+
+        missing = {}
+        for spectrum, key in zip(spectra, keys):
+            if key not in self.keys:
+                missing.setdefault(key, spectrum)
+
+        if len(missing) != 0:
+            logger.info(
+                f"'LibraryEmbeddings': storing embeddings of '{len(missing)}' "
+                f"library spectra in '{self.filepath().name}'"
+            )
+            new_vectors = np.asarray(embed(list(missing.values())), dtype=np.float32)
+            if self.vectors is None:
+                self.vectors = new_vectors
+            else:
+                self.vectors = np.concatenate((self.vectors, new_vectors))
+            for key in missing:
+                self.keys[key] = len(self.keys)
+            self.save()
+
+        return np.asarray(
+            self.vectors[[self.keys[key] for key in keys]], dtype=float
+        ).reshape(len(spectra), -1)
+
+    def ivf_index(
+        self: Self, spectra: list, vectors: np.ndarray, metadata_keys: tuple = ()
+    ) -> IvfIndex:
+        """Return the IVF index of the library, built once and stored next to it
+
+        The index is rebuilt if the model or the library spectra changed.
+
+        Arguments:
+            spectra: a list of matchms Spectrum objects of the library
+            vectors: the unit-length embeddings in the order of spectra
+            metadata_keys: the metadata used as additional model input
+
+        Returns:
+            The IvfIndex of the library
+        """
+        digest = hashlib.blake2b(self.file_hash.encode(), digest_size=16)
+        for spectrum in spectra:
+            digest.update(EmbeddingCache.spectrum_key(spectrum, metadata_keys).encode())
+
+        index = IvfIndex(key=digest.hexdigest()).load(self.filepath_index())
+        if index.centroids is None:
+            logger.info(
+                f"'LibraryEmbeddings': building IVF index of '{len(spectra)}' "
+                f"library spectra in '{self.filepath_index().name}'"
+            )
+            index.build(vectors)
+            index.save(self.filepath_index())
+        return index
+
+    def precompute(self: Self, spectra: list, sim_algorithm: Any) -> Self:
+        """Embed and store all spectra of a library
+
+        Arguments:
+            spectra: a list of matchms Spectrum objects of the library
+            sim_algorithm: a CachedMS2DeepScore object holding the model
+
+        Returns:
+            The LibraryEmbeddings instance
+        """
+        self.load()
+        self.get_vectors(
+            spectra, sim_algorithm.calculate_vectors, sim_algorithm.metadata_keys
+        )
+        return self
+
+
+def precompute_library_embeddings(
+    location: Path,
+    spectra: list,
+    backend: str = "keras",
+    batch_size: int = 1024,
+    nr_threads: int = 0,
+) -> LibraryEmbeddings:
+    """Embed a spectral library with the default model and store it next to it
+
+    Arguments:
+        location: the library directory or file
+        spectra: a list of matchms Spectrum objects of the library
+        backend: the MS2DeepScore inference backend ('keras', 'numpy')
+        batch_size: the number of spectra embedded per inference batch
+        nr_threads: the CPU threads used for inference, 0 for the library default
+
+    Returns:
+        The LibraryEmbeddings instance holding the stored embeddings
+    """
+    UtilityMethodManager().check_ms2deepscore_req("positive")
+    file = urlparse(DefaultPaths().url_ms2deepscore_pos).path.split("/")[-1]
+    model_path = DefaultPaths().dirpath_ms2deepscore_pos.joinpath(file)
+    sim_algorithm = CachedMS2DeepScore(
+        model_path=model_path,
+        backend=backend,
+        batch_size=batch_size,
+        nr_threads=nr_threads,
+    )
+    return LibraryEmbeddings(
+        location=location, file_hash=sim_algorithm.cache.file_hash
+    ).precompute(spectra, sim_algorithm)
+
+
+def precompute_mibig_embeddings(
+    backend: str = "keras", batch_size: int = 1024, nr_threads: int = 0
+) -> LibraryEmbeddings:
+    """Embed the complete MIBiG spectral library and store it next to it
+
+    Arguments:
+        backend: the MS2DeepScore inference backend ('keras', 'numpy')
+        batch_size: the number of spectra embedded per inference batch
+        nr_threads: the CPU threads used for inference, 0 for the library default
+
+    Returns:
+        The LibraryEmbeddings instance holding the stored embeddings
+    """
+    return precompute_library_embeddings(
+        DefaultPaths().library_mibig_pos,
+        UtilityMethodManager().load_mibig_spec_lib(),
+        backend,
+        batch_size,
+        nr_threads,
+    )
@@ -0,0 +1,268 @@
+"""MS2DeepScore embedding inference in NumPy, without keras and tensorflow.
+
+Copyright (c) 2022 to present Mitja Maximilian Zdouc, PhD
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+import json
+from pathlib import Path
+from typing import Any, Optional, Self
+
+import h5py
+import numpy as np
+from pydantic import BaseModel
+
+
+class NumpyMS2DeepScore(BaseModel):
+    """Pydantic-based class to organize MS2DeepScore embedding inference in NumPy
+
+    Reads the spectrum binner and the weights of the base network from the
+    ms2deepscore HDF5 model file. Spectra are binned as by the ms2deepscore
+    SpectrumBinner and embedded in batches by the forward pass of the dense,
+    batch normalization and (inactive) dropout layers in float32.
+
+    Attributes:
+        d_bins: the bin width
+        mz_min: the lower bound of binned m/z values
+        mz_max: the upper bound of binned m/z values
+        peak_scaling: the power applied to peak intensities
+        allowed_missing_percentage: max weighted percentage of unknown peaks
+        bin_ids: the sorted known bin numbers
+        bin_positions: the input vector position of each known bin
+        input_dim: the dimension of the input vectors
+        output_vector_dim: the dimension of the embeddings
+        layers: a list of tuples (layer type, dict of arrays) of the base network
+        batch_size: the number of spectra embedded per batch
+        metadata_keys: the metadata used as additional model input
+    """
+
+    d_bins: float = 1.0
+    mz_min: float = 10.0
+    mz_max: float = 1000.0
+    peak_scaling: float = 0.5
+    allowed_missing_percentage: float = 0.0
+    bin_ids: Optional[Any] = None
+    bin_positions: Optional[Any] = None
+    input_dim: int = 0
+    output_vector_dim: int = 0
+    layers: list = []
+    batch_size: int = 1024
+    metadata_keys: tuple = ()
+
+    def load(self: Self, model_path: Path) -> Self:
+        """Read the spectrum binner and the base network from the model file
+
+        Arguments:
+            model_path: the path to the ms2deepscore HDF5 model file
+
+        Returns:
+            The NumpyMS2DeepScore instance
+
+        Raises:
+            RuntimeError: model uses additional inputs or unsupported layers
+        """
+        with h5py.File(model_path, mode="r") as infile:
+            binner = json.loads(infile.attrs["spectrum_binner"])
+            config = json.loads(infile.attrs["model_config"])
+            weights = infile["model_weights"]["base"]
+
+            if binner.get("additional_metadata"):
+                raise RuntimeError(
+                    "'NumpyMS2DeepScore': models with additional metadata inputs are "
+                    "not supported - use the 'keras' backend."
+                )
+
+            self.mz_min = binner["mz_min"]
+            self.mz_max = binner["mz_max"]
+            self.d_bins = (self.mz_max - self.mz_min) / binner["number_of_bins"]
+            self.peak_scaling = binner["peak_scaling"]
+            self.allowed_missing_percentage = binner["allowed_missing_percentage"]
+            bins = sorted((int(k), v) for k, v in binner["peak_to_position"].items())
+            self.bin_ids = np.array([b[0] for b in bins], dtype=int)
+            self.bin_positions = np.array([b[1] for b in bins], dtype=int)
+            self.input_dim = len(binner["known_bins"])
+
+            base = next(
+                layer
+                for layer in config["config"]["layers"]
+                if layer["config"].get("name") == "base"
+            )
+            self.layers = []
+            for layer in base["config"]["layers"]:
+                self.layers.extend(self.read_layer(layer, weights))
+
+        self.output_vector_dim = next(
+            params["kernel"].shape[1]
+            for kind, params in reversed(self.layers)
+            if kind == "dense"
+        )
+        return self
+
+    @staticmethod
+    def read_layer(layer: dict, weights: Any) -> list:
+        """Read the weights of a keras layer of the base network
+
+        Arguments:
+            layer: the keras config of the layer
+            weights: the HDF5 group holding the base network weights
+
+        Returns:
+            A list with a tuple (layer type, dict of arrays), empty for no-op layers
+
+        Raises:
+            RuntimeError: unsupported layer type or activation
+        """
+        name = layer["config"]["name"]
+
+        def read(var: str) -> np.ndarray:
+            return np.asarray(weights[f"{name}/{var}:0"], dtype=np.float32)
+
+        match layer["class_name"]:
+            case "InputLayer" | "Dropout":
+                return []
+            case "Dense":
+                if layer["config"]["activation"] not in ("relu", "linear"):
+                    raise RuntimeError(
+                        f"'NumpyMS2DeepScore': unsupported activation "
+                        f"'{layer['config']['activation']}' - use the 'keras' backend."
+                    )
+                units = layer["config"]["units"]
+                return [
+                    (
+                        "dense",
+                        {
+                            "kernel": read("kernel"),
+                            "bias": (
+                                read("bias")
+                                if layer["config"].get("use_bias", True)
+                                else np.zeros(units, dtype=np.float32)
+                            ),
+                            "relu": layer["config"]["activation"] == "relu",
+                        },
+                    )
+                ]
+            case "BatchNormalization":
+                variance = read("moving_variance")
+                scale = 1 / np.sqrt(variance + np.float32(layer["config"]["epsilon"]))
+                if layer["config"].get("scale", True):
+                    scale = scale * read("gamma")
+                shift = -read("moving_mean") * scale
+                if layer["config"].get("center", True):
+                    shift = shift + read("beta")
+                return [("batchnorm", {"scale": scale, "shift": shift})]
+            case _:
+                raise RuntimeError(
+                    f"'NumpyMS2DeepScore': unsupported layer type "
+                    f"'{layer['class_name']}' - use the 'keras' backend."
+                )
+
+    def bin_spectra(self: Self, spectra: list) -> np.ndarray:
+        """Convert spectra to model input vectors as the ms2deepscore SpectrumBinner
+
+        Peak weights are intensity ** peak_scaling. As in ms2deepscore, the weight
+        of the i-th peak inside the m/z range is taken from the i-th peak of the
+        spectrum, and a bin holding several peaks keeps the highest weight.
+
+        Arguments:
+            spectra: a list of matchms Spectrum objects
+
+        Returns:
+            An array of input vectors
+
+        Raises:
+            RuntimeError: a spectrum has no peaks in range or too many unknown peaks
+        """
+        counts = np.array([len(s.peaks.mz) for s in spectra], dtype=int)
+        owner = np.repeat(np.arange(len(spectra)), counts)
+        mz = np.concatenate([s.peaks.mz for s in spectra])
+        weights = np.concatenate([s.peaks.intensities for s in spectra]) ** (
+            self.peak_scaling
+        )
+
+        selected = np.flatnonzero((mz >= self.mz_min) & (mz <= self.mz_max))
+        sel_owner = owner[selected]
+        nr_selected = np.bincount(sel_owner, minlength=len(spectra))
+        if np.any(nr_selected == 0):
+            raise RuntimeError(
+                "'NumpyMS2DeepScore': found no peaks between mz_min and mz_max."
+            )
+
+        rank = (
+            np.arange(len(selected)) - (np.cumsum(nr_selected) - nr_selected)[sel_owner]
+        )
+        sel_weights = weights[(np.cumsum(counts) - counts)[sel_owner] + rank]
+        bins = (mz[selected] / self.d_bins - int(self.mz_min / self.d_bins)).astype(int)
+
+        pos = np.minimum(np.searchsorted(self.bin_ids, bins), len(self.bin_ids) - 1)
+        known = self.bin_ids[pos] == bins
+
+        missing = np.bincount(
+            sel_owner[~known], weights=sel_weights[~known], minlength=len(spectra)
+        ) / np.bincount(owner, weights=weights, minlength=len(spectra))
+        missing[np.bincount(sel_owner[known], minlength=len(spectra)) == 0] = 1.0
+        if np.any(100 * missing > self.allowed_missing_percentage):
+            raise RuntimeError(
+                f"'NumpyMS2DeepScore': {100 * missing.max():.2f} of weighted "
+                f"spectrum is unknown to the model."
+            )
+
+        vectors = np.zeros((len(spectra), self.input_dim), dtype=np.float32)
+        np.maximum.at(
+            vectors,
+            (sel_owner[known], self.bin_positions[pos[known]]),
+            sel_weights[known].astype(np.float32),
+        )
+        return vectors
+
+    def forward(self: Self, vectors: np.ndarray) -> np.ndarray:
+        """Run the forward pass of the base network
+
+        Arguments:
+            vectors: an array of model input vectors
+
+        Returns:
+            An array of embeddings
+        """
+        for kind, params in self.layers:
+            if kind == "dense":
+                vectors = vectors @ params["kernel"]
+                vectors += params["bias"]
+                if params["relu"]:
+                    np.maximum(vectors, 0, out=vectors)
+            else:
+                vectors = vectors * params["scale"] + params["shift"]
+        return vectors
+
+    def calculate_vectors(self: Self, spectrum_list: list) -> np.ndarray:
+        """Return the embeddings of the spectra, calculated in batches
+
+        Arguments:
+            spectrum_list: a list of matchms Spectrum objects
+
+        Returns:
+            An array of embeddings in the order of spectrum_list
+        """
+        embeddings = np.empty((len(spectrum_list), self.output_vector_dim))
+        for first in range(0, len(spectrum_list), self.batch_size):
+            batch = spectrum_list[first : first + self.batch_size]
+            embeddings[first : first + len(batch)] = self.forward(
+                self.bin_spectra(batch)
+            )
+        return embeddings
@@ -0,0 +1,96 @@
+"""Sparse storage of thresholded pairwise similarity scores.
+
+Copyright (c) 2022 to present Mitja Maximilian Zdouc, PhD
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from typing import Any, Optional, Self
+
+import numpy as np
+from pydantic import BaseModel
+
+
+class SparseScores(BaseModel):
+    """Pydantic-based class to organize thresholded all-vs-all similarity scores
+
+    Only pairs reaching 'score_cutoff' are kept, once each as upper triangle
+    coordinates (row < col) with float32 scores; memory scales with the number of
+    retained pairs. The scoring loop appends pairs block-wise; 'finalize' joins
+    the blocks and drops repeated pairs.
+
+    Attributes:
+        ids: the identifier ('id' metadata) of each spectrum, by index
+        score_cutoff: the minimum score of a retained pair
+        rows: the row index of each retained pair
+        cols: the column index of each retained pair
+        scores: the score of each retained pair
+        blocks: the appended blocks not yet joined
+    """
+
+    ids: list
+    score_cutoff: float
+    rows: Optional[Any] = None
+    cols: Optional[Any] = None
+    scores: Optional[Any] = None
+    blocks: list = []
+
+    def append(self: Self, rows: np.ndarray, cols: np.ndarray, scores: np.ndarray):
+        """Add the pairs of a block that reach the cutoff, as upper triangle pairs
+
+        Arguments:
+            rows: the row indices of the scored pairs
+            cols: the column indices of the scored pairs
+            scores: the scores of the pairs
+        """
+        keep = (rows != cols) & (scores >= self.score_cutoff)
+        self.blocks.append(
+            (
+                np.minimum(rows[keep], cols[keep]).astype(np.int32),
+                np.maximum(rows[keep], cols[keep]).astype(np.int32),
+                scores[keep].astype(np.float32),
+            )
+        )
+
+    def finalize(self: Self) -> Self:
+        """Join the appended blocks into the coordinate arrays, each pair once
+
+        Returns:
+            The SparseScores instance
+        """
+        blocks = self.blocks
+        if self.rows is not None:
+            blocks = [(self.rows, self.cols, self.scores), *blocks]
+        self.rows = np.concatenate([b[0] for b in blocks] or [np.zeros(0, np.int32)])
+        self.cols = np.concatenate([b[1] for b in blocks] or [np.zeros(0, np.int32)])
+        self.scores = np.concatenate(
+            [b[2] for b in blocks] or [np.zeros(0, np.float32)]
+        )
+        self.blocks = []
+
+        _, first = np.unique(
+            self.rows.astype(np.int64) * len(self.ids) + self.cols, return_index=True
+        )
+        if len(first) != len(self.rows):
+            self.rows, self.cols, self.scores = (
+                self.rows[first],
+                self.cols[first],
+                self.scores[first],
+            )
+        return self
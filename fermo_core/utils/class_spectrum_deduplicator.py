@@ -0,0 +1,227 @@
+"""Collapse identical and near-identical MS/MS spectra into representatives.
+
+Copyright (c) 2022 to present Mitja Maximilian Zdouc, PhD
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from typing import Self
+
+import numpy as np
+from pydantic import BaseModel
+from scipy import sparse
+
+from fermo_core.utils.class_embedding_cache import EmbeddingCache
+from fermo_core.utils.class_sparse_scores import SparseScores
+
+
+class SpectrumDeduplicator(BaseModel):
+    """Pydantic-based class to organize the deduplication of spectra before scoring
+
+    Spectra with identical peaks (and metadata values, if given) share a hash and
+    are represented by the first of them. With 'min_cosine' below 1.0, near-
+    duplicates are joined too: in order, each representative not yet assigned
+    takes over the unassigned ones whose cosine of binned peaks reaches
+    'min_cosine' and whose metadata values match (numeric ones within
+    'fragment_tol'). Only representatives are scored; the scores are fanned back
+    out to all members.
+
+    Attributes:
+        min_cosine: the minimum cosine of near-duplicates, 1.0 for identical only
+        fragment_tol: the bin width of near-duplicate detection, in m/z units
+    """
+
+    min_cosine: float = 1.0
+    fragment_tol: float = 0.1
+
+    def group(self: Self, spectra: list, metadata_keys: tuple = ()) -> np.ndarray:
+        """Assign each spectrum to a representative
+
+        Arguments:
+            spectra: a list of matchms Spectrum objects
+            metadata_keys: the metadata that must be identical too
+
+        Returns:
+            An array with the index of the representative of each spectrum
+        """
+        first = {}
+        rep = np.array(
+            [
+                first.setdefault(EmbeddingCache.spectrum_key(s, metadata_keys), i)
+                for i, s in enumerate(spectra)
+            ],
+            dtype=int,
+        ).reshape(-1)
+
+        if self.min_cosine < 1.0 and len(first) > 1:
+            uniq = np.unique(rep)
+            leader = self.near_duplicates([spectra[i] for i in uniq], metadata_keys)
+            rep = uniq[leader][np.searchsorted(uniq, rep)]
+        return rep
+
+    def unique_pairs(
+        self: Self,
+        queries: list,
+        ref_idx: np.ndarray,
+        query_idx: np.ndarray,
+        metadata_keys: tuple = (),
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Map library-query pairs to pairs of representative queries, each once
+
+        Arguments:
+            queries: a list of matchms Spectrum objects of the queries
+            ref_idx: the library indices of the pairs
+            query_idx: the query indices of the pairs
+            metadata_keys: the metadata that must be identical too
+
+        Returns:
+            A tuple of the library and representative query indices of the unique
+            pairs, and the unique pair of each pair
+        """
+        rep = self.group(queries, metadata_keys)[query_idx]
+        _, first, inverse = np.unique(
+            ref_idx.astype(np.int64) * len(queries) + rep,
+            return_index=True,
+            return_inverse=True,
+        )
+        return ref_idx[first], rep[first], inverse.reshape(-1)
+
+    def binned_vectors(self: Self, spectra: list) -> sparse.csr_matrix:
+        """Bin the peaks of spectra into unit-length sparse vectors
+
+        Arguments:
+            spectra: a list of matchms Spectrum objects
+
+        Returns:
+            A csr matrix with a row per spectrum
+        """
+        counts = np.array([len(s.peaks.mz) for s in spectra], dtype=int)
+        bins = np.floor(
+            np.concatenate([s.peaks.mz for s in spectra]) / self.fragment_tol
+        ).astype(np.int64)
+        _, columns = np.unique(bins, return_inverse=True)
+        vectors = sparse.csr_matrix(
+            (
+                np.concatenate([s.peaks.intensities for s in spectra]),
+                (np.repeat(np.arange(len(spectra)), counts), columns.reshape(-1)),
+            ),
+            shape=(len(spectra), columns.max() + 1),
+        )
+        norm = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).reshape(-1))
+        return sparse.diags(1 / np.where(norm == 0, 1, norm)) @ vectors
+
+    @staticmethod
+    def metadata_values(spectra: list, key: str) -> np.ndarray:
+        """Collect a metadata value of spectra, as floats if all are numeric
+
+        Arguments:
+            spectra: a list of matchms Spectrum objects
+            key: the metadata key
+
+        Returns:
+            A float array (missing values NaN) or an object array of the reprs
+        """
+        values = [s.get(key) for s in spectra]
+        try:
+            return np.array(
+                [np.nan if value is None else value for value in values], dtype=float
+            )
+        except (TypeError, ValueError):
+            return np.array([repr(value) for value in values], dtype=object)
+
+    def near_duplicates(
+        self: Self, spectra: list, metadata_keys: tuple = ()
+    ) -> np.ndarray:
+        """Assign each spectrum to the first spectrum it is a near-duplicate of
+
+        Arguments:
+            spectra: a list of matchms Spectrum objects with distinct peaks
+            metadata_keys: the metadata that must match too, numeric values within
+                'fragment_tol'
+
+        Returns:
+            An array with the index of the representative of each spectrum
+        """
+        metadata = [self.metadata_values(spectra, key) for key in metadata_keys]
+        vectors = self.binned_vectors(spectra)
+        leader = np.full(len(spectra), -1, dtype=int)
+        block_size = max(1, min(1024, 2**24 // len(spectra)))
+        for start in range(0, len(spectra), block_size):
+            block = (vectors[start : start + block_size] @ vectors.T).tocsr()
+            for row in range(block.shape[0]):
+                if leader[start + row] != -1:
+                    continue
+                leader[start + row] = start + row
+                span = slice(block.indptr[row], block.indptr[row + 1])
+                cols = block.indices[span][block.data[span] >= self.min_cosine - 1e-9]
+                cols = cols[leader[cols] == -1]
+                for values in metadata:
+                    if values.dtype == object:
+                        cols = cols[values[cols] == values[start + row]]
+                    else:
+                        diff = np.abs(values[cols] - values[start + row])
+                        cols = cols[diff <= self.fragment_tol + 1e-9]
+                leader[cols] = start + row
+        return leader
+
+    @staticmethod
+    def fan_out(scores: SparseScores, ids: list, rep: np.ndarray) -> SparseScores:
+        """Expand the scores of representatives to all pairs of their members
+
+        The members of a representative are scored as its pairs; the pairs among
+        members of the same representative are scored 1.0.
+
+        Arguments:
+            scores: the scores of the representatives, in order of np.unique(rep)
+            ids: the identifier of each spectrum
+            rep: the index of the representative of each spectrum
+
+        Returns:
+            A SparseScores object of the retained pairs of all spectra
+        """
+        _, label = np.unique(rep, return_inverse=True)
+        label = label.reshape(-1)
+        order = np.argsort(label, kind="stable")
+        counts = np.bincount(label)
+        starts = np.cumsum(counts) - counts
+
+        def member_pairs(a: np.ndarray, b: np.ndarray) -> tuple:
+            nr_pairs = counts[a] * counts[b]
+            pair = np.repeat(np.arange(len(a)), nr_pairs)
+            pos = np.arange(nr_pairs.sum()) - np.repeat(
+                np.cumsum(nr_pairs) - nr_pairs, nr_pairs
+            )
+            pos_a, pos_b = pos // counts[b][pair], pos % counts[b][pair]
+            return (
+                pair,
+                pos_a < pos_b,
+                order[starts[a][pair] + pos_a],
+                order[starts[b][pair] + pos_b],
+            )
+
+        result = SparseScores(ids=ids, score_cutoff=scores.score_cutoff)
+        pair, _, rows, cols = member_pairs(scores.rows, scores.cols)
+        result.append(rows, cols, scores.scores[pair])
+
+        groups = np.flatnonzero(counts > 1)
+        _, upper, rows, cols = member_pairs(groups, groups)
+        result.append(
+            rows[upper], cols[upper], np.ones(np.count_nonzero(upper), np.float32)
+        )
+        return result.finalize()
@@ -30,6 +30,7 @@ from typing import Self
 from urllib.parse import urlparse
 
 import matchms
+import numpy as np
 import pandas as pd
 from pydantic import BaseModel
 
@@ -174,6 +175,88 @@ class UtilityMethodManager(BaseModel):
             )
             raise e
 
+    @staticmethod
+    def expand_index_ranges(
+        start: np.ndarray, stop: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Expand per-item half-open index ranges into flat pairs of indices
+
+        Arguments:
+            start: the first index of the range of each item
+            stop: the stop index (exclusive) of the range of each item
+
+        Returns:
+            A tuple of item indices and the indices inside their range
+        """
+        counts = stop - start
+        owner = np.repeat(np.arange(len(start)), counts)
+        offsets = np.repeat(np.cumsum(counts) - counts - start, counts)
+        return owner, np.arange(counts.sum()) - offsets
+
+    @staticmethod
+    def precursor_window_pairs(
+        ref_mz: np.ndarray, query_mz: np.ndarray, max_diff: float
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Collect reference-query pairs inside a precursor m/z window
+
+        The references are sorted by precursor m/z and the candidate slice of each
+        query is located by binary search, without comparing all pairs.
+
+        Arguments:
+            ref_mz: the precursor m/z of each reference (unsorted)
+            query_mz: the precursor m/z of each query
+            max_diff: the maximum absolute precursor m/z difference (inclusive)
+
+        Returns:
+            A tuple of reference indices and query indices, grouped by query
+        """
+        ref_mz = np.asarray(ref_mz, dtype=float)
+        query_mz = np.asarray(query_mz, dtype=float)
+        order = np.argsort(ref_mz, kind="stable")
+        sorted_mz = ref_mz[order]
+        margin = max_diff + 10**-6
+
+        q_idx, pos = UtilityMethodManager.expand_index_ranges(
+            start=np.searchsorted(sorted_mz, query_mz - margin, side="left"),
+            stop=np.searchsorted(sorted_mz, query_mz + margin, side="right"),
+        )
+        r_idx = order[pos]
+
+        mask = np.abs(ref_mz[r_idx] - query_mz[q_idx]) <= max_diff
+        return r_idx[mask], q_idx[mask]
+
+    @staticmethod
+    def match_masses_ppm(
+        queries: np.ndarray, refs: np.ndarray, mass_dev_ppm: float
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Match query masses against sorted reference masses inside a ppm window
+
+        Arguments:
+            queries: an array of m/z values to match
+            refs: an ascending sorted array of (nonzero) reference m/z values
+            mass_dev_ppm: the maximum mass deviation in ppm (exclusive)
+
+        Returns:
+            A tuple of query indices, reference indices and their deviation in ppm
+
+        Notes:
+            The ppm deviation is calculated as in `mass_deviation`. The search window
+            is slightly widened to be robust against rounding; the exact deviation
+            decides on the match.
+        """
+        queries = np.asarray(queries, dtype=float)
+        refs = np.asarray(refs, dtype=float)
+        tol = (mass_dev_ppm * 10**-6) * (1 + 10**-6)
+
+        q_idx, r_idx = UtilityMethodManager.expand_index_ranges(
+            start=np.searchsorted(refs, queries / (1 + tol), side="left"),
+            stop=np.searchsorted(refs, queries / (1 - tol), side="right"),
+        )
+
+        ppm = np.abs(((queries[q_idx] - refs[r_idx]) / refs[r_idx]) * 10**6)
+        mask = ppm < mass_dev_ppm
+        return q_idx[mask], r_idx[mask], ppm[mask]
+
     @staticmethod
     def extract_as_kcb_results(as_results: Path, cutoff: float) -> dict:
         """Extract MIBiG IDs from antiSMASH full results folder
@@ -258,17 +341,11 @@ class UtilityMethodManager(BaseModel):
             )
 
     @staticmethod
-    def create_mibig_spec_lib(mibig_ids: set) -> list[matchms.Spectrum]:
-        """Load MIBiG-derived in silico spectral library.
-
-        Attributes:
-            mibig_ids: A set of MIBiG IDs to create a targeted spectral library
+    def load_mibig_spec_lib() -> list[matchms.Spectrum]:
+        """Load all valid spectra of the MIBiG-derived in silico spectral library.
 
         Returns:
-            The spectral library
-
-        Raises:
-            RuntimeError: empty spectral library
+            The unfiltered spectral library
         """
         mgf_gen = matchms.importing.load_from_mgf(DefaultPaths().library_mibig_pos)
         spectra = []
@@ -301,9 +378,22 @@ class UtilityMethodManager(BaseModel):
                     )
             except Exception as e:
                 logger.warning(f"SpecLibMgfParser: {e}")
+        return spectra
+
+    def create_mibig_spec_lib(self: Self, mibig_ids: set) -> list[matchms.Spectrum]:
+        """Load MIBiG-derived in silico spectral library.
+
+        Attributes:
+            mibig_ids: A set of MIBiG IDs to create a targeted spectral library
 
+        Returns:
+            The spectral library
+
+        Raises:
+            RuntimeError: empty spectral library
+        """
         filtered_spectra = []
-        for spectrum in spectra:
+        for spectrum in self.load_mibig_spec_lib():
             ids = set(spectrum.metadata.get("mibigaccession").split(","))
             if not mibig_ids.isdisjoint(ids):
                 filtered_spectra.append(spectrum)
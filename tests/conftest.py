@@ -1,3 +1,7 @@
+import json
+
+import h5py
+import numpy as np
 import pandas as pd
 import pytest
 
@@ -60,3 +64,66 @@ def feature_instance(general_parser_instance):
 def sample_instance(general_parser_instance):
     stats, features, samples = general_parser_instance.return_attributes()
     return samples
+
+
+@pytest.fixture
+def ms2deepscore_model_file(tmp_path):
+    """Fixture to write a small random ms2deepscore model file without keras."""
+    rng = np.random.default_rng(0)
+    binner = {
+        "number_of_bins": 99,
+        "mz_max": 1000.0,
+        "mz_min": 10.0,
+        "d_bins": 10.0,
+        "peak_scaling": 0.5,
+        "allowed_missing_percentage": 0.0,
+        "peak_to_position": {str(i): i for i in range(99)},
+        "known_bins": list(range(99)),
+        "additional_metadata": [],
+    }
+    layers = [
+        {"class_name": "InputLayer", "config": {"name": "base_input"}},
+        {
+            "class_name": "Dense",
+            "config": {"name": "dense1", "units": 8, "activation": "relu"},
+        },
+        {
+            "class_name": "BatchNormalization",
+            "config": {"name": "normalization1", "epsilon": 0.001},
+        },
+        {"class_name": "Dropout", "config": {"name": "dropout1", "rate": 0.2}},
+        {
+            "class_name": "Dense",
+            "config": {"name": "embedding", "units": 4, "activation": "relu"},
+        },
+    ]
+    config = {
+        "class_name": "Functional",
+        "config": {
+            "layers": [
+                {
+                    "class_name": "Functional",
+                    "config": {"name": "base", "layers": layers},
+                }
+            ]
+        },
+    }
+    weights = {
+        "dense1/kernel:0": rng.normal(size=(99, 8)),
+        "dense1/bias:0": rng.normal(size=8),
+        "normalization1/gamma:0": rng.uniform(0.5, 1.5, 8),
+        "normalization1/beta:0": rng.normal(size=8),
+        "normalization1/moving_mean:0": rng.normal(size=8),
+        "normalization1/moving_variance:0": rng.uniform(0.5, 1.5, 8),
+        "embedding/kernel:0": rng.normal(size=(8, 4)),
+        "embedding/bias:0": rng.uniform(0.5, 1.0, 4),
+    }
+    path = tmp_path.joinpath("model.hdf5")
+    with h5py.File(path, "w") as outfile:
+        outfile.attrs["spectrum_binner"] = json.dumps(binner)
+        outfile.attrs["model_config"] = json.dumps(config)
+        for name, value in weights.items():
+            outfile.create_dataset(
+                f"model_weights/base/{name}", data=value.astype(np.float32)
+            )
+    return path
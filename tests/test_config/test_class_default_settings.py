@@ -1,9 +1,13 @@
+import numpy as np
+
 from fermo_core.config.class_default_settings import (
     CharFragments,
     DefaultPaths,
     Fragment,
     Loss,
     NeutralLosses,
+    load_char_fragments,
+    load_neutral_losses,
 )
 
 
@@ -16,6 +20,14 @@ def test_dirpath_ms2deepscore():
     assert default_settings.dirpath_ms2deepscore_pos.exists()
 
 
+def test_embedding_cache_environment(monkeypatch, tmp_path):
+    monkeypatch.setenv("FERMO_EMBEDDING_CACHE", str(tmp_path))
+    monkeypatch.setenv("FERMO_EMBEDDING_CACHE_MAX_MB", "16")
+    default_settings = DefaultPaths()
+    assert default_settings.dirpath_embedding_cache == tmp_path
+    assert default_settings.max_mb_embedding_cache == 16
+
+
 def test_class_loss_valid():
     assert isinstance(Loss(descr="example", loss=123.456, abbr="ex"), Loss)
 
@@ -37,3 +49,29 @@ def test_init_fragment():
 def test_char_fragments_valid():
     char_frags = CharFragments()
     assert len(char_frags.aa_frags) != 0
+
+
+def test_load_neutral_losses_valid():
+    library = load_neutral_losses()
+    assert library is load_neutral_losses()
+    assert len(library.mass) == sum(
+        len(getattr(NeutralLosses(), ctgr)) for ctgr in library.ctgrs
+    )
+    assert np.all(np.diff(library.mass) >= 0)
+
+
+def test_load_char_fragments_valid():
+    library = load_char_fragments()
+    char_frags = CharFragments()
+    assert len(library.mass) == len(char_frags.aa_frags)
+    first = np.flatnonzero(library.idx == 0)[0]
+    assert library.descr[first] == char_frags.aa_frags[0].descr
+
+
+def test_mass_library_select_valid():
+    library = load_neutral_losses().select(("glycoside", "ribosomal"))
+    assert library.ctgrs == ("glycoside", "ribosomal")
+    assert set(library.ctgr) == {0, 1}
+    assert len(library.mass) == len(NeutralLosses().glycoside) + len(
+        NeutralLosses().ribosomal
+    )
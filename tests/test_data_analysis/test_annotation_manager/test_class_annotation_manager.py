@@ -35,19 +35,28 @@ def test_init_valid(annotation_manager_instance):
 
 
 @pytest.mark.slow
-def test_run_user_lib_mod_cosine_matching_valid(annotation_manager_instance):
-    annotation_manager_instance.run_user_lib_mod_cosine_matching()
+def test_run_library_matching_user_lib_mod_cosine_valid(annotation_manager_instance):
+    params = annotation_manager_instance.params
+    params.SpectralLibMatchingDeepscoreParameters.activate_module = False
+    annotation_manager_instance.run_library_matching()
     assert isinstance(
         annotation_manager_instance.features.get(79).Annotations.matches[0], Match
     )
+    assert params.SpectralLibMatchingCosineParameters.module_passed
 
 
 @pytest.mark.slow
-def test_run_user_lib_ms2deepscore_matching_valid(annotation_manager_instance):
-    annotation_manager_instance.run_user_lib_ms2deepscore_matching()
+def test_run_library_matching_user_lib_ms2deepscore_valid(
+    annotation_manager_instance,
+):
+    params = annotation_manager_instance.params
+    params.SpectralLibMatchingCosineParameters.activate_module = False
+    params.SpectralLibMatchingDeepscoreParameters.activate_module = True
+    annotation_manager_instance.run_library_matching()
     assert isinstance(
         annotation_manager_instance.features.get(79).Annotations.matches[0], Match
     )
+    assert params.SpectralLibMatchingDeepscoreParameters.module_passed
 
 
 @pytest.mark.slow
@@ -88,25 +97,37 @@ def test_run_ms2query_results_assignment_valid(annotation_manager_instance):
 
 
 @pytest.mark.slow
-def test_run_as_kcb_cosine_annotation_valid(annotation_manager_instance):
-    annotation_manager_instance.params.AsResultsParameters = AsResultsParameters(
+def test_run_library_matching_kcb_mod_cosine_valid(annotation_manager_instance):
+    params = annotation_manager_instance.params
+    params.SpectralLibMatchingCosineParameters.activate_module = False
+    params.AsResultsParameters = AsResultsParameters(
         directory_path=Path("example_data/JABTEZ000000000.1/"), similarity_cutoff=0.2
     )
-    annotation_manager_instance.run_as_kcb_cosine_annotation()
-    assert isinstance(
-        annotation_manager_instance.features.get(146).Annotations.matches[0], Match
-    )
+    annotation_manager_instance.run_library_matching()
+    match = annotation_manager_instance.features.get(146).Annotations.matches[0]
+    assert match.module == "antismash_kcb_annotation"
+    assert params.AsKcbCosineMatchingParams.module_passed
 
 
 @pytest.mark.slow
-def test_run_as_kcb_deepscore_annotation_valid(annotation_manager_instance):
-    annotation_manager_instance.params.AsResultsParameters = AsResultsParameters(
+def test_run_library_matching_kcb_ms2deepscore_valid(annotation_manager_instance):
+    params = annotation_manager_instance.params
+    params.SpectralLibMatchingCosineParameters.activate_module = False
+    params.AsKcbCosineMatchingParams.activate_module = False
+    params.AsKcbDeepscoreMatchingParams.activate_module = True
+    params.AsResultsParameters = AsResultsParameters(
         directory_path=Path("example_data/JABTEZ000000000.1/"), similarity_cutoff=0.8
     )
-    annotation_manager_instance.params.AsKcbDeepscoreMatchingParams.activate_module = (
-        True
-    )
-    annotation_manager_instance.run_as_kcb_deepscore_annotation()
-    assert isinstance(
-        annotation_manager_instance.features.get(149).Annotations.matches[0], Match
-    )
+    annotation_manager_instance.run_library_matching()
+    match = annotation_manager_instance.features.get(149).Annotations.matches[0]
+    assert match.module == "antismash_kcb_annotation"
+    assert params.AsKcbDeepscoreMatchingParams.module_passed
+
+
+@pytest.mark.slow
+def test_run_library_matching_valid(annotation_manager_instance):
+    params = annotation_manager_instance.params
+    annotation_manager_instance.run_library_matching()
+    match = annotation_manager_instance.features.get(79).Annotations.matches[0]
+    assert match.module == "user_library_annotation"
+    assert params.SpectralLibMatchingCosineParameters.module_passed
@@ -82,3 +82,14 @@ def test_validate_pos_aa_fragments_invalid(frag_annotator_pos):
     feature = frag_annotator_pos.features.get(1)
     with pytest.raises(AttributeError):
         frag_annotator_pos.validate_pos_aa_fragments(feature)
+
+
+def test_annotate_run_pos_valid(frag_annotator_pos):
+    frag_annotator_pos.annotate_run_pos({1})
+    assert len(frag_annotator_pos.features.entries[1].Annotations.fragments) == 2
+
+
+def test_annotate_run_pos_no_spectrum(frag_annotator_pos):
+    frag_annotator_pos.features.entries[1].Spectrum = None
+    frag_annotator_pos.annotate_run_pos({1})
+    assert frag_annotator_pos.features.entries[1].Annotations is None
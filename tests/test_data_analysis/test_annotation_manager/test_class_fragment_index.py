@@ -0,0 +1,52 @@
+import matchms
+import numpy as np
+import pytest
+
+from fermo_core.data_analysis.annotation_manager.class_fragment_index import (
+    FragmentIndex,
+)
+
+
+@pytest.fixture
+def fragment_index():
+    library = [
+        matchms.Spectrum(
+            mz=np.array([10, 45, 60], dtype=float),
+            intensities=np.array([10, 30, 100], dtype=float),
+            metadata={"precursor_mz": 105.0},
+        ),
+        matchms.Spectrum(
+            mz=np.array([20, 70], dtype=float),
+            intensities=np.array([50, 100], dtype=float),
+            metadata={"precursor_mz": 300.0},
+        ),
+    ]
+    return FragmentIndex(tolerance=0.1).build(library)
+
+
+def test_build_valid(fragment_index):
+    assert fragment_index.nr_refs == 2
+    assert list(fragment_index.frag_mz) == [10, 20, 45, 60, 70]
+    assert list(fragment_index.peak_ref) == [0, 0, 0, 1, 1]
+
+
+def test_max_matched_peaks_valid(fragment_index):
+    query = matchms.Spectrum(
+        mz=np.array([10, 40, 60.05, 80, 100], dtype=float),
+        intensities=np.array([10, 20, 100, 15, 55], dtype=float),
+        metadata={"precursor_mz": 100.0},
+    )
+    refs, max_peaks = fragment_index.max_matched_peaks(query)
+    assert list(refs) == [0]
+    assert list(max_peaks) == [3]
+
+
+def test_max_matched_peaks_empty(fragment_index):
+    query = matchms.Spectrum(
+        mz=np.array([500], dtype=float),
+        intensities=np.array([10], dtype=float),
+        metadata={"precursor_mz": 600.0},
+    )
+    refs, max_peaks = fragment_index.max_matched_peaks(query)
+    assert len(refs) == 0
+    assert len(max_peaks) == 0
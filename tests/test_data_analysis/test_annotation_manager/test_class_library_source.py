@@ -0,0 +1,31 @@
+import matchms
+import numpy as np
+
+from fermo_core.data_analysis.annotation_manager.class_library_source import (
+    LibrarySource,
+)
+
+
+def test_combine_valid():
+    spectrum = matchms.Spectrum(
+        mz=np.array([10, 45, 60], dtype=float),
+        intensities=np.array([10, 30, 100], dtype=float),
+        metadata={"precursor_mz": 105.0},
+    )
+    sources = [
+        LibrarySource(
+            library=[spectrum, spectrum],
+            library_name="a",
+            score_cutoff=0.7,
+            max_precursor_mass_diff=10,
+        ),
+        LibrarySource(
+            library=[spectrum],
+            library_name="b",
+            score_cutoff=0.7,
+            max_precursor_mass_diff=10,
+        ),
+    ]
+    library, source_idx = LibrarySource.combine(sources)
+    assert len(library) == 3
+    assert source_idx.tolist() == [0, 0, 1]
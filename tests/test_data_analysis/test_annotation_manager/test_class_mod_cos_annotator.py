@@ -2,11 +2,15 @@ import matchms
 import numpy as np
 import pytest
 
+from fermo_core.data_analysis.annotation_manager.class_library_source import (
+    LibrarySource,
+)
 from fermo_core.data_analysis.annotation_manager.class_mod_cos_annotator import (
     ModCosAnnotator,
 )
-from fermo_core.data_processing.class_repository import Repository
 from fermo_core.data_processing.builder_feature.dataclass_feature import Feature
+from fermo_core.data_processing.class_repository import Repository
+from fermo_core.utils.class_spectrum_deduplicator import SpectrumDeduplicator
 from fermo_core.utils.utility_method_manager import UtilityMethodManager as Utils
 
 
@@ -76,13 +80,45 @@ def test_calculate_scores_mod_cosine_valid(mod_cos_annotator):
     assert mod_cos_annotator.scores is not None
 
 
+def test_calculate_scores_mod_cosine_deduplicated(mod_cos_annotator):
+    duplicate = mod_cos_annotator.features.get(1).model_copy()
+    duplicate.f_id = 2
+    mod_cos_annotator.features.add(2, duplicate)
+    mod_cos_annotator.active_features = {1, 2}
+    mod_cos_annotator.backend = "numpy"
+    mod_cos_annotator.deduplicator = SpectrumDeduplicator()
+    mod_cos_annotator.prepare_queries()
+    mod_cos_annotator.calculate_scores_mod_cosine()
+    assert mod_cos_annotator.scores["query"].tolist() == [0, 1]
+    assert mod_cos_annotator.scores["score"][0] == mod_cos_annotator.scores["score"][1]
+
+
+def test_collect_candidates_valid(mod_cos_annotator):
+    mod_cos_annotator.prepare_queries()
+    ref_idx, query_idx = mod_cos_annotator.collect_candidates()
+    assert ref_idx.tolist() == [0]
+    assert query_idx.tolist() == [0]
+
+
+def test_collect_candidates_outside_window(mod_cos_annotator):
+    mod_cos_annotator.prepare_queries()
+    mod_cos_annotator.max_precursor_mass_diff = 4
+    ref_idx, query_idx = mod_cos_annotator.collect_candidates()
+    assert len(ref_idx) == 0
+
+
+def test_calculate_scores_mod_cosine_outside_window(mod_cos_annotator):
+    mod_cos_annotator.prepare_queries()
+    mod_cos_annotator.max_precursor_mass_diff = 4
+    mod_cos_annotator.calculate_scores_mod_cosine()
+    assert list(mod_cos_annotator.matches_by_query(0)) == []
+
+
 @pytest.mark.slow
 def test_filter_match_valid(mod_cos_annotator):
     mod_cos_annotator.prepare_queries()
     mod_cos_annotator.calculate_scores_mod_cosine()
-    sorted_matches = mod_cos_annotator.scores.scores_by_query(
-        mod_cos_annotator.queries[0], name="ModifiedCosine_score", sort=True
-    )
+    sorted_matches = list(mod_cos_annotator.matches_by_query(0))
     assert mod_cos_annotator.filter_match(sorted_matches[0], 100.0)
 
 
@@ -91,12 +127,33 @@ def test_filter_match_invalid(mod_cos_annotator):
     mod_cos_annotator.prepare_queries()
     mod_cos_annotator.score_cutoff = 1.0
     mod_cos_annotator.calculate_scores_mod_cosine()
-    sorted_matches = mod_cos_annotator.scores.scores_by_query(
-        mod_cos_annotator.queries[0], name="ModifiedCosine_score", sort=True
-    )
+    sorted_matches = list(mod_cos_annotator.matches_by_query(0))
     assert mod_cos_annotator.filter_match(sorted_matches[0], 100.0) is False
 
 
+@pytest.mark.slow
+def test_best_matches_bounded(mod_cos_annotator):
+    mod_cos_annotator.library = mod_cos_annotator.library * 3
+    mod_cos_annotator.max_nr_matches = 2
+    mod_cos_annotator.prepare_queries()
+    mod_cos_annotator.calculate_scores_mod_cosine()
+    assert len(list(mod_cos_annotator.matches_by_query(0))) == 3
+    assert len(mod_cos_annotator.best_matches(0, 100.0)) == 2
+    mod_cos_annotator.max_nr_matches = None
+    assert len(mod_cos_annotator.best_matches(0, 100.0)) == 3
+
+
+@pytest.mark.slow
+def test_calculate_scores_mod_cosine_numpy_backend(mod_cos_annotator):
+    mod_cos_annotator.prepare_queries()
+    mod_cos_annotator.calculate_scores_mod_cosine()
+    expected = mod_cos_annotator.scores
+    mod_cos_annotator.backend = "numpy"
+    mod_cos_annotator.calculate_scores_mod_cosine()
+    assert np.allclose(mod_cos_annotator.scores["score"], expected["score"])
+    assert np.array_equal(mod_cos_annotator.scores["matches"], expected["matches"])
+
+
 def test_extract_userlib_scores_invalid(mod_cos_annotator):
     with pytest.raises(RuntimeError):
         mod_cos_annotator.extract_userlib_scores()
@@ -125,3 +182,41 @@ def test_extract_mibig_scores_valid(mod_cos_annotator):
 def test_extract_mibig_scores_invalid(mod_cos_annotator):
     with pytest.raises(RuntimeError):
         mod_cos_annotator.extract_mibig_scores({})
+
+
+def test_extract_source_scores_valid(mod_cos_annotator):
+    library = mod_cos_annotator.library
+    sources = [
+        LibrarySource(
+            library=library,
+            library_name="dummy_lib",
+            score_cutoff=0.7,
+            max_precursor_mass_diff=600,
+            min_nr_matched_peaks=3,
+        ),
+        LibrarySource(
+            library=library,
+            library_name="mibig",
+            kcb_results={"BGC0000000": {"bgc_sim": 80, "region": "dummy"}},
+            score_cutoff=0.7,
+            max_precursor_mass_diff=4,
+            min_nr_matched_peaks=3,
+        ),
+    ]
+    annotator = ModCosAnnotator.from_sources(
+        features=mod_cos_annotator.features,
+        active_features={1},
+        sources=sources,
+        fragment_tol=0.1,
+        backend="numpy",
+    )
+    annotator.prepare_queries()
+    annotator.calculate_scores_mod_cosine()
+    annotator.extract_source_scores()
+    matches = annotator.return_features().entries[1].Annotations.matches
+    assert [m.module for m in matches] == ["user_library_annotation"]
+
+
+def test_extract_source_scores_invalid(mod_cos_annotator):
+    with pytest.raises(RuntimeError):
+        mod_cos_annotator.extract_source_scores()
@@ -1,3 +1,6 @@
+import logging
+from types import SimpleNamespace
+
 import matchms
 import numpy as np
 import pytest
@@ -5,11 +8,22 @@ import pytest
 from fermo_core.data_analysis.annotation_manager.class_ms2deepscore_annotator import (
     Ms2deepscoreAnnotator,
 )
-from fermo_core.data_processing.class_repository import Repository
 from fermo_core.data_processing.builder_feature.dataclass_feature import Feature
+from fermo_core.data_processing.class_repository import Repository
 from fermo_core.utils.utility_method_manager import UtilityMethodManager as Utils
 
 
+class StubSimAlgorithm:
+    def __init__(self):
+        self.cache = SimpleNamespace(file_hash="abc")
+        self.metadata_keys = ()
+
+    def calculate_vectors(self, spectra):
+        return np.array(
+            [[s.get("precursor_mz"), s.peaks.intensities.sum()] for s in spectra]
+        )
+
+
 @pytest.fixture
 def ms2deepscore_annotator():
     library = [
@@ -76,12 +90,68 @@ def test_calculate_ms2deepscore_valid(ms2deepscore_annotator):
 
 
 @pytest.mark.slow
-def test_filter_match_valid(ms2deepscore_annotator):
+def test_calculate_ms2deepscore_library_path(ms2deepscore_annotator, tmp_path):
     ms2deepscore_annotator.prepare_queries()
     ms2deepscore_annotator.calculate_scores_ms2deepscore()
-    sorted_matches = ms2deepscore_annotator.scores.scores_by_query(
-        ms2deepscore_annotator.queries[0], name="MS2DeepScore", sort=True
+    expected = ms2deepscore_annotator.scores["score"]
+    ms2deepscore_annotator.library_path = tmp_path
+    ms2deepscore_annotator.calculate_scores_ms2deepscore()
+    assert tmp_path.joinpath("ms2deepscore_embeddings.npz").exists()
+    assert np.allclose(ms2deepscore_annotator.scores["score"], expected)
+
+
+def test_score_library_library_path_valid(ms2deepscore_annotator, tmp_path):
+    annotator = ms2deepscore_annotator
+    annotator.library = annotator.library * 3
+    annotator.library_path = tmp_path
+    query_vectors = np.array([[1.0, 0.0], [0.6, 0.8]])
+    scores = annotator.score_library(
+        StubSimAlgorithm(),
+        query_vectors,
+        np.array([0, 1, 1]),
+        np.array([2, 0, 1]),
+        annotator,
+    )
+    ref = np.array([105.0, 140.0]) / np.linalg.norm([105.0, 140.0])
+    assert np.allclose(scores, query_vectors[[0, 1, 1]] @ ref)
+    assert tmp_path.joinpath("ms2deepscore_embeddings.npz").exists()
+
+
+def test_score_library_ivf_no_library_path(ms2deepscore_annotator, caplog):
+    annotator = ms2deepscore_annotator
+    annotator.search = "ivf"
+    query_vectors = np.array([[0.6, 0.8]])
+    scores = annotator.score_library(
+        StubSimAlgorithm(), query_vectors, np.array([0]), np.array([0]), annotator
+    )
+    ref = np.array([105.0, 140.0]) / np.linalg.norm([105.0, 140.0])
+    assert np.allclose(scores, query_vectors @ ref)
+    assert "using search 'exact' instead" in caplog.text
+
+
+def test_score_library_ivf_missed_pairs(ms2deepscore_annotator, tmp_path, caplog):
+    caplog.set_level(logging.INFO)
+    annotator = ms2deepscore_annotator
+    annotator.library = annotator.library * 3
+    annotator.library_path = tmp_path
+    annotator.search = "ivf"
+    annotator.nr_candidates = 1
+    scores = annotator.score_library(
+        StubSimAlgorithm(),
+        np.array([[0.6, 0.8]]),
+        np.array([0, 0, 0]),
+        np.array([0, 1, 2]),
+        annotator,
     )
+    assert np.count_nonzero(scores) == 1
+    assert "'2' of '3' library-query pairs" in caplog.text
+
+
+@pytest.mark.slow
+def test_filter_match_valid(ms2deepscore_annotator):
+    ms2deepscore_annotator.prepare_queries()
+    ms2deepscore_annotator.calculate_scores_ms2deepscore()
+    sorted_matches = list(ms2deepscore_annotator.matches_by_query(0))
     assert ms2deepscore_annotator.filter_match(sorted_matches[0], 100.0)
 
 
@@ -90,9 +160,7 @@ def test_filter_match_invalid(ms2deepscore_annotator):
     ms2deepscore_annotator.prepare_queries()
     ms2deepscore_annotator.score_cutoff = 1.0
     ms2deepscore_annotator.calculate_scores_ms2deepscore()
-    sorted_matches = ms2deepscore_annotator.scores.scores_by_query(
-        ms2deepscore_annotator.queries[0], name="MS2DeepScore", sort=True
-    )
+    sorted_matches = list(ms2deepscore_annotator.matches_by_query(0))
     assert ms2deepscore_annotator.filter_match(sorted_matches[0], 100.0) is False
 
 
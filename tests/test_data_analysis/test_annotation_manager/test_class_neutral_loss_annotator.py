@@ -153,3 +153,20 @@ def test_validate_gen_other_neg_losses_valid(annotator_neg):
     feature = annotator_neg.features.get(1)
     feature = annotator_neg.validate_gen_other_neg_losses(feature)
     assert feature.Annotations.losses[0].id == "Methyl-radical(*CH3)"
+
+
+def test_compile_references_valid(annotator_pos):
+    refs = annotator_pos.compile_references(("ribosomal", "glycoside"))
+    assert refs.ctgrs == ("ribosomal", "glycoside")
+    assert np.all(np.diff(refs.mass) >= 0)
+    assert set(refs.ctgr) == {0, 1}
+
+
+def test_validate_losses_order_valid(annotator_pos):
+    feature = annotator_pos.features.get(1)
+    feature = annotator_pos.validate_losses(
+        feature,
+        ("ribosomal", "nonribo", "glycoside", "gen_bio_pos", "gen_other_pos"),
+    )
+    assert len(feature.Annotations.losses) == 6
+    assert "ribosomal" in feature.Annotations.losses[0].id
@@ -21,8 +21,7 @@ def score_assigner():
             networks={
                 "modified_cosine": SpecSimNet(
                     algorithm="modified_cosine",
-                    network={},
-                    subnetworks={},
+                    graph=None,
                     summary={"1": {1}, "2": {2}, "3": {3}, "4": {4}},
                 )
             },
@@ -121,6 +120,12 @@ def test_collect_sample_spec_networks_valid(score_assigner):
     assert score_assigner.samples.entries["s1"].networks["modified_cosine"] == {1, 2}
 
 
+def test_collect_sample_spec_networks_replace_valid(score_assigner):
+    score_assigner.samples.entries["s1"].networks = {"modified_cosine": {9}}
+    score_assigner.collect_sample_spec_networks()
+    assert score_assigner.samples.entries["s1"].networks["modified_cosine"] == {1, 2}
+
+
 def test_collect_assign_sample_scores_valid(score_assigner):
     score_assigner.assign_feature_scores()
     score_assigner.collect_sample_spec_networks()
@@ -0,0 +1,59 @@
+import networkx
+import numpy as np
+import pytest
+
+from fermo_core.data_analysis.sim_networks_manager.class_array_network import (
+    ArrayNetwork,
+)
+from fermo_core.utils.class_sparse_scores import SparseScores
+
+
+@pytest.fixture
+def scores():
+    scores = SparseScores(ids=[10, 11, 12, 13, 14], score_cutoff=0.7)
+    scores.append(
+        np.array([0, 0, 1, 2]),
+        np.array([1, 2, 2, 3]),
+        np.array([0.9, 0.8, 0.95, 0.75]),
+    )
+    return scores.finalize()
+
+
+def test_build_valid(scores):
+    network = ArrayNetwork(ids=scores.ids).build(scores, 0.7, 10)
+    assert len(network.rows) == 4
+    assert network.clusters() == {0: {10, 11, 12, 13}, 1: {14}}
+
+
+def test_build_mutual_top_n_valid(scores):
+    network = ArrayNetwork(ids=scores.ids).build(scores, 0.7, 1)
+    assert list(zip(network.rows.tolist(), network.cols.tolist())) == [(1, 2)]
+    assert network.clusters() == {0: {10}, 1: {11, 12}, 2: {13}, 3: {14}}
+
+
+def test_build_cutoff_valid(scores):
+    network = ArrayNetwork(ids=scores.ids).build(scores, 0.85, 10)
+    assert len(network.rows) == 2
+    assert network.clusters() == {0: {10, 11, 12}, 1: {13}, 2: {14}}
+
+
+def test_to_networkx_valid(scores):
+    graph = ArrayNetwork(ids=scores.ids).build(scores, 0.7, 10).to_networkx()
+    assert sorted(graph.nodes) == [10, 11, 12, 13, 14]
+    assert graph.edges[11, 12]["weight"] == pytest.approx(0.95)
+
+
+def test_subnetworks_valid(scores):
+    subnetworks = ArrayNetwork(ids=scores.ids).build(scores, 0.7, 1).subnetworks()
+    assert len(subnetworks) == 4
+    assert list(subnetworks[1].edges) == [(11, 12)]
+    assert subnetworks[1].graph["name"] == 1
+
+
+def test_to_cytoscape_valid(scores):
+    network = ArrayNetwork(ids=scores.ids).build(scores, 0.7, 1)
+    cytoscape = network.to_cytoscape()
+    assert cytoscape == {
+        label: networkx.cytoscape_data(graph)
+        for label, graph in network.subnetworks().items()
+    }
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from fermo_core.data_analysis.sim_networks_manager.class_edge_store import EdgeStore
+from fermo_core.utils.class_sparse_scores import SparseScores
+
+
+@pytest.fixture
+def scores():
+    scores = SparseScores(ids=[1, 2, 3], score_cutoff=0.7)
+    scores.append(np.array([0, 1]), np.array([1, 2]), np.array([0.8, 0.9]))
+    return scores.finalize()
+
+
+def test_save_load_valid(scores, tmp_path):
+    filepath = tmp_path.joinpath("edges.npz")
+    EdgeStore(filepath=filepath, settings={"a": 1}).save(["x", "y", "z"], scores)
+    store = EdgeStore(filepath=filepath, settings={"a": 1}).load()
+    assert store.keys == ["x", "y", "z"]
+    assert store.scores.rows.tolist() == [0, 1]
+
+
+def test_load_other_settings(scores, tmp_path):
+    filepath = tmp_path.joinpath("edges.npz")
+    EdgeStore(filepath=filepath, settings={"a": 1}).save(["x", "y", "z"], scores)
+    store = EdgeStore(filepath=filepath, settings={"a": 2}).load()
+    assert store.scores is None
+
+
+def test_load_min_score_valid(scores, tmp_path):
+    filepath = tmp_path.joinpath("edges.npz")
+    EdgeStore(filepath=filepath, settings={"a": 1, "score_cutoff": 0.5}).save(
+        ["x", "y", "z"], scores
+    )
+    store = EdgeStore(filepath=filepath, settings={"a": 1, "score_cutoff": 0.7})
+    assert store.load().scores is None
+    assert store.load(min_score=0.7).scores is not None
+    assert store.load(min_score=0.4).scores is None
+
+
+def test_reorder_valid(scores, tmp_path):
+    filepath = tmp_path.joinpath("edges.npz")
+    EdgeStore(filepath=filepath, settings={"a": 1}).save(["x", "y", "z"], scores)
+    store = EdgeStore(filepath=filepath, settings={"a": 1}).load()
+    features, keys, nr_old, rows, cols, old_scores = store.reorder(
+        (10, 20, 30), ["w", "z", "y"]
+    )
+    assert features == (20, 30, 10)
+    assert keys == ["z", "y", "w"]
+    assert nr_old == 2
+    assert list(zip(rows.tolist(), cols.tolist())) == [(1, 0)]
+    assert old_scores.tolist() == pytest.approx([0.9])
+
+
+def test_reorder_top_n_removed_valid(scores, tmp_path):
+    filepath = tmp_path.joinpath("edges.npz")
+    EdgeStore(filepath=filepath, settings={"a": 1}).save(["x", "y", "z"], scores)
+    store = EdgeStore(filepath=filepath, settings={"a": 1}).load()
+    features, keys, nr_old, rows, cols, old_scores = store.reorder(
+        (10, 30), ["x", "z"], top_n=True
+    )
+    assert features == (10, 30)
+    assert nr_old == 0
+    assert len(rows) == 0
+
+
+def test_reorder_empty(tmp_path):
+    store = EdgeStore(filepath=tmp_path.joinpath("edges.npz"), settings={}).load()
+    features, keys, nr_old, rows, cols, old_scores = store.reorder((10,), ["w"])
+    assert features == (10,)
+    assert nr_old == 0
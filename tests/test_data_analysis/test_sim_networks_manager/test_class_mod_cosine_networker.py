@@ -10,6 +10,23 @@ def test_init_mod_cosine_networker_valid():
     assert isinstance(ModCosineNetworker(), ModCosineNetworker)
 
 
+def test_candidate_cutoff_valid():
+    settings = SpecSimNetworkCosineParameters(
+        **{
+            "activate_module": True,
+            "msms_min_frag_nr": 5,
+            "fragment_tol": 0.1,
+            "score_cutoff": 0.7,
+            "max_nr_links": 10,
+            "candidate_floor": 0.4,
+        }
+    )
+    assert ModCosineNetworker.candidate_cutoff(settings) == 0.7
+    settings.store_candidates = True
+    assert ModCosineNetworker.candidate_cutoff(settings) == 0.4
+    assert ModCosineNetworker.edge_settings(settings)["score_cutoff"] == 0.4
+
+
 @pytest.mark.slow
 def test_spec_sim_networking_valid(feature_instance):
     features = (12, 13)
@@ -44,3 +61,94 @@ def test_create_network_valid(feature_instance):
         features, feature_instance, settings
     )
     assert ModCosineNetworker().create_network(scores, settings) is not None
+
+
+@pytest.mark.slow
+def test_create_network_numpy_backend_valid(feature_instance):
+    features = (12, 13)
+    params = {
+        "activate_module": True,
+        "msms_min_frag_nr": 5,
+        "fragment_tol": 0.1,
+        "score_cutoff": 0.1,
+        "max_nr_links": 10,
+    }
+    networks = []
+    for backend in ("matchms", "numpy"):
+        settings = SpecSimNetworkCosineParameters(**params, backend=backend)
+        scores = ModCosineNetworker().spec_sim_networking(
+            features, feature_instance, settings
+        )
+        networks.append(ModCosineNetworker().create_network(scores, settings))
+    assert sorted(networks[0].to_networkx().edges(data=True)) == sorted(
+        networks[1].to_networkx().edges(data=True)
+    )
+
+
+def test_create_tiles_valid():
+    tiles = ModCosineNetworker.create_tiles(5, 2)
+    assert tiles == [
+        (0, 2, 0, 2),
+        (0, 2, 2, 4),
+        (0, 2, 4, 5),
+        (2, 4, 2, 4),
+        (2, 4, 4, 5),
+        (4, 5, 4, 5),
+    ]
+
+
+def test_create_tiles_nr_old_valid():
+    tiles = ModCosineNetworker.create_tiles(5, 2, 3)
+    assert tiles == [
+        (0, 2, 3, 5),
+        (2, 3, 3, 5),
+        (3, 5, 3, 5),
+    ]
+
+
+@pytest.mark.slow
+def test_create_network_tiled_valid(feature_instance):
+    features = (12, 13, 14, 15, 16)
+    params = {
+        "activate_module": True,
+        "msms_min_frag_nr": 5,
+        "fragment_tol": 0.1,
+        "score_cutoff": 0.1,
+        "max_nr_links": 10,
+        "backend": "numpy",
+    }
+    networks = []
+    for nr_workers in (1, 2):
+        settings = SpecSimNetworkCosineParameters(
+            **params, nr_workers=nr_workers, tile_size=2
+        )
+        scores = ModCosineNetworker().spec_sim_networking(
+            features, feature_instance, settings
+        )
+        networks.append(ModCosineNetworker().create_network(scores, settings))
+    assert sorted(networks[0].to_networkx().edges(data=True)) == sorted(
+        networks[1].to_networkx().edges(data=True)
+    )
+
+
+@pytest.mark.slow
+def test_create_network_prescreen_valid(feature_instance):
+    features = (12, 13, 14, 15, 16)
+    params = {
+        "activate_module": True,
+        "msms_min_frag_nr": 5,
+        "fragment_tol": 0.1,
+        "score_cutoff": 0.1,
+        "max_nr_links": 10,
+        "backend": "numpy",
+    }
+    networks = []
+    for prescreen in (False, True):
+        settings = SpecSimNetworkCosineParameters(**params, prescreen=prescreen)
+        scores = ModCosineNetworker().spec_sim_networking(
+            features, feature_instance, settings
+        )
+        networks.append(ModCosineNetworker().create_network(scores, settings))
+    assert sorted(networks[0].to_networkx().edges(data=True)) == sorted(
+        networks[1].to_networkx().edges(data=True)
+    )
@@ -1,3 +1,4 @@
+import numpy as np
 import pytest
 
 from fermo_core.data_analysis.sim_networks_manager.class_ms2deepscore_networker import (
@@ -42,3 +43,12 @@ def test_create_network_valid(feature_instance):
         features, feature_instance, settings
     )
     assert Ms2deepscoreNetworker().create_network(scores, settings) is not None
+
+
+def test_top_links_valid():
+    vectors = np.array(
+        [[1.0, 0.0], [0.8, 0.6], [0.6, 0.8], [0.0, 1.0]], dtype=np.float32
+    )
+    rows, cols, scores = Ms2deepscoreNetworker.top_links(vectors, 1, 2, 1)
+    assert list(zip(rows.tolist(), cols.tolist())) == [(1, 2), (2, 1)]
+    assert scores.dtype == np.float32
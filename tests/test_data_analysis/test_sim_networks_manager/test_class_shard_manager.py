@@ -0,0 +1,123 @@
+import matchms
+import numpy as np
+import pytest
+
+from fermo_core.data_analysis.sim_networks_manager.class_mod_cosine_networker import (
+    ModCosineNetworker,
+)
+from fermo_core.data_analysis.sim_networks_manager.class_ms2deepscore_networker import (
+    Ms2deepscoreNetworker,
+)
+from fermo_core.data_analysis.sim_networks_manager.class_shard_manager import (
+    ShardManager,
+)
+from fermo_core.input_output.param_handlers import (
+    SpecSimNetworkCosineParameters,
+    SpecSimNetworkDeepscoreParameters,
+)
+
+
+@pytest.fixture
+def spectra():
+    rng = np.random.default_rng(0)
+    base = [np.sort(rng.uniform(50, 400, 8)).round(2) for _ in range(3)]
+    return [
+        matchms.Spectrum(
+            mz=base[i % 3] + 0.001 * i,
+            intensities=rng.uniform(0.1, 1, 8),
+            metadata={"id": i, "precursor_mz": 500.0 + i},
+            metadata_harmonization=False,
+        )
+        for i in range(12)
+    ]
+
+
+def test_create_blocks_valid():
+    settings = SpecSimNetworkDeepscoreParameters(
+        activate_module=True, msms_min_frag_nr=1, score_cutoff=0.5, max_nr_links=2
+    )
+    blocks = ShardManager.create_blocks("ms2deepscore", 10, settings, 4)
+    assert len(blocks) == 4
+    assert sorted(tile[0] for block in blocks for tile in block) == [0, 3, 6, 9]
+
+
+def test_cosine_round_trip_valid(spectra, tmp_path):
+    settings = SpecSimNetworkCosineParameters(
+        activate_module=True,
+        msms_min_frag_nr=1,
+        fragment_tol=0.1,
+        score_cutoff=0.7,
+        max_nr_links=10,
+        tile_size=4,
+    )
+    edge_settings = ModCosineNetworker.edge_settings(settings)
+    manager = ShardManager(directory_path=tmp_path)
+    manager.plan(spectra, settings, edge_settings, 3)
+    for nr in range(len(manager.load_manifest()["blocks"])):
+        ShardManager(directory_path=tmp_path).work(nr)
+    scores = manager.merge(manager.load_manifest()["keys"], edge_settings)
+
+    direct = ModCosineNetworker.score_block(spectra, settings, (0, 12, 0, 12))
+    assert sorted(zip(scores.rows.tolist(), scores.cols.tolist())) == sorted(
+        zip(direct[0].tolist(), direct[1].tolist())
+    )
+    assert scores.ids == list(range(12))
+    assert len(scores.rows) != 0
+
+
+def test_deepscore_round_trip_valid(spectra, tmp_path):
+    settings = SpecSimNetworkDeepscoreParameters(
+        activate_module=True, msms_min_frag_nr=1, score_cutoff=0.5, max_nr_links=2
+    )
+    edge_settings = Ms2deepscoreNetworker.edge_settings(settings)
+    vectors = np.random.default_rng(1).normal(size=(12, 4)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    manager = ShardManager(directory_path=tmp_path)
+    manager.plan(spectra, settings, edge_settings, 5, vectors)
+    manager.work()
+    scores = manager.merge(manager.load_manifest()["keys"], edge_settings)
+
+    direct = Ms2deepscoreNetworker.top_links(vectors, 0, 12, 2)
+    keep = direct[2] >= 0.5
+    assert set(zip(scores.rows.tolist(), scores.cols.tolist())) == {
+        (min(r, c), max(r, c)) for r, c in zip(direct[0][keep], direct[1][keep])
+    }
+
+
+def test_merge_missing_shards(spectra, tmp_path):
+    settings = SpecSimNetworkCosineParameters(
+        activate_module=True,
+        msms_min_frag_nr=1,
+        fragment_tol=0.1,
+        score_cutoff=0.7,
+        max_nr_links=10,
+        tile_size=4,
+    )
+    edge_settings = ModCosineNetworker.edge_settings(settings)
+    manager = ShardManager(directory_path=tmp_path)
+    manager.plan(spectra, settings, edge_settings, 3)
+    manager.work(0)
+    with pytest.raises(RuntimeError):
+        manager.merge(manager.load_manifest()["keys"], edge_settings)
+
+
+def test_merge_other_spectra(spectra, tmp_path):
+    settings = SpecSimNetworkCosineParameters(
+        activate_module=True,
+        msms_min_frag_nr=1,
+        fragment_tol=0.1,
+        score_cutoff=0.7,
+        max_nr_links=10,
+        tile_size=4,
+    )
+    edge_settings = ModCosineNetworker.edge_settings(settings)
+    manager = ShardManager(directory_path=tmp_path)
+    manager.plan(spectra, settings, edge_settings, 3)
+    manager.work()
+    with pytest.raises(RuntimeError):
+        manager.merge(manager.load_manifest()["keys"][1:], edge_settings)
+
+
+def test_work_no_manifest(tmp_path):
+    with pytest.raises(RuntimeError):
+        ShardManager(directory_path=tmp_path).work()
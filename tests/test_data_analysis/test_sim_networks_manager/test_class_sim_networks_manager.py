@@ -1,3 +1,4 @@
+import matchms
 import numpy as np
 import pytest
 
@@ -10,6 +11,13 @@ from fermo_core.data_analysis.sim_networks_manager.class_ms2deepscore_networker
 from fermo_core.data_analysis.sim_networks_manager.class_sim_networks_manager import (
     SimNetworksManager,
 )
+from fermo_core.data_processing.builder_feature.dataclass_feature import Feature
+from fermo_core.data_processing.class_repository import Repository
+from fermo_core.input_output.param_handlers import (
+    SpecSimNetworkDeepscoreParameters,
+    SpectrumDeduplicationParameters,
+)
+from fermo_core.utils.class_sparse_scores import SparseScores
 
 
 @pytest.fixture
@@ -65,6 +73,163 @@ def test_run_analysis_valid(sim_networks_manager_instance):
     assert sim_networks_manager_instance.features.get(12).networks is not None
 
 
+@pytest.mark.slow
+def test_run_concurrently_valid(sim_networks_manager_instance):
+    sim_networks_manager_instance.run_concurrently()
+    assert "modified_cosine" in sim_networks_manager_instance.stats.networks
+    assert sim_networks_manager_instance.features.get(12).networks is not None
+
+
+@pytest.mark.slow
+def test_score_features_incremental_valid(sim_networks_manager_instance, tmp_path):
+    params = sim_networks_manager_instance.params
+    params.OutputParameters.directory_path = tmp_path
+    params.SpecSimNetworkCosineParameters.incremental = True
+    for features in ((12, 13), (12, 13, 14)):
+        scores = sim_networks_manager_instance.score_features(
+            ModCosineNetworker(), features, params.SpecSimNetworkCosineParameters
+        )
+    assert scores.ids == [12, 13, 14]
+    assert tmp_path.joinpath("out.fermo.modified_cosine.edges.npz").exists()
+
+
+@pytest.mark.slow
+def test_score_features_deduplicated_valid(sim_networks_manager_instance):
+    params = sim_networks_manager_instance.params
+    features = tuple(
+        sim_networks_manager_instance.filter_input_spectra(
+            tuple(sim_networks_manager_instance.stats.active_features),
+            sim_networks_manager_instance.features,
+            1,
+            "modified_cosine",
+        )["included"]
+    )
+    direct = sim_networks_manager_instance.score_features(
+        ModCosineNetworker(), features, params.SpecSimNetworkCosineParameters
+    )
+    params.SpectrumDeduplicationParameters = SpectrumDeduplicationParameters(
+        activate_module=True
+    )
+    scores = sim_networks_manager_instance.score_features(
+        ModCosineNetworker(), features, params.SpecSimNetworkCosineParameters
+    )
+    assert not params.SpectrumDeduplicationParameters.module_passed
+    assert scores.ids == direct.ids
+    assert sorted(zip(scores.rows.tolist(), scores.cols.tolist())) == sorted(
+        zip(direct.rows.tolist(), direct.cols.tolist())
+    )
+
+
+def test_rethreshold_valid(sim_networks_manager_instance, tmp_path):
+    params = sim_networks_manager_instance.params
+    params.OutputParameters.directory_path = tmp_path
+    params.SpecSimNetworkCosineParameters.store_candidates = True
+    params.SpecSimNetworkCosineParameters.candidate_floor = 0.5
+    scores = SparseScores(ids=[12, 13, 14], score_cutoff=0.5)
+    scores.append(np.array([0, 1]), np.array([1, 2]), np.array([0.6, 0.9]))
+    sim_networks_manager_instance.save_candidates(scores.finalize())
+
+    sim_networks_manager_instance.rethreshold(0.55, 5)
+    network = sim_networks_manager_instance.stats.networks["modified_cosine"]
+    assert len(network.summary) == 1
+    sim_networks_manager_instance.rethreshold(0.8, 5)
+    network = sim_networks_manager_instance.stats.networks["modified_cosine"]
+    assert sorted(map(sorted, network.summary.values())) == [[12], [13, 14]]
+    assert params.SpecSimNetworkCosineParameters.score_cutoff == 0.8
+    assert (
+        sim_networks_manager_instance.features.get(12)
+        .networks["modified_cosine"]
+        .network_id
+        == network.feature_clusters()[12]
+    )
+
+
+def test_rethreshold_invalid(sim_networks_manager_instance, tmp_path):
+    params = sim_networks_manager_instance.params
+    params.OutputParameters.directory_path = tmp_path
+    with pytest.raises(RuntimeError):
+        sim_networks_manager_instance.rethreshold(0.8, 5)
+
+
+def test_score_representatives_incremental_removed_valid(
+    sim_networks_manager_instance, tmp_path, monkeypatch
+):
+    angles = {1: 0, 2: 10, 3: 30, 4: 120}
+    repo = Repository()
+    for f_id in angles:
+        repo.add(
+            f_id,
+            Feature(
+                f_id=f_id,
+                Spectrum=matchms.Spectrum(
+                    mz=np.array([100.0 + f_id]),
+                    intensities=np.array([1.0]),
+                    metadata={"id": f_id, "precursor_mz": 200.0},
+                    metadata_harmonization=False,
+                ),
+            ),
+        )
+    monkeypatch.setattr(
+        Ms2deepscoreNetworker,
+        "embed",
+        staticmethod(
+            lambda spectra, settings: np.array(
+                [
+                    [np.cos(np.radians(a)), np.sin(np.radians(a))]
+                    for a in (angles[s.get("id")] for s in spectra)
+                ],
+                dtype=np.float32,
+            )
+        ),
+    )
+    sim_networks_manager_instance.features = repo
+    sim_networks_manager_instance.params.OutputParameters.directory_path = tmp_path
+    settings = SpecSimNetworkDeepscoreParameters(
+        activate_module=True,
+        msms_min_frag_nr=1,
+        score_cutoff=0.1,
+        max_nr_links=1,
+        incremental=True,
+    )
+
+    def links(features):
+        scores = sim_networks_manager_instance.score_representatives(
+            Ms2deepscoreNetworker(), features, settings
+        )
+        network = Ms2deepscoreNetworker.create_network(scores, settings)
+        ids = np.array(network.ids)
+        return sorted(
+            tuple(sorted(pair))
+            for pair in zip(ids[network.rows].tolist(), ids[network.cols].tolist())
+        )
+
+    links((1, 2, 3))
+    incremental = links((1, 3, 4))
+    settings.incremental = False
+    assert incremental == links((1, 3, 4)) == [(1, 3)]
+
+
+def test_store_ms2deepscore_none_valid(sim_networks_manager_instance):
+    sim_networks_manager_instance.store_ms2deepscore(None)
+    assert sim_networks_manager_instance.stats.networks is None
+
+
+def test_store_modified_cosine_deduplication_passed_valid(
+    sim_networks_manager_instance,
+):
+    params = sim_networks_manager_instance.params
+    params.SpectrumDeduplicationParameters = SpectrumDeduplicationParameters(
+        activate_module=True
+    )
+    sim_networks_manager_instance.store_modified_cosine(None)
+    assert not params.SpectrumDeduplicationParameters.module_passed
+    sim_networks_manager_instance.store_modified_cosine(
+        ({"graph": "foo", "summary": {0: {12, 13}}}, (12, 13))
+    )
+    assert params.SpecSimNetworkCosineParameters.module_passed
+    assert params.SpectrumDeduplicationParameters.module_passed
+
+
 @pytest.mark.slow
 def test_run_modified_cosine_alg_valid(sim_networks_manager_instance):
     sim_networks_manager_instance.run_modified_cosine_alg()
@@ -148,8 +313,7 @@ def test_format_network_for_storage_ms2deep_valid(
 def test_store_network_data_valid(sim_networks_manager_instance):
     network_name = "foo"
     network_data = {
-        "network": "foo",
-        "subnetworks": {0: "bar"},
+        "graph": "foo",
         "summary": {0: {12, 13}},
     }
     included = tuple([12, 13])
@@ -157,3 +321,6 @@ def test_store_network_data_valid(sim_networks_manager_instance):
         network_name=network_name, network_data=network_data, features=included
     )
     assert sim_networks_manager_instance.stats.networks is not None
+    assert (
+        sim_networks_manager_instance.features.get(13).networks["foo"].network_id == 0
+    )
@@ -1,8 +1,11 @@
-import networkx
+import numpy as np
 import pandas as pd
 from pydantic import ValidationError
 import pytest
 
+from fermo_core.data_analysis.sim_networks_manager.class_array_network import (
+    ArrayNetwork,
+)
 from fermo_core.data_processing.class_stats import (
     Stats,
     SpecSimNet,
@@ -54,27 +57,52 @@ def test_success_parse_mzmine3(stats):
     assert len(stats.samples) == 11
 
 
+def array_network():
+    return ArrayNetwork(
+        ids=[1, 2, 3],
+        rows=np.array([0, 1]),
+        cols=np.array([1, 2]),
+        weights=np.array([0.9, 0.8]),
+        labels=np.array([0, 0, 0]),
+    )
+
+
 def test_init_spec_sim_net_valid():
     entry = SpecSimNet(
         algorithm="xyz",
-        network=networkx.Graph(),
-        subnetworks={1: networkx.Graph()},
+        graph=array_network(),
         summary={1: {1, 2, 3}},
     )
     assert isinstance(entry, SpecSimNet)
 
 
+def test_feature_clusters_valid():
+    entry = SpecSimNet(
+        algorithm="xyz",
+        graph=None,
+        summary={1: {1, 2}, 2: {3}},
+    )
+    assert entry.feature_clusters() == {1: 1, 2: 1, 3: 2}
+    assert entry.membership is not None
+
+
 def test_specsimnet_to_json_valid():
     stats = Stats()
     stats.networks = {
         "xyz": SpecSimNet(
             algorithm="xyz",
-            network=networkx.Graph(),
-            subnetworks={1: networkx.Graph()},
-            summary={1: {1, 2, 3}},
+            graph=array_network(),
+            summary={0: {1, 2, 3}},
         )
     }
-    assert stats.networks["xyz"].to_json() is not None
+    json_dict = stats.networks["xyz"].to_json()
+    assert json_dict["subnetworks"][0]["data"] == [("name", 0)]
+    assert len(json_dict["subnetworks"][0]["elements"]["edges"]) == 2
+
+
+def test_specsimnet_network_valid():
+    entry = SpecSimNet(algorithm="xyz", graph=array_network(), summary={0: {1, 2, 3}})
+    assert list(entry.network().edges) == [(1, 2), (2, 3)]
 
 
 def test_init_spec_sim_net_invalid():
@@ -102,9 +130,8 @@ def test_to_json_networks_valid():
     stats.networks = {
         "xyz": SpecSimNet(
             algorithm="xyz",
-            network=networkx.Graph(),
-            subnetworks={1: networkx.Graph()},
-            summary={1: {1, 2, 3}},
+            graph=array_network(),
+            summary={0: {1, 2, 3}},
         )
     }
     json_dict = stats.to_json()
@@ -22,6 +22,34 @@ def test_run_argparse_invalid():
     assert e.value.code == 2
 
 
+def test_run_argparse_shard_work_valid():
+    args = ArgparseManager().run_argparse(
+        "version", ["--shard_work", "shards/manifest.json", "--shard_block", "2"]
+    )
+    assert args.parameters is None
+    assert args.shard_block == 2
+
+
+def test_run_argparse_rethreshold_valid():
+    args = ArgparseManager().run_argparse(
+        "version",
+        ["--rethreshold", "results/out.fermo.session.json", "--score_cutoff", "0.8"],
+    )
+    assert args.parameters is None
+    assert args.score_cutoff == 0.8
+    assert args.max_nr_links is None
+
+
+def test_run_argparse_precompute_embeddings_valid():
+    args = ArgparseManager().run_argparse(
+        "version",
+        ["--precompute_embeddings", "mibig", "--embedding_backend", "numpy"],
+    )
+    assert args.parameters is None
+    assert args.precompute_embeddings == "mibig"
+    assert args.embedding_backend == "numpy"
+
+
 def test_define_argparse_args_valid():
     assert isinstance(
         ArgparseManager().define_argparse_args("version"), argparse.ArgumentParser
@@ -442,6 +442,30 @@ def test_assign_as_kcb_matching_deepscore_invalid():
     assert params.AsKcbDeepscoreMatchingParams is None
 
 
+def test_assign_spectrum_deduplication_valid():
+    params = ParameterManager()
+    params.assign_spectrum_deduplication({"activate_module": True})
+    assert params.SpectrumDeduplicationParameters.min_cosine == 1.0
+
+
+def test_assign_spectrum_deduplication_invalid():
+    params = ParameterManager()
+    params.assign_spectrum_deduplication({"min_cosine": "asdfg"})
+    assert params.SpectrumDeduplicationParameters is None
+
+
+def test_assign_shard_networking_valid(tmp_path):
+    params = ParameterManager()
+    params.assign_shard_networking({"directory_path": tmp_path, "step": "merge"})
+    assert params.ShardNetworkingParameters.step == "merge"
+
+
+def test_assign_shard_networking_invalid(tmp_path):
+    params = ParameterManager()
+    with pytest.raises(ValueError):
+        params.assign_shard_networking({"directory_path": tmp_path, "step": "asdf"})
+
+
 def test_assign_parameters_cli_valid():
     json_in = FileManager.load_json_file("tests/test_data/test.parameters.json")
     params = ParameterManager()
@@ -0,0 +1,109 @@
+import json
+
+import numpy as np
+import pytest
+
+from fermo_core.data_analysis.sim_networks_manager.class_edge_store import EdgeStore
+from fermo_core.data_analysis.sim_networks_manager.class_mod_cosine_networker import (
+    ModCosineNetworker,
+)
+from fermo_core.input_output.class_session_rethresholder import (
+    SessionRethresholder,
+)
+from fermo_core.input_output.param_handlers import SpecSimNetworkCosineParameters
+from fermo_core.utils.class_sparse_scores import SparseScores
+
+
+@pytest.fixture
+def session_path(tmp_path):
+    settings = SpecSimNetworkCosineParameters(
+        **{
+            "activate_module": True,
+            "msms_min_frag_nr": 5,
+            "fragment_tol": 0.1,
+            "score_cutoff": 0.7,
+            "max_nr_links": 10,
+            "store_candidates": True,
+        }
+    )
+    session = {
+        "parameters": {"SpecSimNetworkCosineParameters": settings.to_json()},
+        "stats": {
+            "samples": ["s1", "s2"],
+            "active_features": [1, 2, 3],
+            "networks": {
+                "modified_cosine": {
+                    "algorithm": "modified_cosine",
+                    "subnetworks": {},
+                    "summary": {"0": [1, 2], "1": [3]},
+                }
+            },
+        },
+        "general_features": {
+            str(f_id): {"networks": {}, "scores": {}} for f_id in (1, 2, 3)
+        },
+        "samples": {
+            "s1": {"feature_ids": [1, 2], "networks": {}, "scores": {}},
+            "s2": {"feature_ids": [3], "networks": {}, "scores": {}},
+        },
+    }
+    path = tmp_path.joinpath("out.fermo.session.json")
+    path.write_text(json.dumps(session))
+
+    scores = SparseScores(ids=[1, 2, 3], score_cutoff=0.5)
+    scores.append(np.array([0, 1]), np.array([1, 2]), np.array([0.8, 0.6]))
+    EdgeStore(
+        filepath=tmp_path.joinpath("out.fermo.modified_cosine.candidates.npz"),
+        settings=ModCosineNetworker.edge_settings(settings),
+    ).save(["1", "2", "3"], scores.finalize())
+    return path
+
+
+def test_run_valid(session_path):
+    SessionRethresholder(session_path=session_path).run(0.55)
+    session = json.loads(session_path.read_text())
+    network = session["stats"]["networks"]["modified_cosine"]
+    assert network["summary"] == {"0": [1, 2, 3]}
+    assert session["general_features"]["3"]["networks"]["modified_cosine"] == {
+        "algorithm": "modified_cosine",
+        "network_id": 0,
+    }
+    assert session["samples"]["s1"]["scores"]["specificity"] == 0
+    assert (
+        session["parameters"]["SpecSimNetworkCosineParameters"]["score_cutoff"] == 0.55
+    )
+    assert session_path.parent.joinpath("out.fermo.modified_cosine.graphml").exists()
+
+
+def test_run_summary_valid(session_path):
+    path_summary = session_path.parent.joinpath("out.fermo.summary.txt")
+    path_summary.write_text(
+        "First line.\n"
+        "MS/MS spectra of all molecular features with more than '5' fragment ions "
+        "were compared pairwise and scored using the 'modified cosine' algorithm, "
+        "with a fragment tolerance of '0.1'. From the resulting similarity matrix, a "
+        "network was created, with features represented as nodes and the similarity "
+        "value as edges. Edges were pruned if their score was below a similarity "
+        "cutoff of '0.7'. Also, edges were pruned so that only the '10' highest "
+        "scoring edges remained.\n"
+        "Last line."
+    )
+    SessionRethresholder(session_path=session_path).run(0.55, 5)
+    summary = path_summary.read_text().split("\n")
+    assert len(summary) == 3
+    assert summary[0] == "First line."
+    assert "cutoff of '0.55'" in summary[1]
+    assert "only the '5' highest" in summary[1]
+    assert summary[2] == "Last line."
+
+
+def test_run_candidates_invalid(session_path):
+    with pytest.raises(RuntimeError):
+        SessionRethresholder(session_path=session_path).run(0.4)
+
+
+def test_load_session_invalid(tmp_path):
+    with pytest.raises(RuntimeError):
+        SessionRethresholder(
+            session_path=tmp_path.joinpath("out.fermo.session.json")
+        ).load_session()
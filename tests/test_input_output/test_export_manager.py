@@ -3,10 +3,13 @@ import os
 from datetime import datetime
 from pathlib import Path
 
-import networkx as nx
+import numpy as np
 import pandas as pd
 import pytest
 
+from fermo_core.data_analysis.sim_networks_manager.class_array_network import (
+    ArrayNetwork,
+)
 from fermo_core.data_processing.builder_feature.dataclass_feature import (
     Adduct,
     Annotations,
@@ -125,9 +128,14 @@ def csv_exporter():
     csv_exporter.stats.networks = {
         "abc": SpecSimNet(
             algorithm="abc",
-            subnetworks={},
+            graph=ArrayNetwork(
+                ids=[],
+                rows=np.zeros(0, int),
+                cols=np.zeros(0, int),
+                weights=np.zeros(0),
+                labels=np.zeros(0, int),
+            ),
             summary={0: set()},
-            network=nx.Graph(),
         )
     }
     csv_exporter.stats.GroupMData.ctgrs = {"abcde": {"a": "b"}}
@@ -223,9 +231,14 @@ def test_write_cytoscape_output_valid(real_data_export):
     real_data_export.stats.networks = {
         "xyz": SpecSimNet(
             algorithm="xyz",
-            subnetworks={},
+            graph=ArrayNetwork(
+                ids=[],
+                rows=np.zeros(0, int),
+                cols=np.zeros(0, int),
+                weights=np.zeros(0),
+                labels=np.zeros(0, int),
+            ),
             summary={1: set()},
-            network=nx.Graph(),
         )
     }
     assert real_data_export.write_cytoscape_output() is None
@@ -23,11 +23,13 @@ from fermo_core.input_output.param_handlers import (
     PhenoQuantConcAssgnParams,
     PhenoQuantPercentAssgnParams,
     PhenotypeParameters,
+    ShardNetworkingParameters,
     SpecLibParameters,
     SpecSimNetworkCosineParameters,
     SpecSimNetworkDeepscoreParameters,
     SpectralLibMatchingCosineParameters,
     SpectralLibMatchingDeepscoreParameters,
+    SpectrumDeduplicationParameters,
 )
 
 
@@ -278,6 +280,35 @@ def test_init_spec_lib_matching_cosine_parameters_valid():
         SpectralLibMatchingCosineParameters,
     )
     assert i.to_json().get("fragment_tol") == 0.1
+    assert i.to_json().get("max_nr_matches") is None
+
+
+def test_init_spec_lib_matching_cosine_parameters_max_nr_matches_fail():
+    with pytest.raises(ValidationError):
+        SpectralLibMatchingCosineParameters(
+            **{
+                "activate_module": True,
+                "fragment_tol": 0.1,
+                "min_nr_matched_peaks": 5,
+                "score_cutoff": 0.7,
+                "max_precursor_mass_diff": 600,
+                "max_nr_matches": 0,
+            }
+        )
+
+
+def test_init_spec_lib_matching_cosine_parameters_backend_fail():
+    with pytest.raises(ValidationError):
+        SpectralLibMatchingCosineParameters(
+            **{
+                "activate_module": True,
+                "fragment_tol": 0.1,
+                "min_nr_matched_peaks": 5,
+                "score_cutoff": 0.7,
+                "max_precursor_mass_diff": 600,
+                "backend": "asdf",
+            }
+        )
 
 
 def test_init_spec_lib_matching_cosine_parameters_fail():
@@ -294,6 +325,20 @@ def test_init_spec_lib_matching_deepscore_parameters_valid():
         SpectralLibMatchingDeepscoreParameters,
     )
     assert i.to_json().get("score_cutoff") == 0.8
+    assert i.to_json().get("search") == "exact"
+    assert i.to_json().get("nr_probe") == 8
+
+
+def test_init_spec_lib_matching_deepscore_parameters_search_fail():
+    with pytest.raises(ValidationError):
+        SpectralLibMatchingDeepscoreParameters(
+            **{
+                "activate_module": True,
+                "score_cutoff": 0.8,
+                "max_precursor_mass_diff": 600,
+                "search": "asdf",
+            }
+        )
 
 
 def test_init_spec_lib_matching_deepscore_parameters_fail():
@@ -365,6 +410,51 @@ def test_init_spec_sim_network_cosine_parameters_fail():
         SpecSimNetworkCosineParameters(None)
 
 
+def test_init_spec_sim_network_cosine_parameters_prescreen_valid():
+    i = SpecSimNetworkCosineParameters(
+        **{
+            "activate_module": True,
+            "msms_min_frag_nr": 5,
+            "fragment_tol": 0.1,
+            "score_cutoff": 0.7,
+            "max_nr_links": 10,
+            "prescreen": False,
+        }
+    )
+    assert i.to_json().get("prescreen") is False
+    assert i.to_json().get("incremental") is False
+
+
+def test_init_spec_sim_network_cosine_parameters_candidates_valid():
+    i = SpecSimNetworkCosineParameters(
+        **{
+            "activate_module": True,
+            "msms_min_frag_nr": 5,
+            "fragment_tol": 0.1,
+            "score_cutoff": 0.7,
+            "max_nr_links": 10,
+            "store_candidates": True,
+            "candidate_floor": 0.4,
+        }
+    )
+    assert i.to_json().get("store_candidates") is True
+    assert i.to_json().get("candidate_floor") == 0.4
+
+
+def test_init_spec_sim_network_cosine_parameters_candidates_fail():
+    with pytest.raises(ValueError):
+        SpecSimNetworkCosineParameters(
+            **{
+                "activate_module": True,
+                "msms_min_frag_nr": 5,
+                "fragment_tol": 0.1,
+                "score_cutoff": 0.7,
+                "max_nr_links": 10,
+                "candidate_floor": 1.5,
+            }
+        )
+
+
 def test_init_spec_sim_network_deepscore_parameters_valid():
     i = SpecSimNetworkDeepscoreParameters(
         **{
@@ -379,6 +469,47 @@ def test_init_spec_sim_network_deepscore_parameters_valid():
         SpecSimNetworkDeepscoreParameters,
     )
     assert i.to_json().get("score_cutoff") == 0.7
+    assert i.to_json().get("backend") == "keras"
+
+
+def test_init_spec_sim_network_deepscore_parameters_concurrent_valid():
+    i = SpecSimNetworkDeepscoreParameters(
+        **{
+            "activate_module": True,
+            "msms_min_frag_nr": 5,
+            "score_cutoff": 0.7,
+            "max_nr_links": 10,
+            "concurrent": False,
+        }
+    )
+    assert i.to_json().get("concurrent") is False
+
+
+def test_init_spec_sim_network_deepscore_parameters_backend_fail():
+    with pytest.raises(ValidationError):
+        SpecSimNetworkDeepscoreParameters(
+            **{
+                "activate_module": True,
+                "msms_min_frag_nr": 5,
+                "score_cutoff": 0.7,
+                "max_nr_links": 10,
+                "backend": "asdf",
+            }
+        )
+
+
+def test_init_spec_sim_network_deepscore_parameters_nr_threads_fail():
+    with pytest.raises(ValidationError):
+        SpecSimNetworkDeepscoreParameters(
+            **{
+                "activate_module": True,
+                "msms_min_frag_nr": 5,
+                "score_cutoff": 0.7,
+                "max_nr_links": 10,
+                "batch_size": 64,
+                "nr_threads": -1,
+            }
+        )
 
 
 def test_init_spec_sim_network_deepscore_parameters_fail():
@@ -565,3 +696,26 @@ def test_test_outputparams_fail():
         OutputParameters(directory_path=Path("dgsdgfsdfgs/"))
     with pytest.raises(ValidationError):
         OutputParameters()
+
+
+def test_shard_networking_parameters_valid(tmp_path):
+    i = ShardNetworkingParameters(
+        directory_path=tmp_path.joinpath("shards"), step="plan"
+    )
+    assert i.directory_path.exists()
+    assert i.to_json().get("nr_blocks") == 100
+
+
+def test_shard_networking_parameters_fail(tmp_path):
+    with pytest.raises(ValueError):
+        ShardNetworkingParameters(directory_path=tmp_path, step="work")
+
+
+def test_spectrum_deduplication_parameters_valid():
+    i = SpectrumDeduplicationParameters(activate_module=True, min_cosine=0.99)
+    assert i.to_json().get("min_cosine") == 0.99
+
+
+def test_spectrum_deduplication_parameters_fail():
+    with pytest.raises(ValueError):
+        SpectrumDeduplicationParameters(activate_module=True, min_cosine=1.5)
@@ -0,0 +1,82 @@
+from pathlib import Path
+
+import matchms
+import numpy as np
+import pytest
+from matchms.importing import load_from_mgf
+
+from fermo_core.utils.class_batched_mod_cosine import (
+    BatchedModifiedCosine,
+    PeakStore,
+)
+
+
+@pytest.fixture
+def spectra():
+    return [
+        matchms.Spectrum(
+            mz=np.array([10, 40, 60, 80, 100], dtype=float),
+            intensities=np.array([10, 20, 100, 15, 55], dtype=float),
+            metadata={"precursor_mz": 100.0},
+        ),
+        matchms.Spectrum(
+            mz=np.array([10, 45, 60], dtype=float),
+            intensities=np.array([10, 30, 100], dtype=float),
+            metadata={"precursor_mz": 105.0},
+        ),
+        matchms.Spectrum(
+            mz=np.array([500, 600], dtype=float),
+            intensities=np.array([10, 30], dtype=float),
+            metadata={"precursor_mz": 700.0},
+        ),
+    ]
+
+
+def test_peak_store_valid(spectra):
+    store = PeakStore(spectra)
+    assert list(store.offsets) == [0, 5, 8, 10]
+    assert store.precursor[1] == 105.0
+
+
+def test_pair_identical(spectra):
+    score = BatchedModifiedCosine(tolerance=0.1).pair(spectra[0], spectra[0])
+    assert round(float(score["score"]), 6) == 1.0
+    assert int(score["matches"]) == 5
+
+
+def test_pair_shifted(spectra):
+    score = BatchedModifiedCosine(tolerance=0.1).pair(spectra[1], spectra[0])
+    assert int(score["matches"]) == 3
+
+
+def test_pair_no_match(spectra):
+    score = BatchedModifiedCosine(tolerance=0.1).pair(spectra[2], spectra[0])
+    assert float(score["score"]) == 0.0
+    assert int(score["matches"]) == 0
+
+
+def test_matrix_symmetric(spectra):
+    scores = BatchedModifiedCosine(tolerance=0.1).matrix(
+        spectra, spectra, is_symmetric=True
+    )
+    assert scores.shape == (3, 3)
+    assert np.array_equal(scores["score"], scores["score"].T)
+
+
+def test_matrix_invalid(spectra):
+    with pytest.raises(ValueError):
+        BatchedModifiedCosine(tolerance=0.1).matrix(spectra, spectra, array_type="asdf")
+
+
+@pytest.mark.slow
+def test_matrix_equals_matchms():
+    spectra = list(load_from_mgf(str(Path("tests/test_data/test.msms.mgf"))))[:40]
+    for tol in (0.01, 0.1, 1.0):
+        expected = matchms.similarity.ModifiedCosine(tolerance=tol).matrix(
+            spectra, spectra, is_symmetric=True
+        )
+        scores = BatchedModifiedCosine(tolerance=tol, batch_size=100).matrix(
+            spectra, spectra, is_symmetric=True
+        )
+        assert np.allclose(scores["score"], expected["score"], atol=1e-9)
+        assert np.array_equal(scores["matches"], expected["matches"])
@@ -0,0 +1,47 @@
+import matchms
+import numpy as np
+
+from fermo_core.utils.class_cosine_prescreen import CosinePrescreen
+
+
+def create_spectrum(mz: list, intensities: list, precursor_mz: float):
+    return matchms.Spectrum(
+        mz=np.array(mz, dtype=float),
+        intensities=np.array(intensities, dtype=float),
+        metadata={"precursor_mz": precursor_mz},
+        metadata_harmonization=False,
+    )
+
+
+def test_candidates_bound_valid():
+    rng = np.random.default_rng(0)
+    spectra = []
+    for _ in range(20):
+        mz = np.sort(rng.choice(np.arange(50, 300, 7.0), 6, replace=False))
+        mz = mz + rng.normal(0, 0.03, 6) + rng.choice([0, 14.0])
+        spectra.append(
+            create_spectrum(mz, rng.uniform(0.1, 1, 6), float(rng.uniform(300, 330)))
+        )
+    scores = matchms.similarity.ModifiedCosine(tolerance=0.1).matrix(
+        spectra, spectra, is_symmetric=True
+    )["score"]
+    prescreen = CosinePrescreen(tolerance=0.1).build(spectra)
+    bound = (prescreen.vectors @ prescreen.spread.T).toarray()
+    assert np.all(bound >= scores - 1e-9)
+
+    rows, cols = prescreen.candidates((0, 20, 0, 20), 0.5)
+    assert np.all(rows < cols)
+    expected = {(r, c) for r, c in zip(*np.nonzero(scores >= 0.5)) if r < c}
+    assert expected <= set(zip(rows.tolist(), cols.tolist()))
+
+
+def test_candidates_shifted_valid():
+    spectra = [
+        create_spectrum([100.0, 200.0], [1.0, 1.0], 300.0),
+        create_spectrum([150.0, 250.0], [1.0, 1.0], 350.0),
+        create_spectrum([400.0, 500.0], [1.0, 1.0], 700.0),
+    ]
+    rows, cols = (
+        CosinePrescreen(tolerance=0.1).build(spectra).candidates((0, 3, 0, 3), 0.7)
+    )
+    assert list(zip(rows.tolist(), cols.tolist())) == [(0, 1)]
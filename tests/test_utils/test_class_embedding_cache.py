@@ -0,0 +1,133 @@
+import logging
+
+import matchms
+import numpy as np
+import pytest
+
+from fermo_core.utils.class_embedding_cache import CachedMS2DeepScore, EmbeddingCache
+
+
+@pytest.fixture
+def spectra():
+    return [
+        matchms.Spectrum(
+            mz=np.array([10, 40, 60], dtype=float),
+            intensities=np.array([0.1, 0.2, 1.0], dtype=float),
+            metadata={"precursor_mz": 100.0},
+        ),
+        matchms.Spectrum(
+            mz=np.array([10, 45, 60], dtype=float),
+            intensities=np.array([0.1, 0.3, 1.0], dtype=float),
+            metadata={"precursor_mz": 105.0},
+        ),
+    ]
+
+
+class CountingEmbedder:
+    def __init__(self):
+        self.nr_embedded = 0
+
+    def __call__(self, spectra):
+        self.nr_embedded += len(spectra)
+        return np.array(
+            [[s.peaks.mz.sum(), s.peaks.intensities.sum()] for s in spectra]
+        )
+
+
+def test_spectrum_key_valid(spectra):
+    assert EmbeddingCache.spectrum_key(spectra[0]) != EmbeddingCache.spectrum_key(
+        spectra[1]
+    )
+    assert EmbeddingCache.spectrum_key(spectra[0]) == EmbeddingCache.spectrum_key(
+        spectra[0].clone()
+    )
+
+
+def test_get_vectors_memory(spectra):
+    cache = EmbeddingCache(file_hash="abc", dim=2)
+    embed = CountingEmbedder()
+    first = cache.get_vectors([*spectra, spectra[0]], embed)
+    second = cache.get_vectors(spectra, embed)
+    assert embed.nr_embedded == 2
+    assert np.array_equal(first[0], first[2])
+    assert np.array_equal(first[:2], second)
+
+
+def test_get_vectors_disk(spectra, tmp_path):
+    embed = CountingEmbedder()
+    first = EmbeddingCache(file_hash="abc", dim=2, cache_dir=tmp_path).get_vectors(
+        spectra, embed
+    )
+    second = EmbeddingCache(file_hash="abc", dim=2, cache_dir=tmp_path).get_vectors(
+        spectra, embed
+    )
+    assert embed.nr_embedded == 2
+    assert np.allclose(first, second)
+
+
+def test_get_vectors_disk_inconsistent(spectra, tmp_path):
+    embed = CountingEmbedder()
+    first = EmbeddingCache(file_hash="abc", dim=2, cache_dir=tmp_path).get_vectors(
+        spectra, embed
+    )
+    with open(tmp_path.joinpath("abc.vectors"), "ab") as outfile:
+        outfile.write(np.zeros(2, dtype=np.float32).tobytes())
+    cache = EmbeddingCache(file_hash="abc", dim=2, cache_dir=tmp_path)
+    second = cache.get_vectors(spectra, embed)
+    assert embed.nr_embedded == 4
+    assert np.allclose(first, second)
+    assert cache.read_disk() is not None
+    assert len(cache.disk_index) == 2
+
+
+def test_get_vectors_other_model(spectra, tmp_path):
+    embed = CountingEmbedder()
+    EmbeddingCache(file_hash="abc", dim=2, cache_dir=tmp_path).get_vectors(
+        spectra, embed
+    )
+    EmbeddingCache(file_hash="def", dim=2, cache_dir=tmp_path).get_vectors(
+        spectra, embed
+    )
+    assert embed.nr_embedded == 4
+
+
+def test_get_vectors_evict_oldest(spectra, tmp_path):
+    embed = CountingEmbedder()
+    EmbeddingCache(file_hash="abc", dim=2, cache_dir=tmp_path).get_vectors(
+        spectra, embed
+    )
+    size = sum(f.stat().st_size for f in tmp_path.glob("abc.*"))
+    cache = EmbeddingCache(
+        file_hash="def", dim=2, cache_dir=tmp_path, max_size=size + 1
+    )
+    cache.get_vectors(spectra, embed)
+    assert not tmp_path.joinpath("abc.vectors").exists()
+    assert not tmp_path.joinpath("abc.index").exists()
+    assert len(cache.disk_index) == 2
+
+
+def test_cached_ms2deepscore_numpy_valid(ms2deepscore_model_file, spectra):
+    sim_algorithm = CachedMS2DeepScore(
+        model_path=ms2deepscore_model_file, backend="numpy", persist=False
+    )
+    scores = sim_algorithm.matrix(spectra, spectra, is_symmetric=True)
+    assert sim_algorithm.cache.file_hash.endswith("-numpy")
+    assert scores.shape == (2, 2)
+    assert np.allclose(np.diag(scores), 1.0)
+    assert sim_algorithm.pair(spectra[0], spectra[1]) == pytest.approx(scores[0, 1])
+
+
+def test_infer_vectors_batch_size(ms2deepscore_model_file, spectra, caplog):
+    vectors = CachedMS2DeepScore(
+        model_path=ms2deepscore_model_file, backend="numpy", persist=False
+    ).infer_vectors(spectra)
+    with caplog.at_level(logging.INFO, logger="fermo_core"):
+        batched = CachedMS2DeepScore(
+            model_path=ms2deepscore_model_file,
+            backend="numpy",
+            batch_size=1,
+            nr_threads=1,
+            persist=False,
+        ).infer_vectors(spectra)
+    assert np.allclose(vectors, batched)
+    assert "embedded '2' spectra" in caplog.text
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from fermo_core.utils.class_ivf_index import IvfIndex
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(20, 16))
+    library = centers[rng.integers(0, 20, 400)] + 0.3 * rng.normal(size=(400, 16))
+    queries = centers[rng.integers(0, 20, 30)] + 0.3 * rng.normal(size=(30, 16))
+    return (
+        library / np.linalg.norm(library, axis=1, keepdims=True),
+        queries / np.linalg.norm(queries, axis=1, keepdims=True),
+    )
+
+
+def test_build_valid(vectors):
+    index = IvfIndex(key="abc").build(vectors[0], nr_lists=10)
+    assert len(index.centroids) == 10
+    assert index.offsets[-1] == 400
+    assert sorted(index.members) == list(range(400))
+
+
+def test_list_sums_empty_lists():
+    vectors = np.arange(12, dtype=np.float32).reshape(4, 3)
+    sums = IvfIndex.list_sums(vectors, np.array([1, 0, 1, 1]), 4)
+    assert np.array_equal(sums[0], vectors[1])
+    assert np.array_equal(sums[1], vectors[0] + vectors[2] + vectors[3])
+    assert not sums[2:].any()
+
+
+def test_search_all_lists_exact(vectors):
+    index = IvfIndex(key="abc").build(vectors[0], nr_lists=10)
+    query_idx, rows = index.search(vectors[0], vectors[1], k=5, nr_probe=10)
+    exact = np.argsort(-(vectors[1] @ vectors[0].T), axis=1)[:, :5]
+    assert np.array_equal(query_idx, np.repeat(np.arange(30), 5))
+    assert np.array_equal(rows, exact.ravel())
+
+
+def test_search_batches_valid(vectors):
+    index = IvfIndex(key="abc").build(vectors[0], nr_lists=10)
+    expected = index.search(vectors[0], vectors[1], k=5, nr_probe=2)
+    batched = index.search(vectors[0], vectors[1], k=5, nr_probe=2, batch_size=7)
+    assert np.array_equal(expected[0], batched[0])
+    assert np.array_equal(expected[1], batched[1])
+
+
+def test_benchmark_valid(vectors):
+    index = IvfIndex(key="abc").build(vectors[0], nr_lists=10)
+    results = index.benchmark(vectors[0], vectors[1], k=5, nr_probes=[1, 10])
+    assert results[0]["nr_probe"] == 0
+    assert results[1]["recall"] > 0.5
+    assert results[2]["recall"] == 1.0
+
+
+def test_save_load_valid(vectors, tmp_path):
+    path = tmp_path.joinpath("index.npz")
+    IvfIndex(key="abc").build(vectors[0], nr_lists=10).save(path)
+    assert IvfIndex(key="abc").load(path).centroids is not None
+    assert IvfIndex(key="def").load(path).centroids is None
+    assert [p.name for p in tmp_path.iterdir()] == ["index.npz"]
@@ -0,0 +1,89 @@
+import matchms
+import numpy as np
+import pytest
+
+from fermo_core.utils.class_library_embeddings import LibraryEmbeddings
+
+
+@pytest.fixture
+def spectra():
+    return [
+        matchms.Spectrum(
+            mz=np.array([10, 40, 60], dtype=float),
+            intensities=np.array([0.1, 0.2, 1.0], dtype=float),
+            metadata={"precursor_mz": 100.0},
+        ),
+        matchms.Spectrum(
+            mz=np.array([10, 45, 60], dtype=float),
+            intensities=np.array([0.1, 0.3, 1.0], dtype=float),
+            metadata={"precursor_mz": 105.0},
+        ),
+    ]
+
+
+class CountingEmbedder:
+    def __init__(self):
+        self.nr_embedded = 0
+
+    def __call__(self, spectra):
+        self.nr_embedded += len(spectra)
+        return np.array(
+            [[s.peaks.mz.sum(), s.peaks.intensities.sum()] for s in spectra]
+        )
+
+
+def test_filepath_valid(tmp_path):
+    library_file = tmp_path.joinpath("lib.mgf")
+    library_file.touch()
+    assert LibraryEmbeddings(location=tmp_path, file_hash="abc").filepath() == (
+        tmp_path.joinpath("ms2deepscore_embeddings.npz")
+    )
+    assert LibraryEmbeddings(location=library_file, file_hash="abc").filepath() == (
+        tmp_path.joinpath("lib.mgf.ms2deepscore.npz")
+    )
+
+
+def test_get_vectors_stored(spectra, tmp_path):
+    embed = CountingEmbedder()
+    first = (
+        LibraryEmbeddings(location=tmp_path, file_hash="abc")
+        .load()
+        .get_vectors(spectra, embed)
+    )
+    second = (
+        LibraryEmbeddings(location=tmp_path, file_hash="abc")
+        .load()
+        .get_vectors([spectra[1], spectra[0]], embed)
+    )
+    assert embed.nr_embedded == 2
+    assert np.allclose(first, second[::-1])
+
+
+def test_get_vectors_added(spectra, tmp_path):
+    embed = CountingEmbedder()
+    LibraryEmbeddings(location=tmp_path, file_hash="abc").load().get_vectors(
+        spectra[:1], embed
+    )
+    embeddings = LibraryEmbeddings(location=tmp_path, file_hash="abc").load()
+    embeddings.get_vectors(spectra, embed)
+    assert embed.nr_embedded == 2
+    assert len(LibraryEmbeddings(location=tmp_path, file_hash="abc").load().keys) == 2
+
+
+def test_load_other_model(spectra, tmp_path):
+    LibraryEmbeddings(location=tmp_path, file_hash="abc").load().get_vectors(
+        spectra, CountingEmbedder()
+    )
+    embeddings = LibraryEmbeddings(location=tmp_path, file_hash="def").load()
+    assert embeddings.vectors is None
+    assert embeddings.keys == {}
+
+
+def test_ivf_index_stored(spectra, tmp_path):
+    embeddings = LibraryEmbeddings(location=tmp_path, file_hash="abc").load()
+    vectors = embeddings.get_vectors(spectra, CountingEmbedder())
+    vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    embeddings.ivf_index(spectra, vectors)
+    assert tmp_path.joinpath("ms2deepscore_ivf.npz").exists()
+    index = embeddings.ivf_index(spectra, vectors)
+    assert index.centroids is not None
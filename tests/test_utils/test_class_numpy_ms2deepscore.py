@@ -0,0 +1,99 @@
+import h5py
+import matchms
+import numpy as np
+import pytest
+
+from fermo_core.utils.class_numpy_ms2deepscore import NumpyMS2DeepScore
+
+
+@pytest.fixture
+def spectra():
+    return [
+        matchms.Spectrum(
+            mz=np.array([5, 25, 27, 400], dtype=float),
+            intensities=np.array([0.25, 0.16, 0.04, 1.0], dtype=float),
+            metadata={"precursor_mz": 500.0},
+        ),
+        matchms.Spectrum(
+            mz=np.array([30, 45, 600], dtype=float),
+            intensities=np.array([0.1, 0.3, 1.0], dtype=float),
+            metadata={"precursor_mz": 700.0},
+        ),
+    ]
+
+
+def test_load_valid(ms2deepscore_model_file):
+    model = NumpyMS2DeepScore().load(ms2deepscore_model_file)
+    assert model.input_dim == 99
+    assert model.output_vector_dim == 4
+    assert [kind for kind, params in model.layers] == ["dense", "batchnorm", "dense"]
+
+
+def test_load_additional_metadata_invalid(ms2deepscore_model_file):
+    with h5py.File(ms2deepscore_model_file, "r+") as outfile:
+        outfile.attrs["spectrum_binner"] = outfile.attrs["spectrum_binner"].replace(
+            '"additional_metadata": []', '"additional_metadata": [["x", {}]]'
+        )
+    with pytest.raises(RuntimeError):
+        NumpyMS2DeepScore().load(ms2deepscore_model_file)
+
+
+def test_bin_spectra_valid(ms2deepscore_model_file, spectra):
+    vectors = NumpyMS2DeepScore().load(ms2deepscore_model_file).bin_spectra(spectra)
+    assert vectors.shape == (2, 99)
+    # in-range peaks take the weights of the first peaks, as in ms2deepscore
+    assert vectors[0, 1] == pytest.approx(0.5)
+    assert vectors[0, 39] == pytest.approx(0.2)
+    assert vectors[1, 59] == pytest.approx(1.0)
+    assert np.count_nonzero(vectors) == 5
+
+
+def test_bin_spectra_no_peaks_invalid(ms2deepscore_model_file):
+    spectrum = matchms.Spectrum(
+        mz=np.array([5.0]), intensities=np.array([1.0]), metadata={}
+    )
+    with pytest.raises(RuntimeError):
+        NumpyMS2DeepScore().load(ms2deepscore_model_file).bin_spectra([spectrum])
+
+
+def test_bin_spectra_unknown_invalid(ms2deepscore_model_file, spectra):
+    model = NumpyMS2DeepScore().load(ms2deepscore_model_file)
+    model.bin_ids = model.bin_ids[:50]
+    model.bin_positions = model.bin_positions[:50]
+    with pytest.raises(RuntimeError):
+        model.bin_spectra(spectra)
+
+
+def test_calculate_vectors_batches_valid(ms2deepscore_model_file, spectra):
+    model = NumpyMS2DeepScore().load(ms2deepscore_model_file)
+    expected = model.calculate_vectors(spectra)
+    model.batch_size = 1
+    assert expected.shape == (2, 4)
+    assert np.allclose(model.calculate_vectors(spectra), expected)
+
+
+@pytest.mark.slow
+def test_calculate_vectors_vs_keras(tmp_path):
+    from ms2deepscore import MS2DeepScore, SpectrumBinner
+    from ms2deepscore.models import SiameseModel, load_model
+
+    rng = np.random.default_rng(0)
+    spectra = [
+        matchms.Spectrum(
+            mz=np.sort(rng.uniform(10, 990, 40)),
+            intensities=rng.uniform(0, 1, 40),
+            metadata={"precursor_mz": 990.0, "inchikey": f"{i:014d}"},
+        )
+        for i in range(50)
+    ]
+    binner = SpectrumBinner(200, mz_min=10.0, mz_max=1000.0, peak_scaling=0.5)
+    binner.fit_transform(spectra, progress_bar=False)
+    SiameseModel(binner, base_dims=(32, 32), embedding_dim=16).save(
+        tmp_path.joinpath("model.hdf5")
+    )
+
+    expected = MS2DeepScore(
+        load_model(tmp_path.joinpath("model.hdf5")), progress_bar=False
+    ).calculate_vectors(spectra)
+    vectors = NumpyMS2DeepScore().load(tmp_path.joinpath("model.hdf5"))
+    assert np.allclose(vectors.calculate_vectors(spectra), expected, atol=10**-5)
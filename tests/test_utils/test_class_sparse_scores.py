@@ -0,0 +1,27 @@
+import numpy as np
+
+from fermo_core.utils.class_sparse_scores import SparseScores
+
+
+def test_append_finalize_valid():
+    scores = SparseScores(ids=["1", "2", "3"], score_cutoff=0.7)
+    scores.append(np.array([0, 1, 1]), np.array([1, 0, 2]), np.array([0.8, 0.8, 0.5]))
+    scores.append(np.array([0, 2]), np.array([2, 2]), np.array([0.9, 1.0]))
+    scores.finalize()
+    assert scores.rows.tolist() == [0, 0]
+    assert scores.cols.tolist() == [1, 2]
+    assert scores.scores.dtype == np.float32
+    assert scores.blocks == []
+
+
+def test_finalize_empty():
+    scores = SparseScores(ids=["1"], score_cutoff=0.7).finalize()
+    assert len(scores.rows) == 0
+
+
+def test_finalize_duplicates_valid():
+    scores = SparseScores(ids=["1", "2", "3"], score_cutoff=0.7)
+    scores.append(np.array([2, 0]), np.array([0, 1]), np.array([0.8, 0.9]))
+    scores.append(np.array([0]), np.array([2]), np.array([0.8]))
+    scores.finalize()
+    assert list(zip(scores.rows.tolist(), scores.cols.tolist())) == [(0, 1), (0, 2)]
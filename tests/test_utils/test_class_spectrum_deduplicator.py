@@ -0,0 +1,74 @@
+import matchms
+import numpy as np
+import pytest
+
+from fermo_core.utils.class_sparse_scores import SparseScores
+from fermo_core.utils.class_spectrum_deduplicator import SpectrumDeduplicator
+
+
+def spectrum(mz: list, intensities: list, precursor_mz: float) -> matchms.Spectrum:
+    return matchms.Spectrum(
+        mz=np.array(mz, dtype=float),
+        intensities=np.array(intensities, dtype=float),
+        metadata={"precursor_mz": precursor_mz},
+        metadata_harmonization=False,
+    )
+
+
+@pytest.fixture
+def spectra():
+    return [
+        spectrum([50, 80, 120], [1.0, 0.5, 0.2], 200.0),
+        spectrum([60, 90, 150], [1.0, 0.3, 0.7], 250.0),
+        spectrum([50, 80, 120], [1.0, 0.5, 0.2], 200.0),
+        spectrum([50, 80, 120], [1.0, 0.5, 0.2], 300.0),
+        spectrum([50, 80, 120.02], [1.0, 0.5, 0.21], 200.0),
+    ]
+
+
+def test_group_valid(spectra):
+    rep = SpectrumDeduplicator().group(spectra)
+    assert rep.tolist() == [0, 1, 0, 0, 4]
+
+
+def test_group_metadata_valid(spectra):
+    rep = SpectrumDeduplicator().group(spectra, ("precursor_mz",))
+    assert rep.tolist() == [0, 1, 0, 3, 4]
+
+
+def test_group_near_duplicates_valid(spectra):
+    rep = SpectrumDeduplicator(min_cosine=0.99).group(spectra)
+    assert rep.tolist() == [0, 1, 0, 0, 0]
+
+
+def test_group_near_duplicates_metadata_valid(spectra):
+    spectra.append(spectrum([50, 80, 120.02], [1.0, 0.5, 0.21], 300.05))
+    rep = SpectrumDeduplicator(min_cosine=0.99).group(spectra, ("precursor_mz",))
+    assert rep.tolist() == [0, 1, 0, 3, 0, 3]
+
+
+def test_metadata_values_non_numeric(spectra):
+    spectra[0].set("ionmode", "positive")
+    values = SpectrumDeduplicator.metadata_values(spectra[:2], "ionmode")
+    assert values.tolist() == ["'positive'", "None"]
+
+
+def test_fan_out_valid():
+    scores = SparseScores(ids=[10, 11], score_cutoff=0.7)
+    scores.append(np.array([0]), np.array([1]), np.array([0.8]))
+    scores.finalize()
+    result = SpectrumDeduplicator.fan_out(
+        scores, [10, 11, 12, 13], np.array([0, 1, 0, 1])
+    )
+    pairs = dict(zip(zip(result.rows.tolist(), result.cols.tolist()), result.scores))
+    assert sorted(pairs) == [(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)]
+    assert pairs[(0, 2)] == pytest.approx(1.0)
+    assert pairs[(2, 3)] == pytest.approx(0.8)
+
+
+def test_unique_pairs_valid(spectra):
+    ref, query, inverse = SpectrumDeduplicator().unique_pairs(
+        spectra, np.array([5, 5, 6, 5]), np.array([0, 2, 2, 1])
+    )
+    assert list(zip(ref.tolist(), query.tolist())) == [(5, 0), (5, 1), (6, 0)]
+    assert inverse.tolist() == [0, 0, 2, 1]
@@ -32,6 +32,34 @@ def test_download_file_timeout():
         )
 
 
+def test_match_masses_ppm_valid():
+    q_idx, r_idx, ppm = UtilityMethodManager.match_masses_ppm(
+        queries=np.array([100.0, 200.001, 300.0]),
+        refs=np.array([100.0005, 200.0, 250.0]),
+        mass_dev_ppm=10.0,
+    )
+    assert list(q_idx) == [0, 1]
+    assert list(r_idx) == [0, 1]
+    assert ppm[1] == UtilityMethodManager.mass_deviation(200.001, 200.0, 1)
+
+
+def test_match_masses_ppm_empty():
+    q_idx, r_idx, ppm = UtilityMethodManager.match_masses_ppm(
+        queries=np.array([]), refs=np.array([100.0]), mass_dev_ppm=10.0
+    )
+    assert len(q_idx) == 0
+
+
+def test_precursor_window_pairs_valid():
+    ref_idx, query_idx = UtilityMethodManager.precursor_window_pairs(
+        ref_mz=np.array([300.0, 100.0, 102.0, np.nan]),
+        query_mz=np.array([101.0, 500.0, 299.0]),
+        max_diff=1.0,
+    )
+    assert list(query_idx) == [0, 0, 2]
+    assert list(ref_idx) == [1, 2, 0]
+
+
 def test_create_spectrum_object_valid():
     spectrum = UtilityMethodManager.create_spectrum_object(
         {